@@ -1,67 +1,36 @@
 # -*- coding: utf-8 -*-
-import time, calendar
+import functools, os, time
 from datetime import datetime, timedelta, date
-from typing import Dict, Any, List, Optional
+from typing import Dict
 import pandas as pd
 import streamlit as st
+from walking_buddies import probes, routes
+from walking_buddies.core import (BLOCKED, REWARD_CATALOG, ROLES, open_engine, tier_for_points, total_calories, total_miles, total_walks)
 
 APP_NAME = "Walking Buddies"
+DB_PATH = os.environ.get("WALKING_BUDDIES_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "walking_buddies.db"))
+JOURNAL_DIR = os.environ.get("WALKING_BUDDIES_JOURNAL", DB_PATH + ".events")   # empty disables the event journal
+RENDER_ALL_TABS = os.environ.get("WALKING_BUDDIES_ALL_TABS", "") == "1"   # classic st.tabs layout: every tab built on every rerun
+DIAGNOSTICS = os.environ.get("WALKING_BUDDIES_DIAGNOSTICS", "") == "1"   # show the Diagnostics tab (or open the app with ?diagnostics=1)
 st.set_page_config(page_title=APP_NAME, page_icon="👟", layout="wide")
+probes.RECORDER.begin_run("script")   # no-op unless timings are being recorded
 
 # =========================
-# Session State & Defaults
+# Engine & Session State
 # =========================
+@st.cache_resource
+def _get_engine():
+    # One engine (store, shared state and its indexes) per process; every session reads and writes through it.
+    # The domain logic lives in walking_buddies.core; this script is only its UI. Notices such as awarded points
+    # become toasts in whichever session caused them; the reminder timer thread runs once per process.
+    engine = open_engine(DB_PATH, JOURNAL_DIR or None, notify=lambda message: st.toast(message))
+    engine.reminder_scheduler.start()
+    return engine
+
 def _ensure_state():
+    # Per-session UI state only; shared data is on the engine
     ss = st.session_state
-    ss.setdefault("users", {})
-    ss.setdefault("teams", {})  # team -> {"captain": uid, "members": set(), "roles": {uid: "Captain|Co-Captain|Player"}, ...}
     ss.setdefault("invites", [])
-    ss.setdefault("routes", [])
-    ss.setdefault("messages", [])
-    ss.setdefault("photos", [])   # [{'user_id','miles','notes','ts','audience'}]
-    ss.setdefault("reminders", {
-        "walk_enabled": True, "walk_every_min": 120,
-        "stand_enabled": True, "stand_every_min": 30,
-        "next_walk_at": None, "next_stand_at": None, "snooze_minutes": 10,
-    })
-    # Built-in challenge catalog
-    ss.setdefault("challenge_catalog", [
-        {"id":"daily_5000","name":"Daily Step Goal","desc":"Hit 5,000 steps today","type":"daily_steps","target":5000,"period":"daily","reward_points":50},
-        {"id":"weekend_walkathon","name":"Weekend Walkathon","desc":"Walk 10 miles Sat–Sun","type":"distance_period","target_miles":10.0,"period":"weekend","reward_points":150},
-        {"id":"photo_share","name":"Photo Challenge","desc":"Share a scenic walk photo this week","type":"boolean_weekly","target":1,"period":"weekly","reward_points":20},
-        {"id":"invite_3","name":"Invite Challenge","desc":"Invite 3 friends this month","type":"count_monthly","target":3,"period":"monthly","reward_points":100},
-        {"id":"team_100_miles","name":"Team Mileage Goal","desc":"Teams aim for 100 miles combined this week","type":"team_distance_weekly","target_miles":100.0,"period":"weekly","reward_points":300},
-        {"id":"relay_pass_baton","name":"Relay Challenge","desc":"Each member walks 2 miles this week","type":"team_each_member_distance_weekly","target_miles":2.0,"period":"weekly","reward_points":200},
-        {"id":"city_explorer","name":"City Explorer","desc":"Walk 5 distinct neighborhoods this month","type":"distinct_routes_monthly","target_count":5,"period":"monthly","reward_points":120},
-    ])
-    # Personalized
-    ss.setdefault("custom_challenges", [])         # list of challenge dicts created by users
-    ss.setdefault("user_challenges", {})           # {uid: {challenge_id: {"joined":bool,"completed":bool,"last_reset":periodKey}}}
-    # Team battles
-    ss.setdefault("team_battles", [])              # list of {'name','home','away','start','end','reward_points','winner':None}
-    ss.setdefault("reward_catalog", [
-        {"id":"badge_10_walks","type":"badge","name":"First 10 Walks","cost":0,"desc":"Milestone badge after 10 walks"},
-        {"id":"badge_100_miles","type":"badge","name":"100 Miles Club","cost":0,"desc":"Milestone badge after 100 miles"},
-        {"id":"coupon_sneakers","type":"coupon","name":"Sneaker Discount $10","cost":300,"desc":"$10 off partner sneakers"},
-        {"id":"coupon_cafe","type":"coupon","name":"Local Cafe $5","cost":150,"desc":"$5 voucher at partner cafe"},
-        {"id":"giftcard","type":"gift","name":"Gift Card $20","cost":800,"desc":"Generic gift card"},
-        {"id":"premium_challenge","type":"unlock","name":"Exclusive Challenge Pack","cost":400,"desc":"Unlock premium challenge set"},
-    ])
-    ss.setdefault("badges", {})
-    ss.setdefault("privacy_defaults", {
-        "profileVisibility": "private",  # private | friends | team | public
-        "showCity": True,
-        "showCompany": False,
-        "leaderboards": {"public": False, "alias": "", "teamVisible": True},
-        "discoverability": {"byCity": True, "byCompany": False},
-        "routes": {"defaultShare": "private"},  # private | friends | team | public
-        "photos": {"defaultAudience": "friends", "stripEXIF": True, "autoExpireDays": 365},
-        "messaging": {"allowRequests": "friends_of_friends", "readReceipts": False, "blocked": []},
-        "notifications": {"genericContent": True, "quietHours": "22:00-07:00"},
-        "health": {"appleHealth": {"steps": True, "distance": False}, "googleFit": {"steps": True}},
-        "analytics": {"crash": True, "performance": True, "researchProgram": False},
-        "security": {"appLock": False, "twoFA": False},
-    })
     # Timer
     ss.setdefault("timer_running", False)
     ss.setdefault("timer_started_at", None)
@@ -85,380 +54,56 @@ def _ensure_state():
         "Make sidewalks your superpower."
     ])
 
+engine = _get_engine()
 _ensure_state()
 
-POINT_RULES = {"base_per_minute":1,"streak_7":10,"streak_30":50,"group_walk_bonus":20,"invite_bonus":50,"photo_share":5}
-TIERS=[("Platinum",5000),("Gold",1000),("Silver",500),("Bronze",0)]
-ROLES=["Captain","Co-Captain","Player"]
-
-# =========================
-# Helpers & User Model
-# =========================
-def ensure_user(uid: str, name: Optional[str]=None)->Dict[str,Any]:
-    user = st.session_state.users.setdefault(uid, {
-        "name": name or uid, "points":0, "team":None, "company":"", "city":"", "available_times":"Mornings",
-        "buddies": set(), "walk_dates":[], "steps_log":{}, "minutes_log":{}, "distance_miles_log":{},
-        "calories_log":{},
-        "photos_this_week":0, "invites_this_month":0, "routes_completed_month": set(), "mood_log":{}, "avatar_level":1,
-        "privacy": st.session_state.privacy_defaults.copy()
-    })
-    if "privacy" not in user: user["privacy"] = st.session_state.privacy_defaults.copy()
-    if "calories_log" not in user: user["calories_log"] = {}
-    return user
-
-def calc_streak(dates: List[datetime])->int:
-    if not dates: return 0
-    ds = sorted({d.date() for d in dates}, reverse=True)
-    streak = 0; today = date.today()
-    for d in ds:
-        if d == today - timedelta(days=streak): streak += 1
-        elif d < today - timedelta(days=streak): break
-    return streak
-
-def tier_for_points(p:int)->str:
-    for name, th in TIERS:
-        if p>=th: return name
-    return "Bronze"
-
-def total_walks(u): return len(u.get("walk_dates",[]))
-def total_miles(u): return sum(float(v) for v in u.get("distance_miles_log",{}).values())
-def total_calories(u): return sum(int(v) for v in u.get("calories_log",{}).values())
-
-def add_points(uid, pts, reason=""):
-    u=ensure_user(uid,uid); u["points"]=int(u.get("points",0))+int(pts)
-    if reason: st.toast(f"+{pts} pts: {reason}")
-
-def evolve_avatar(user_id: str):
-    u = ensure_user(user_id, user_id)
-    miles = total_miles(u); streak = calc_streak(u["walk_dates"])
-    level = 1
-    if miles >= 50 or streak >= 14: level = 2
-    if miles >= 150 or streak >= 30: level = 3
-    if miles >= 300 or streak >= 60: level = 4
-    u["avatar_level"] = level
-
-def check_and_award_badges(user_id: str):
-    u = ensure_user(user_id, user_id)
-    b = st.session_state.badges.setdefault(user_id, set())
-    if total_walks(u) >= 10: b.add("badge_10_walks")
-    if total_miles(u) >= 100.0: b.add("badge_100_miles")
-    evolve_avatar(user_id)
-
-# Privacy helpers
-def is_friend(a,b)->bool:
-    ua = ensure_user(a, a); return b in ua.get("buddies", set())
-def same_team(a,b)->bool:
-    ua, ub = ensure_user(a, a), ensure_user(b, b)
-    return ua.get("team") and ua.get("team")==ub.get("team")
-def can_view_profile(owner_id: str, viewer_id: str)->bool:
-    if owner_id == viewer_id: return True
-    p = ensure_user(owner_id)["privacy"].get("profileVisibility","private")
-    if p == "public": return True
-    if p == "team": return same_team(owner_id, viewer_id)
-    if p == "friends": return is_friend(owner_id, viewer_id)
-    return False
-
-# =========================
-# Challenges Engine (Built-in + Personalized)
-# =========================
-def _period_key(period: str)->str:
-    today = date.today()
-    if period == "daily":
-        return today.isoformat()
-    if period == "weekly":
-        y, w, _ = today.isocalendar()
-        return f"{y}-W{w:02d}"
-    if period == "weekend":
-        wd = today.weekday()
-        saturday = today + timedelta(days=(5 - wd)) if wd <= 5 else today - timedelta(days=(wd - 5))
-        return f"weekend-{saturday.isoformat()}"
-    if period == "monthly":
-        return f"{today.year}-{today.month:02d}"
-    return "alltime"
-
-def get_challenge_by_id(ch_id: str):
-    for c in st.session_state.challenge_catalog:
-        if c["id"] == ch_id:
-            return c
-    for c in st.session_state.custom_challenges:
-        if c["id"] == ch_id:
-            return c
-    return None
-
-def _ensure_user_challenge(uid: str, ch_id: str):
-    uc = st.session_state.user_challenges.setdefault(uid, {})
-    if ch_id not in uc:
-        uc[ch_id] = {"joined": False, "completed": False, "last_reset": None}
-    ch = get_challenge_by_id(ch_id)
-    if ch:
-        p = ch.get("period","weekly")
-        key=_period_key(p)
-        if uc[ch_id]["last_reset"] != key:
-            uc[ch_id]["completed"] = False
-            uc[ch_id]["last_reset"] = key
-    return uc[ch_id]
-
-def _dates_for_period(period) -> List[str]:
-    today = date.today()
-    if period == "daily":
-        return [today.isoformat()]
-    if period == "weekly":
-        y, w, _ = today.isocalendar()
-        monday = date.fromisocalendar(y, w, 1)
-        return [(monday + timedelta(days=i)).isoformat() for i in range(7)]
-    if period == "monthly":
-        start = date(today.year, today.month, 1)
-        days = calendar.monthrange(today.year, today.month)[1]
-        return [(start + timedelta(days=i)).isoformat() for i in range(days)]
-    if period == "weekend":
-        wd = today.weekday()
-        saturday = today + timedelta(days=(5 - wd)) if wd <= 5 else today - timedelta(days=(wd - 5))
-        return [saturday.isoformat(), (saturday + timedelta(days=1)).isoformat()]
-    return [today.isoformat()]
-
-def _sum_steps_period(u, period):
-    return sum(int(u["steps_log"].get(d, 0)) for d in _dates_for_period(period))
-
-def _sum_minutes_period(u, period):
-    return sum(int(u["minutes_log"].get(d, 0)) for d in _dates_for_period(period))
-
-def _sum_miles_period(u, period):
-    return sum(float(u["distance_miles_log"].get(d, 0.0)) for d in _dates_for_period(period))
-
-def _count_walks_period(u, period):
-    ds = set(_dates_for_period(period))
-    return sum(1 for dt in u.get("walk_dates", []) if dt.date().isoformat() in ds)
-
-def join_challenge(uid, ch_id):
-    _ensure_user_challenge(uid, ch_id)["joined"]=True
-    st.success("Joined challenge!")
-
-def leave_challenge(uid, ch_id):
-    _ensure_user_challenge(uid, ch_id)["joined"]=False
-    st.info("Left challenge.")
-
-def complete_challenge_if_eligible(uid, ch):
-    uc = _ensure_user_challenge(uid, ch["id"])
-    if uc["completed"] or not uc["joined"]:
-        return False
-    u = ensure_user(uid, uid)
-    # Built-ins
-    if ch["id"] == "daily_5000":
-        if int(u["steps_log"].get(date.today().isoformat(), 0)) >= int(ch["target"]):
-            uc["completed"] = True; add_points(uid, ch["reward_points"], ch["name"]); return True
-    elif ch["id"] == "weekend_walkathon":
-        wd=date.today().weekday()
-        saturday = date.today()+timedelta(days=(5-wd)) if wd<=5 else date.today()-timedelta(days=(wd-5))
-        sunday = saturday+timedelta(days=1)
-        total=float(u["distance_miles_log"].get(saturday.isoformat(),0.0))+float(u["distance_miles_log"].get(sunday.isoformat(),0.0))
-        if total >= float(ch["target_miles"]):
-            uc["completed"] = True; add_points(uid, ch["reward_points"], ch["name"]); return True
-    elif ch["id"] == "photo_share":
-        if int(u.get("photos_this_week", 0)) >= 1:
-            uc["completed"] = True; add_points(uid, ch["reward_points"], ch["name"]); return True
-    elif ch["id"] == "invite_3":
-        if int(u.get("invites_this_month", 0)) >= int(ch["target"]):
-            uc["completed"] = True; add_points(uid, ch["reward_points"], ch["name"]); return True
-    elif ch["id"] == "city_explorer":
-        if len(u.get("routes_completed_month", set())) >= int(ch["target_count"]):
-            uc["completed"] = True; add_points(uid, ch["reward_points"], ch["name"]); return True
-    # Personalized
-    if ch.get("custom", False):
-        metric=ch.get("metric","steps"); period=ch.get("period","weekly"); target=float(ch.get("target_value",0))
-        if metric == "steps": val = _sum_steps_period(u, period)
-        elif metric == "minutes": val = _sum_minutes_period(u, period)
-        elif metric == "miles": val = _sum_miles_period(u, period)
-        elif metric == "walks": val = _count_walks_period(u, period)
-        else: val = 0.0
-        if val >= target:
-            uc["completed"]=True; add_points(uid, int(ch.get("reward_points",0)), ch["name"]); return True
-    return False
-
-def update_challenges_after_walk(uid):
-    for ch in (st.session_state.challenge_catalog + st.session_state.custom_challenges):
-        _ensure_user_challenge(uid, ch["id"])
-        complete_challenge_if_eligible(uid, ch)
-
-# =========================
-# Logging & Points
-# =========================
-def award_walk(uid, minutes, steps, miles, calories, is_group, shared_photo, mood=None):
-    u=ensure_user(uid,uid); today=date.today().isoformat()
-    # append walk and logs
-    u["walk_dates"].append(datetime.now())
-    u["minutes_log"][today]=int(u["minutes_log"].get(today,0))+int(minutes)
-    u["steps_log"][today]=int(u["steps_log"].get(today,0))+int(steps)
-    u["distance_miles_log"][today]=float(u["distance_miles_log"].get(today,0.0))+float(miles)
-    u["calories_log"][today]=int(u["calories_log"].get(today,0))+int(calories)
-    # points
-    gained=int(minutes)*POINT_RULES["base_per_minute"]
-    if is_group: gained+=POINT_RULES["group_walk_bonus"]
-    if shared_photo:
-        gained+=POINT_RULES["photo_share"]
-        u["photos_this_week"]=int(u.get("photos_this_week",0))+1
-        audience = u.get("privacy",{}).get("photos",{}).get("defaultAudience","friends")
-        st.session_state.photos.append({"user_id": uid, "miles": miles, "notes": "Shared a scenic photo", "ts": datetime.now().isoformat(timespec="seconds"), "audience": audience})
-    s=calc_streak(u["walk_dates"])
-    if s>=30: gained+=POINT_RULES["streak_30"]
-    elif s>=7: gained+=POINT_RULES["streak_7"]
-    u["points"]=int(u.get("points",0))+gained
-    # mood
-    if mood: u["mood_log"][today]=mood
-    check_and_award_badges(uid)
-    update_challenges_after_walk(uid)
-    return gained, u["points"], s
-
-# =========================
-# Simple routes & messaging helpers
-# =========================
-def add_route(uid, name, distance_km, notes, audience):
-    st.session_state.routes.append({"user_id": uid, "name": name, "distance_km": float(distance_km), "notes": notes, "created_at": datetime.now().isoformat(timespec="seconds"), "audience": audience})
-    u = ensure_user(uid, uid); u["routes_completed_month"].add(name)
-
-def list_routes(uid): return [r for r in st.session_state.routes if r["user_id"] == uid]
-
-def delete_route(uid, name):
-    st.session_state.routes = [
-        r for r in st.session_state.routes
-        if not (r["user_id"] == uid and r["name"] == name)
-    ]
-
-def send_message(sender_id, recipient_id, text):
-    # Respect messaging privacy: block list + who can message
-    recip = ensure_user(recipient_id)
-    msg_policy = recip.get("privacy",{}).get("messaging",{"allowRequests":"friends_of_friends","blocked":[]})
-    if sender_id in msg_policy.get("blocked",[]):
-        st.error("You can't message this user."); return
-    allow = msg_policy.get("allowRequests","friends_of_friends")
-    ok = False
-    if allow == "anyone": ok = True
-    elif allow == "friends_of_friends":
-        # simple check: friend or shares any buddy in common
-        su = ensure_user(sender_id); ok = (recipient_id in su.get("buddies", set())) or (len(su.get("buddies", set()).intersection(ensure_user(recipient_id).get("buddies", set())))>0)
-    elif allow == "friends_only":
-        ok = sender_id in ensure_user(recipient_id).get("buddies", set())
-    if not ok:
-        st.warning("Message request not allowed by recipient's privacy settings."); return
-    st.session_state.messages.append({"from": sender_id, "to": recipient_id, "text": text, "ts": datetime.now().isoformat(timespec="seconds")})
-
-def get_conversation(a,b):
-    msgs = [m for m in st.session_state.messages if (m["from"]==a and m["to"]==b) or (m["from"]==b and m["to"]==a)]
-    msgs.sort(key=lambda x: x["ts"]); return msgs
-
-# =========================
-# Leaderboards (privacy-aware)
-# =========================
-def leaderboard_display_name(u: Dict[str,Any])->str:
-    lb = u.get("privacy",{}).get("leaderboards", {})
-    alias = (lb.get("alias") or "").strip()
-    if alias: return alias
-    name = (u.get("name") or "User").strip()
-    parts = name.split()
-    if len(parts)>=2: return f"{parts[0]} {parts[1][0]}."
-    return name
-
-def get_leaderboards(viewer_id: str):
-    users=st.session_state.users; rows=[]; team_points={}
-    for uid,u in users.items():
-        lb = u.get("privacy",{}).get("leaderboards", {"public": False, "teamVisible": True})
-        include_public = bool(lb.get("public", False))
-        same_team_ok = same_team(uid, viewer_id) and bool(lb.get("teamVisible", True))
-        if not (include_public or same_team_ok or uid==viewer_id):
-            continue
-        display = leaderboard_display_name(u)
-        rows.append({"user":display,"points":int(u.get("points",0)),"team":u.get("team") or ""})
-        if u.get("team"): team_points[u["team"]] = team_points.get(u["team"],0) + int(u.get("points",0))
-
-    users_df=pd.DataFrame(rows, columns=["user","points","team"])
-    if not users_df.empty: users_df=users_df.sort_values("points",ascending=False).reset_index(drop=True)
-    teams_df=pd.DataFrame([{"team":k,"points":v} for k,v in team_points.items()], columns=["team","points"])
-    if not teams_df.empty: teams_df=teams_df.sort_values("points",ascending=False).reset_index(drop=True)
-
-    team_member_rows=[]
-    for tname, tinfo in st.session_state.teams.items():
-        for member in sorted(list(tinfo.get("members", set()))):
-            u = ensure_user(member, member)
-            lb = u.get("privacy",{}).get("leaderboards", {"public": False, "teamVisible": True})
-            include_public = bool(lb.get("public", False))
-            same_team_ok = same_team(member, viewer_id) and bool(lb.get("teamVisible", True))
-            if not (include_public or same_team_ok or member==viewer_id):
-                continue
-            role = tinfo.get("roles", {}).get(member, "Player")
-            team_member_rows.append({"team": tname, "user": leaderboard_display_name(u), "points": int(u.get("points",0)), "role": role})
-    team_members_df = pd.DataFrame(team_member_rows, columns=["team","user","points","role"])
-    if not team_members_df.empty: team_members_df = team_members_df.sort_values(["team","role","points"], ascending=[True, True, False]).reset_index(drop=True)
-
-    return users_df, teams_df, team_members_df
-
 # =========================
-# Team Battles (Community)
+# Views (DataFrames over engine rows, memoized with them)
 # =========================
-def _sum_team_miles_for_range(team_name: str, start_iso: str, end_iso: str)->float:
-    start_d = date.fromisoformat(start_iso); end_d = date.fromisoformat(end_iso)
-    total = 0.0
-    team = st.session_state.teams.get(team_name, {"members": set()})
-    for uid in team.get("members", set()):
-        u = ensure_user(uid, uid)
-        for d_str, miles in u.get("distance_miles_log", {}).items():
-            try:
-                dd = date.fromisoformat(d_str)
-                if start_d <= dd <= end_d:
-                    total += float(miles)
-            except Exception:
-                pass
-    return total
-
-def compute_battle_score(battle: Dict[str,Any])->Dict[str,Any]:
-    home = battle["home"]; away = battle["away"]
-    start = battle["start"]; end = battle["end"]
-    home_m = _sum_team_miles_for_range(home, start, end)
-    away_m = _sum_team_miles_for_range(away, start, end)
-    winner = None
-    if home_m > away_m: winner = home
-    elif away_m > home_m: winner = away
-    return {"home_miles": home_m, "away_miles": away_m, "winner": winner}
-
-def award_battle_points(battle: Dict[str,Any]):
-    if battle.get("winner_awarded"): return
-    res = compute_battle_score(battle)
-    winner = res["winner"]
-    if not winner: return
-    pts = int(battle.get("reward_points", 200))
-    team = st.session_state.teams.get(winner, {"members": set()})
-    for uid in team.get("members", set()):
-        add_points(uid, pts//max(1,len(team.get("members", set()))), f"Team Battle win: {battle['name']}")
-    battle["winner_awarded"] = True
-
-# =========================
-# Reminders
-# =========================
-def init_reminders():
-    r=st.session_state.reminders; now=datetime.now()
-    if r.get("next_walk_at") is None and r.get("walk_enabled",True): r["next_walk_at"]=now+timedelta(minutes=int(r.get("walk_every_min",120)))
-    if r.get("next_stand_at") is None and r.get("stand_enabled",True): r["next_stand_at"]=now+timedelta(minutes=int(r.get("stand_every_min",30)))
-
+def get_leaderboards(viewer_id: str, page: int = 0):
+    def frames():
+        users, teams, members = engine.get_leaderboards(viewer_id, page)
+        return (pd.DataFrame(users, columns=["rank","user","points","team"]), pd.DataFrame(teams, columns=["rank","team","points"]),
+                pd.DataFrame(members, columns=["team","user","points","role"]))
+    return engine.memo_view(("leaderboard_frames", viewer_id, page), frames)
+
+def my_leaderboard_position(viewer_id: str):
+    def frame():
+        rank, size, around = engine.my_leaderboard_position(viewer_id)
+        return rank, size, pd.DataFrame(around, columns=["rank","user","points"])
+    return engine.memo_view(("position_frame", viewer_id), frame)
+
+def activity_trend(scope: str, key: str, grain: str, periods: int = 12):
+    # Period totals for the Dashboard charts, indexed by period start
+    def frame():
+        return pd.DataFrame(engine.activity_trend(scope, key, grain, periods)).set_index("period")
+    return engine.memo_view(("trend_frame", scope, key, grain, periods, date.today()), frame)
+
+@probes.timed
 def check_and_display_reminders():
-    r=st.session_state.reminders; now=datetime.now()
-    if r.get("walk_enabled") and r.get("next_walk_at") and now>=r["next_walk_at"]:
+    sched=engine.reminder_scheduler; pending=sched.sink.pending(user_id); r=engine.reminder_settings(user_id)
+    if "walk" in pending:
         st.warning("🚶 Time for a walk reminder!")
         c1,c2,c3=st.columns(3)
         if c1.button("Start Walk Now"):
-            r["next_walk_at"]=now+timedelta(minutes=int(r.get("walk_every_min",120)))
+            sched.complete(user_id,"walk"); sched.sink.ack(user_id,"walk")
             st.success("Open the Log tab to record it.")
-        if c2.button("Snooze 10 min"):
-            r["next_walk_at"]=now+timedelta(minutes=int(r.get("snooze_minutes",10)))
+        if c2.button(f"Snooze {int(r.get('snooze_minutes',10))} min"):
+            sched.snooze(user_id,"walk",int(r.get("snooze_minutes",10))); sched.sink.ack(user_id,"walk")
             st.info("Snoozed.")
         if c3.button("Dismiss"):
-            r["next_walk_at"]=now+timedelta(minutes=int(r.get("walk_every_min",120)))
-    if r.get("stand_enabled") and r.get("next_stand_at") and now>=r["next_stand_at"]:
+            sched.complete(user_id,"walk"); sched.sink.ack(user_id,"walk")
+    if "stand" in pending:
         st.info("🧍 Stand/Stretch reminder!")
         c1,c2=st.columns(2)
         if c1.button("I Stood/Stretch"):
-            r["next_stand_at"]=now+timedelta(minutes=int(r.get("stand_every_min",30)))
+            sched.complete(user_id,"stand"); sched.sink.ack(user_id,"stand")
             st.success("Nice!")
         if c2.button("Snooze 5 min"):
-            r["next_stand_at"]=now+timedelta(minutes=5)
+            sched.snooze(user_id,"stand",5); sched.sink.ack(user_id,"stand")
             st.info("Snoozed.")
+    due=[f"{kind}: {datetime.fromtimestamp(t).strftime('%H:%M')}" for kind in ("walk","stand") if (t:=sched.next_due(user_id, kind))]
+    if due: st.caption("Next reminders — " + ", ".join(due))
 
 # =========================
 # Sidebar: Profile, Team, Roles, Reminders
@@ -470,7 +115,7 @@ city = st.sidebar.text_input("City", value="Atlanta").strip()
 company = st.sidebar.text_input("Company (for leagues)", value="HealthCo").strip()
 avail = st.sidebar.selectbox("Usual walk time", ["Mornings","Lunch","Evenings","Weekends"], index=0)
 if st.sidebar.button("Save Profile"):
-    u=ensure_user(user_id, display_name); u["name"]=display_name; u["city"]=city; u["company"]=company; u["available_times"]=avail; st.success("Profile saved!")
+    engine.update_profile(user_id, display_name, city, company, avail); st.success("Profile saved!")
 
 st.sidebar.markdown("---")
 st.sidebar.title("👥 Team")
@@ -478,25 +123,19 @@ team_name = st.sidebar.text_input("Create/Join team", value="Comeback Kids").str
 team_city = st.sidebar.text_input("Team City (optional)", value=city).strip()
 team_company = st.sidebar.text_input("Team Company (optional)", value=company).strip()
 if st.sidebar.button("Join Team"):
-    u=ensure_user(user_id, display_name); u["team"]=team_name
-    team=st.session_state.teams.setdefault(team_name, {"captain":user_id,"members":set(),"roles":{}, "city":team_city,"company":team_company})
-    team["members"].add(user_id); team["city"]=team_city; team["company"]=team_company
-    if not team.get("roles"): team["roles"][user_id] = "Captain"; team["captain"]=user_id
-    else: team["roles"].setdefault(user_id, "Player")
+    engine.ensure_user(user_id, display_name); engine.join_team(user_id, team_name, team_city, team_company)
     st.success(f"You joined team: {team_name}")
-if team_name and team_name in st.session_state.teams and user_id in st.session_state.teams[team_name].get("members", set()):
-    team = st.session_state.teams[team_name]
+if team_name and team_name in engine.teams and user_id in engine.teams[team_name].get("members", set()):
+    team = engine.teams[team_name]
     cur_role = team.get("roles", {}).get(user_id, "Player")
     new_role = st.sidebar.selectbox("Your team role", ROLES, index=ROLES.index(cur_role))
     if st.sidebar.button("Update Role"):
-        team["roles"][user_id] = new_role
-        if new_role == "Captain": team["captain"] = user_id
+        engine.set_role(user_id, team_name, new_role)
         st.sidebar.success("Role updated.")
 
 st.sidebar.markdown("---")
 st.sidebar.title("🔔 Reminders")
-init_reminders()
-r = st.session_state.reminders
+r = engine.reminder_settings(user_id)
 c1,c2 = st.sidebar.columns(2)
 with c1: r["walk_enabled"] = st.checkbox("Walk reminders", value=r.get("walk_enabled",True))
 with c2: r["stand_enabled"] = st.checkbox("Stand/stretch", value=r.get("stand_enabled",True))
@@ -504,23 +143,30 @@ r["walk_every_min"] = st.sidebar.number_input("Walk every (min)", 15, 360, int(r
 r["stand_every_min"] = st.sidebar.number_input("Stand every (min)", 5, 120, int(r.get("stand_every_min",30)))
 r["snooze_minutes"] = st.sidebar.number_input("Snooze (min)", 5, 60, int(r.get("snooze_minutes",10)))
 if st.sidebar.button("Apply & Reset Timers"):
-    now=datetime.now()
-    if r.get("walk_enabled"): r["next_walk_at"]=now+timedelta(minutes=int(r.get("walk_every_min",120)))
-    if r.get("stand_enabled"): r["next_stand_at"]=now+timedelta(minutes=int(r.get("stand_every_min",30)))
-    st.sidebar.success("Reminder timers reset.")
+    engine.update_reminders(user_id, r, reset=True); st.sidebar.success("Reminder timers reset.")
+else:
+    engine.update_reminders(user_id, r)
 
 # =========================
 # Main UI Tabs
 # =========================
 st.title("👟 Walking Buddies — Social Walking for Healthier Lifestyles")
-tab_dash, tab_log, tab_leader, tab_challenges, tab_community, tab_rewards, tab_routes, tab_messages, tab_privacy = st.tabs(
-    ["Dashboard","Log Walk","Leaderboards","Challenges","Community","Rewards","Routes","Messages","Privacy"]
-)
+
+def _tab_fragment(render):
+    # Each tab body is a fragment: its own widgets rerun only that body, which then flushes its writes
+    @st.fragment
+    @functools.wraps(render)
+    def run():
+        with probes.section(f"tab:{render.__name__}"):
+            render()
+            with probes.section("store.flush"): engine.store.flush()
+    return run
 
 # Dashboard
-with tab_dash:
+@_tab_fragment
+def render_dashboard():
     st.subheader("Personal Dashboard")
-    u=ensure_user(user_id, display_name)
+    u=engine.ensure_user(user_id, display_name)
     # Daily quote
     quotes = st.session_state.quotes
     idx = (date.today().toordinal()) % len(quotes)
@@ -536,11 +182,22 @@ with tab_dash:
     with c5: st.metric("Calories Today", int(u.get("calories_log",{}).get(today_iso,0)))
     with c6: st.metric("Calories (All-Time)", int(total_calories(u)))
     st.divider()
+    st.subheader("📈 Trends")
+    t1,t2,t3=st.columns(3)
+    whose = {"Me": ("user", user_id)}
+    for label, scope in (("My team","team"),("My city","city"),("My company","company")):
+        if u.get(scope): whose[f"{label} ({u[scope]})"] = (scope, u[scope])
+    with t1: who = st.selectbox("Whose", list(whose), key="k_trend_scope")
+    with t2: grain = st.selectbox("Per", ["weekly","weekend","monthly"], key="k_trend_grain")
+    with t3: metric = st.selectbox("Metric", ["miles","steps","minutes","calories","walks"], key="k_trend_metric")
+    st.bar_chart(activity_trend(*whose[who], grain)[metric])
+    st.divider()
     st.subheader("⏰ Reminders")
     check_and_display_reminders()
 
 # Log Walk (Timer + Manual) with calories
-with tab_log:
+@_tab_fragment
+def render_log_walk():
     st.subheader("Log a Walk")
     running = st.session_state.get("timer_running", False)
     started_at = st.session_state.get("timer_started_at", None)
@@ -581,7 +238,7 @@ with tab_log:
         mood_c = st.selectbox("How do you feel now?", ["😀 Energized","🙂 Good","😐 Meh","😕 Tired","😔 Low"], index=1, key="k_timer_mood")
         b1,b2 = st.columns(2)
         if b1.button("Save Walk"):
-            g,t,streak = award_walk(user_id, int(minutes_c), int(steps_c), float(miles_c), int(cals_c), is_group_c, photo_c, mood_c)
+            g,t,streak = engine.award_walk(user_id, int(minutes_c), int(steps_c), float(miles_c), int(cals_c), is_group_c, photo_c, mood_c)
             st.success(f"Saved timed walk: +{g} points! Total: {t} | Streak: {streak} day(s).")
             st.session_state["timer_prompt_open"]=False
         if b2.button("Cancel"):
@@ -597,52 +254,60 @@ with tab_log:
     photo    = st.checkbox("Shared a scenic photo", key="k_manual_photo")
     mood     = st.selectbox("How do you feel now?", ["😀 Energized","🙂 Good","😐 Meh","😕 Tired","😔 Low"], index=1, key="k_manual_mood")
     if st.button("Submit Walk"):
-        g,t,streak = award_walk(user_id, minutes, steps, miles_in, cals_in, is_group, photo, mood)
+        g,t,streak = engine.award_walk(user_id, minutes, steps, miles_in, cals_in, is_group, photo, mood)
         st.success(f"+{g} points! Total: {t} | Streak: {streak} day(s).")
+    with st.expander("Import from Apple Health / Google Fit"):
+        st.caption("Apple Health export.xml or export.zip, Google Fit Takeout CSV/JSON or zip. Days already recorded keep the larger value; only metrics you share in the Privacy Center are imported. For very large exports use `python -m walking_buddies.health_import`.")
+        uploads = st.file_uploader("Export files", type=["xml","csv","json","zip"], accept_multiple_files=True, key="k_health_files")
+        if st.button("Import", disabled=not uploads):
+            days, aggs = engine.import_health(user_id, [(f.name, f) for f in uploads])
+            skipped = sum(a.skipped for a in aggs.values())
+            st.success(f"Imported {sum(a.samples for a in aggs.values())} samples; {days} day(s) updated." + (f" {skipped} samples not shared were ignored." if skipped else ""))
 
 # Leaderboards
-with tab_leader:
+@_tab_fragment
+def render_leaderboards():
     st.subheader("Leaderboards")
-    users_df, teams_df, team_members_df = get_leaderboards(user_id)
+    my_rank, ranked, around_df = my_leaderboard_position(user_id)
+    st.caption(f"Your rank: #{my_rank} of {ranked}")
+    st.dataframe(around_df, use_container_width=True, hide_index=True)
+    lb_page = st.number_input("Page", min_value=1, value=1, step=1, key="k_lb_page") - 1
+    users_df, teams_df, team_members_df = get_leaderboards(user_id, page=int(lb_page))
     st.write("#### Individuals")
-    st.dataframe(users_df if not users_df.empty else pd.DataFrame([], columns=["user","points","team"]), use_container_width=True)
+    st.dataframe(users_df, use_container_width=True, hide_index=True)
     st.write("#### Teams (aggregate points)")
-    st.dataframe(teams_df if not teams_df.empty else pd.DataFrame([], columns=["team","points"]), use_container_width=True)
+    st.dataframe(teams_df, use_container_width=True, hide_index=True)
     st.write("#### Team Members & Roles")
-    st.dataframe(team_members_df if not team_members_df.empty else pd.DataFrame([], columns=["team","user","points","role"]), use_container_width=True)
+    st.dataframe(team_members_df, use_container_width=True)
 
 # Challenges — includes personalized create/join/complete
-with tab_challenges:
+@_tab_fragment
+def render_challenges():
     st.subheader("Challenges")
     st.caption("Built-ins + your own personalized goals. Join, track, and complete to earn points.")
     # Discover / My tabs
-    t1, t2 = st.tabs(["Discover", "My Challenges"])
+    view = st.radio("View", ["Discover", "My Challenges"], horizontal=True, key="k_challenges_view", label_visibility="collapsed")
 
     # Discover: list all built-ins + custom
-    with t1:
-        for ch in list(st.session_state.challenge_catalog) + list(st.session_state.custom_challenges):
+    if view == "Discover":
+        for ch in engine.challenges.challenges():
             st.markdown(f"### {ch['name']}")
             st.write(ch["desc"])
-            uc = st.session_state.user_challenges.setdefault(user_id, {}).setdefault(ch["id"], {"joined": False, "completed": False, "last_reset": None})
+            uc = engine.challenge_state(user_id, ch["id"])
             cols = st.columns(3)
             if uc["joined"]:
                 if cols[0].button(f"Leave", key=f"leave_{ch['id']}"):
-                    leave_challenge(user_id, ch["id"])
+                    engine.leave_challenge(user_id, ch["id"]); st.info("Left challenge.")
             else:
                 if cols[0].button(f"Join", key=f"join_{ch['id']}"):
-                    join_challenge(user_id, ch["id"])
+                    engine.join_challenge(user_id, ch["id"]); st.success("Joined challenge!")
             if cols[1].button("Check Progress", key=f"check_{ch['id']}"):
-                done = complete_challenge_if_eligible(user_id, ch)
+                done = engine.complete_challenge_if_eligible(user_id, ch)
                 st.success("✅ Completed!") if done else st.warning("Not eligible yet—keep going!")
             # Quick progress bar for personalized
-            u = ensure_user(user_id, user_id)
             if ch.get("custom", False):
                 metric=ch.get("metric","steps"); period=ch.get("period","weekly"); target=float(ch.get("target_value",0))
-                if metric == "steps": val = _sum_steps_period(u, period)
-                elif metric == "minutes": val = _sum_minutes_period(u, period)
-                elif metric == "miles": val = _sum_miles_period(u, period)
-                elif metric == "walks": val = _count_walks_period(u, period)
-                else: val = 0.0
+                val = engine.challenge_progress(user_id, ch)
                 st.progress(min(val/target,1.0)); st.caption(f"{val:.0f}/{target:.0f} {metric} ({period})")
             st.divider()
 
@@ -658,101 +323,115 @@ with tab_challenges:
             submitted = st.form_submit_button("Create Challenge")
             if submitted:
                 cid=f"custom_{int(time.time()*1000)}"
-                st.session_state.custom_challenges.append({
+                ch = {
                     "id":cid,"name":name.strip(),"desc":desc.strip(),
                     "custom":True,"scope":scope,"metric":metric,
                     "target_value":float(target_value),"period":period,
                     "reward_points":int(reward_points),"creator":user_id
-                })
+                }
+                engine.add_challenge(ch)
                 st.success("Custom challenge created!")
 
     # My Challenges (joined)
-    with t2:
-        my_uc = st.session_state.user_challenges.get(user_id, {})
+    else:
+        my_uc = engine.user_challenges.get(user_id, {})
         if not my_uc:
             st.info("You haven't joined any challenges yet.")
         else:
             for ch_id, state in my_uc.items():
-                ch = get_challenge_by_id(ch_id)
+                ch = engine.get_challenge_by_id(ch_id)
                 if not ch or not state.get("joined"): continue
                 st.markdown(f"### {ch['name']}")
                 st.write(ch["desc"])
                 done = state.get("completed", False)
                 st.caption("Status: ✅ Completed" if done else "Status: In progress")
                 if st.button("Check & Complete", key=f"complete_my_{ch_id}"):
-                    ok = complete_challenge_if_eligible(user_id, ch)
+                    ok = engine.complete_challenge_if_eligible(user_id, ch)
                     st.success("✅ Completed!") if ok else st.warning("Not yet—keep going.")
                 st.divider()
 
 # Community — Find Buddies, Team Battles, Photo Feed
-with tab_community:
+@_tab_fragment
+def render_community():
     st.subheader("Community")
-    subtab1, subtab2, subtab3 = st.tabs(["Find Local Buddies","Team Battles","Photo Feed"])
+    view = st.radio("View", ["Find Local Buddies","Team Battles","Photo Feed"], horizontal=True, key="k_community_view", label_visibility="collapsed")
 
     # Find Local Buddies (privacy-aware)
-    with subtab1:
+    if view == "Find Local Buddies":
         st.markdown("### Find Local Buddies")
-        u = ensure_user(user_id, display_name)
-        # Seed a few demo users for discovery
-        for demo in [("alex","Alex Johnson","Atlanta","Mornings"),("bri","Bri Gomez","Atlanta","Evenings"),("sam","Sam Lee","Boston","Lunch")]:
-            ensure_user(demo[0], demo[1]); st.session_state.users[demo[0]]["city"]=demo[2]; st.session_state.users[demo[0]]["available_times"]=demo[3]
+        u = engine.ensure_user(user_id, display_name)
+        # Seed a few demo users for discovery, once per database
+        for demo_id, name, city, times in [("alex","Alex Johnson","Atlanta","Mornings"),("bri","Bri Gomez","Atlanta","Evenings"),("sam","Sam Lee","Boston","Lunch")]:
+            if demo_id not in engine.users: engine.update_profile(demo_id, name, city, "", times)
         city_filter = st.text_input("Search by city", value=u.get("city",""))
+        company_filter = st.text_input("Search by company (coworkers who allow it)", value="")
         time_filter = st.selectbox("Usual walk time", ["Any","Mornings","Lunch","Evenings","Weekends"], index=0)
-        results = []
-        for uid, uu in st.session_state.users.items():
-            if uid == user_id: continue
-            if not uu.get("privacy",{}).get("discoverability",{}).get("byCity", True): continue
-            if not can_view_profile(uid, user_id): continue
-            if city_filter and city_filter.lower() not in (uu.get("city","").lower()):
-                continue
-            if time_filter != "Any" and time_filter != uu.get("available_times","Any"):
-                continue
-            results.append((uid, uu))
+        filters = (city_filter, company_filter, time_filter)
+        saved_filters, after = st.session_state.get("buddy_page", (filters, None))
+        if saved_filters != filters: after = None
+        result_ids, next_after = engine.find_buddies(user_id, city_filter, company_filter, time_filter, after=after)
+        results = [(uid, engine.users[uid]) for uid in result_ids]
+        mutual = engine.social.mutual_counts(user_id, result_ids)
         if results:
-            for uid, uu in results:
+            for (uid, uu), n_mutual in zip(results, mutual):
                 cols = st.columns(5)
                 cols[0].write(f"**{uu.get('name', uid)}**")
-                if uu.get("privacy",{}).get("showCity", True):
+                if n_mutual: cols[0].caption(f"{n_mutual} mutual buddies")
+                if uu["privacy"]["showCity"]:
                     cols[1].write(uu.get("city",""))
                 else:
                     cols[1].write("—")
                 cols[2].write(uu.get("available_times",""))
                 if cols[3].button("Add Buddy", key=f"addbuddy_{uid}"):
-                    me = ensure_user(user_id, display_name)
-                    me["buddies"].add(uid); ensure_user(uid)["buddies"].add(user_id)
+                    engine.add_buddies([(user_id, uid)])
                     st.success(f"Added {uu.get('name', uid)} as a buddy!")
-                cols[4].write(uu.get("company","") if uu.get("privacy",{}).get("showCompany", False) else " ")
+                cols[4].write(uu.get("company","") if uu["privacy"]["showCompany"] else " ")
+            pc1, pc2 = st.columns(2)
+            if next_after is not None and pc1.button("More results"):
+                st.session_state["buddy_page"] = (filters, next_after); st.rerun()
+            if after is not None and pc2.button("First page"):
+                st.session_state["buddy_page"] = (filters, None); st.rerun()
         else:
             st.info("No matches yet. Try broadening your filters.")
+        suggested = engine.social.suggestions(user_id, limit=5, visible=engine.visibility.predicate("profile", user_id))
+        if suggested:
+            st.markdown("#### People you may know")
+            for uid, n_mutual in suggested:
+                cols = st.columns([3,2,1])
+                cols[0].write(engine.users.get(uid, {}).get("name", uid)); cols[1].caption(f"{n_mutual} mutual buddies")
+                if cols[2].button("Add", key=f"suggest_{uid}"):
+                    engine.add_buddies([(user_id, uid)]); st.success(f"Added {engine.users.get(uid, {}).get('name', uid)} as a buddy!")
 
     # Team Battles
-    with subtab2:
+    elif view == "Team Battles":
         st.markdown("### Head-to-Head Team Battles")
         st.caption("Create a distance battle between two teams; miles during the window decide the winner.")
         # Creator UI
         colA, colB = st.columns([2,1])
         with colA:
             battle_name = st.text_input("Battle Name", value="City Showdown")
-            home = st.selectbox("Home Team", [""] + list(st.session_state.teams.keys()))
-            away = st.selectbox("Away Team", [""] + [t for t in st.session_state.teams.keys() if t != home])
+            home = st.selectbox("Home Team", [""] + list(engine.teams.keys()))
+            away = st.selectbox("Away Team", [""] + [t for t in engine.teams.keys() if t != home])
             start = st.date_input("Start Date", value=date.today())
             end = st.date_input("End Date", value=date.today()+timedelta(days=7))
             reward_points = st.number_input("Total reward points to split among winners", min_value=0, value=200, step=50)
         with colB:
             if st.button("Create Battle", disabled=(not home or not away or end < start)):
-                st.session_state.team_battles.append({
+                battle = {
+                    "id": f"battle_{int(time.time()*1000)}",
                     "name": battle_name.strip() or "Team Battle",
                     "home": home, "away": away,
                     "start": start.isoformat(), "end": end.isoformat(),
                     "reward_points": int(reward_points),
                     "winner_awarded": False
-                })
+                }
+                engine.create_battle(battle)
                 st.success("Battle created!")
         # Active & Past Battles
-        if st.session_state.team_battles:
+        if engine.team_battles:
             st.markdown("#### Battles")
-            for i, b in enumerate(st.session_state.team_battles):
-                res = compute_battle_score(b)
+            results = engine.score_battles(engine.team_battles)
+            for i, (b, res) in enumerate(zip(engine.team_battles, results)):
                 cols = st.columns([2,2,2,2,2])
                 cols[0].write(f"**{b['name']}**")
                 cols[1].write(f"{b['home']} vs {b['away']}")
@@ -763,146 +442,260 @@ with tab_community:
                 # Award if ended
                 if date.today().isoformat() > b["end"] and not b.get("winner_awarded"):
                     if st.button(f"Award Winner Points (#{i})"):
-                        award_battle_points(b); st.success("Winner points awarded!")
+                        engine.award_battle_points(b); st.success("Winner points awarded!")
 
     # Photo Feed (privacy-aware)
-    with subtab3:
+    else:
         st.markdown("### Recent Scenic Walks")
-        feed = []
-        for ph in reversed(st.session_state.photos[-50:]):
-            owner = ph["user_id"]
-            audience = ph.get("audience","friends")
-            can = False
-            if audience == "public":
-                can = True
-            elif audience == "friends":
-                can = is_friend(owner, user_id) or owner==user_id
-            elif audience == "team":
-                can = same_team(owner, user_id) or owner==user_id
-            elif audience == "private":
-                can = owner==user_id
-            if can:
-                feed.append(ph)
+        feed, older = engine.photo_feed(user_id, before=st.session_state.get("feed_before"))
         if feed:
             for ph in feed:
-                uo = ensure_user(ph["user_id"])
+                uo = engine.ensure_user(ph["user_id"])
                 st.write(f"**{uo.get('name', ph['user_id'])}** · {ph['ts']} · {ph.get('miles',0)} miles · ({ph.get('audience','friends')})")
                 st.caption(ph.get("notes",""))
                 st.divider()
+            fc1, fc2 = st.columns(2)
+            if older is not None and fc1.button("Older posts"):
+                st.session_state["feed_before"] = older; st.rerun()
+            if st.session_state.get("feed_before") is not None and fc2.button("Newest posts"):
+                st.session_state["feed_before"] = None; st.rerun()
         else:
             st.info("No visible photo posts yet — log a walk and tick 'Shared a scenic photo'.")
 
 # Rewards
-with tab_rewards:
+@_tab_fragment
+def render_rewards():
     st.subheader("Rewards & Badges")
-    u=ensure_user(user_id, display_name)
+    u=engine.ensure_user(user_id, display_name)
     col1,col2 = st.columns(2)
     with col1:
         st.metric("Points", int(u.get("points",0))); st.metric("Tier", tier_for_points(int(u.get("points",0))))
-        earned = st.session_state.badges.get(user_id, set())
+        earned = engine.badges.get(user_id, set())
         st.write("**Badges Earned:** " + (", ".join(sorted(earned)) if earned else "None yet"))
     with col2:
         st.markdown("### Redeem Rewards")
-        for item in st.session_state.reward_catalog:
+        for item in REWARD_CATALOG:
             c = st.container(border=True)
             with c:
                 st.write(f"**{item['name']}** — {item['desc']} ({item['cost']} pts)")
                 can = int(u.get("points",0)) >= int(item["cost"])
                 if st.button(f"Redeem '{item['name']}'", disabled=not can, key=f"redeem_{item['id']}"):
-                    u["points"] -= int(item["cost"]); st.success(f"Redeemed {item['name']}!")
+                    if engine.redeem(user_id, item): st.success(f"Redeemed {item['name']}!")
+                    else: st.warning("Not enough points.")
 
 # Routes
-with tab_routes:
+@_tab_fragment
+def render_routes():
     st.subheader("Training Log & Routes")
     rc1, rc2 = st.columns([2,1])
     with rc1:
         route_name = st.text_input("Route name")
         route_km = st.number_input("Distance (km)", 0.1, 200.0, 3.0, step=0.1, format="%.1f")
         route_notes = st.text_area("Notes (optional)", height=80)
+        gpx = st.file_uploader("GPS track (optional, GPX) — sets the distance and neighborhoods", type=["gpx"], key="k_route_gpx")
         # default audience from privacy
-        default_aud = ensure_user(user_id).get("privacy",{}).get("routes",{}).get("defaultShare","private")
+        default_aud = engine.ensure_user(user_id)["privacy"].lookup("routes", "defaultShare")
         audience = st.selectbox("Share with", ["private","friends","team","public"], index=["private","friends","team","public"].index(default_aud))
     with rc2:
         if st.button("Add Route"):
-            if route_name.strip(): add_route(user_id, route_name.strip(), route_km, route_notes.strip(), audience); st.success(f"Route '{route_name}' added.")
+            track = None
+            if gpx is not None:
+                try: track = routes.parse_gpx(gpx.getvalue())
+                except Exception as e: st.error(f"Could not read GPX: {e}")
+            if route_name.strip():
+                r = engine.add_route(user_id, route_name.strip(), route_km, route_notes.strip(), audience, track)
+                st.success(f"Route '{route_name}' added." + (f" {r['distance_km']:.2f} km through {len(r['neighborhoods'])} neighborhood(s)." if "neighborhoods" in r else ""))
             else: st.error("Please provide a route name.")
-    user_routes = list_routes(user_id)
+    user_routes = engine.list_routes(user_id)
     if user_routes:
         st.write("### My Routes")
-        df = pd.DataFrame(user_routes); st.dataframe(df[["name","distance_km","notes","audience","created_at"]], use_container_width=True)
+        df = pd.DataFrame(user_routes)
+        df["neighborhoods"] = [len(r.get("neighborhoods", ())) for r in user_routes]
+        st.dataframe(df[["name","distance_km","neighborhoods","notes","audience","created_at"]], use_container_width=True)
         del_name = st.selectbox("Delete a route", [""] + [r["name"] for r in user_routes])
         if st.button("Delete Selected Route"):
-            if del_name: delete_route(user_id, del_name); st.success(f"Deleted route '{del_name}'.")
+            if del_name: engine.delete_route(user_id, del_name); st.success(f"Deleted route '{del_name}'.")
     else:
         st.info("No routes yet — add your first route above.")
+    st.write("### Routes Near Me")
+    # centered on the start of the user's latest GPS route until they enter a location
+    start = next((engine.route_index.track(user_id, r["name"]) for r in reversed(user_routes) if r.get("polyline")), None)
+    n1, n2, n3 = st.columns(3)
+    lat = n1.number_input("Latitude", -90.0, 90.0, float(start[0][0]) if start else 0.0, format="%.5f", key="k_near_lat")
+    lon = n2.number_input("Longitude", -180.0, 180.0, float(start[1][0]) if start else 0.0, format="%.5f", key="k_near_lon")
+    radius = n3.number_input("Within (km)", 0.1, 50.0, 2.0, step=0.5, key="k_near_km")
+    hits = engine.routes_near(user_id, lat, lon, radius)
+    if hits:
+        st.dataframe(pd.DataFrame([{"name": r["name"], "by": r["user_id"], "km away": round(d, 2), "distance_km": r["distance_km"]} for d, r in hits]), use_container_width=True)
+        tracks = [engine.route_index.track(r["user_id"], r["name"]) for _, r in hits]
+        st.map(pd.DataFrame({"lat": [t[0][0] for t in tracks], "lon": [t[1][0] for t in tracks]}))
+    else:
+        st.caption("No shared GPS routes within that distance.")
 
 # Messages (uses buddies added via Community) with privacy checks in send_message
-with tab_messages:
+@_tab_fragment
+def render_messages():
     st.subheader("Messages")
-    u = ensure_user(user_id, display_name)
-    buddy_choices = sorted(list(u.get("buddies", set())))
-    buddy = st.selectbox("Select a buddy", [""] + buddy_choices, index=0)
+    engine.ensure_user(user_id, display_name)
+    buddy_choices = sorted(engine.social.friends(user_id))
+    convs = engine.conversations
+    def _buddy_label(b):
+        n = convs.unread_count(user_id, b) if b else 0
+        return f"{b} ({n} new)" if n else b
+    buddy = st.selectbox("Select a buddy", [""] + buddy_choices, index=0, format_func=_buddy_label)
     if buddy:
         # respect profile visibility for conversation view
-        if not can_view_profile(buddy, user_id):
+        if not engine.can_view_profile(buddy, user_id):
             st.warning("This user's profile is not visible to you.")
-        msgs = get_conversation(user_id, buddy)
+        cursor_key = f"msg_before_{buddy}"
+        msgs, older = engine.get_conversation(user_id, buddy, before=st.session_state.get(cursor_key))
+        engine.mark_read(user_id, buddy)
+        if older is not None and st.button("Show older messages"):
+            st.session_state[cursor_key] = older; st.rerun()
+        if st.session_state.get(cursor_key) is not None and st.button("Back to latest"):
+            st.session_state[cursor_key] = None; st.rerun()
         for m in msgs:
-            who = "You" if m["from"] == user_id else st.session_state.users.get(m["from"],{}).get("name", m["from"])
+            who = "You" if m["from"] == user_id else engine.users.get(m["from"],{}).get("name", m["from"])
             st.write(f"**{who}** [{m['ts']}]: {m['text']}")
         new_msg = st.text_input("Write a message")
         if st.button("Send"):
-            if new_msg.strip(): send_message(user_id, buddy, new_msg.strip()); st.experimental_rerun()
+            if new_msg.strip():
+                refused = engine.send_message(user_id, buddy, new_msg.strip())
+                if refused == BLOCKED: st.error("You can't message this user.")
+                elif refused: st.warning("Message request not allowed by recipient's privacy settings.")
+                else: st.session_state[cursor_key] = None; engine.store.flush(); st.rerun()
     else:
         st.info("Add buddies from the Community tab to start messaging.")
 
 # Privacy Center
-with tab_privacy:
+@_tab_fragment
+def render_privacy():
     st.subheader("Privacy Center")
-    u = ensure_user(user_id, display_name)
-    p = u["privacy"]
+    u = engine.ensure_user(user_id, display_name)
+    p = u["privacy"]; AUD = ["private","friends","team","public"]
+    ch = {}   # {(section, key): value}; applied copy-on-write below
     st.markdown("### Profile visibility")
-    p["profileVisibility"] = st.selectbox("Who can see your profile?", ["private","friends","team","public"], index=["private","friends","team","public"].index(p.get("profileVisibility","private")))
+    ch[("profileVisibility",)] = st.selectbox("Who can see your profile?", AUD, index=AUD.index(p["profileVisibility"]))
     c1,c2 = st.columns(2)
-    with c1: p["showCity"] = st.checkbox("Show my city", value=bool(p.get("showCity", True)))
-    with c2: p["showCompany"] = st.checkbox("Show my company", value=bool(p.get("showCompany", False)))
+    with c1: ch[("showCity",)] = st.checkbox("Show my city", value=bool(p["showCity"]))
+    with c2: ch[("showCompany",)] = st.checkbox("Show my company", value=bool(p["showCompany"]))
     st.markdown("---")
     st.markdown("### Leaderboards")
-    lb = p.get("leaderboards", {"public": False, "alias": "", "teamVisible": True})
-    lb["public"] = st.checkbox("Appear on public leaderboards", value=bool(lb.get("public", False)))
-    lb["teamVisible"] = st.checkbox("Show me on my team's leaderboard", value=bool(lb.get("teamVisible", True)))
-    lb["alias"] = st.text_input("Leaderboard alias (optional)", value=lb.get("alias",""))
-    p["leaderboards"] = lb
+    lb = p["leaderboards"]
+    ch[("leaderboards","public")] = st.checkbox("Appear on public leaderboards", value=bool(lb["public"]))
+    ch[("leaderboards","teamVisible")] = st.checkbox("Show me on my team's leaderboard", value=bool(lb["teamVisible"]))
+    ch[("leaderboards","alias")] = st.text_input("Leaderboard alias (optional)", value=lb["alias"])
     st.markdown("---")
     st.markdown("### Discoverability")
-    disc = p.get("discoverability", {"byCity": True, "byCompany": False})
-    disc["byCity"] = st.checkbox("Allow people in my city to find me", value=bool(disc.get("byCity", True)))
-    disc["byCompany"] = st.checkbox("Allow coworkers to find me", value=bool(disc.get("byCompany", False)))
-    p["discoverability"] = disc
+    disc = p["discoverability"]
+    ch[("discoverability","byCity")] = st.checkbox("Allow people in my city to find me", value=bool(disc["byCity"]))
+    ch[("discoverability","byCompany")] = st.checkbox("Allow coworkers to find me", value=bool(disc["byCompany"]))
     st.markdown("---")
     st.markdown("### Routes & Photos")
-    routes = p.get("routes", {"defaultShare": "private"})
-    routes["defaultShare"] = st.selectbox("Default route sharing", ["private","friends","team","public"], index=["private","friends","team","public"].index(routes.get("defaultShare","private")))
-    p["routes"] = routes
-    photos = p.get("photos", {"defaultAudience": "friends", "stripEXIF": True, "autoExpireDays": 365})
-    photos["defaultAudience"] = st.selectbox("Default photo audience", ["private","friends","team","public"], index=["private","friends","team","public"].index(photos.get("defaultAudience","friends")))
-    photos["stripEXIF"] = st.checkbox("Strip photo EXIF (location)", value=bool(photos.get("stripEXIF", True)))
-    photos["autoExpireDays"] = st.number_input("Auto-hide photos after (days)", min_value=0, max_value=3650, value=int(photos.get("autoExpireDays",365)))
-    p["photos"] = photos
+    ch[("routes","defaultShare")] = st.selectbox("Default route sharing", AUD, index=AUD.index(p.lookup("routes","defaultShare")))
+    photos = p["photos"]
+    ch[("photos","defaultAudience")] = st.selectbox("Default photo audience", AUD, index=AUD.index(photos["defaultAudience"]))
+    ch[("photos","stripEXIF")] = st.checkbox("Strip photo EXIF (location)", value=bool(photos["stripEXIF"]))
+    ch[("photos","autoExpireDays")] = int(st.number_input("Auto-hide photos after (days)", min_value=0, max_value=3650, value=int(photos["autoExpireDays"])))
     st.markdown("---")
     st.markdown("### Messaging & Security")
-    msg = p.get("messaging", {"allowRequests":"friends_of_friends","readReceipts": False,"blocked":[]})
-    msg["allowRequests"] = st.selectbox("Who can message you?", ["anyone","friends_of_friends","friends_only"], index=["anyone","friends_of_friends","friends_only"].index(msg.get("allowRequests","friends_of_friends")))
-    msg["readReceipts"] = st.checkbox("Send read receipts", value=bool(msg.get("readReceipts", False)))
-    blocked = msg.get("blocked", [])
+    msg = p["messaging"]; REQ = ["anyone","friends_of_friends","friends_only"]
+    ch[("messaging","allowRequests")] = st.selectbox("Who can message you?", REQ, index=REQ.index(msg["allowRequests"]))
+    ch[("messaging","readReceipts")] = st.checkbox("Send read receipts", value=bool(msg["readReceipts"]))
+    blocked = list(msg["blocked"])
     block_user = st.text_input("Block user (enter username)")
     if st.button("Block"):
         if block_user and block_user not in blocked: blocked.append(block_user); st.success(f"Blocked {block_user}")
-    msg["blocked"] = blocked
-    p["messaging"] = msg
-    sec = p.get("security", {"appLock": False, "twoFA": False})
-    sec["appLock"] = st.checkbox("Enable app lock (passcode/biometric)", value=bool(sec.get("appLock", False)))
-    sec["twoFA"] = st.checkbox("Enable 2FA for sign-in", value=bool(sec.get("twoFA", False)))
-    p["security"] = sec
+    ch[("messaging","blocked")] = blocked
+    sec = p["security"]
+    ch[("security","appLock")] = st.checkbox("Enable app lock (passcode/biometric)", value=bool(sec["appLock"]))
+    ch[("security","twoFA")] = st.checkbox("Enable 2FA for sign-in", value=bool(sec["twoFA"]))
+    st.markdown("---")
+    st.markdown("### Health imports")
+    for src, label in (("appleHealth","Apple Health"), ("googleFit","Google Fit")):
+        cols = st.columns(4)
+        for col, flag in zip(cols, ("steps","distance","minutes","calories")):
+            with col: ch[("health",src,flag)] = st.checkbox(f"{label}: {flag}", value=bool(p.lookup("health",src,flag,default=False)), key=f"k_health_{src}_{flag}")
+    new = p.with_changes(ch)
+    if new is not p: engine.set_privacy(user_id, new)   # edits apply live
     if st.button("Save Privacy Settings"):
-        u["privacy"] = p; st.success("Privacy settings saved."); st.balloons()
+        engine.mark_dirty(user_id); st.success("Privacy settings saved."); st.balloons()
+
+# Diagnostics (hidden): probe timings, rerun breakdowns, session-state size, exports
+def session_state_sizes()->pd.DataFrame:
+    # one seen-set throughout: this session's own keys are measured first, then the engine's shared state and
+    # indexes (one row per attribute), so anything reachable from both counts once, under the session key
+    seen = set()
+    rows = [{"key": str(k), "MiB": probes.deep_sizeof(st.session_state[k], seen) / 2**20, "shared": False} for k in sorted(st.session_state.keys(), key=str)]
+    rows += [{"key": f"engine.{k}", "MiB": probes.deep_sizeof(v, seen) / 2**20, "shared": True} for k, v in sorted(vars(engine).items()) if not callable(v)]
+    return pd.DataFrame(rows)
+
+def diagnostics_gauges()->Dict[str,float]:
+    views = engine.views; ss = st.session_state
+    g = {"users": len(engine.users), "state_version": engine.state_version(), "view_cache_hits": views.hits, "view_cache_misses": views.misses}
+    if "diag_sizes" in ss: g["session_state_bytes"] = int(ss.diag_sizes["MiB"].sum() * 2**20)
+    return g
+
+@_tab_fragment
+def render_diagnostics():
+    st.subheader("Diagnostics")
+    rec = probes.RECORDER
+    on = st.toggle("Record timings (all sessions)", value=rec.enabled, help="Probes are installed on the next rerun and cost nothing while off.")
+    if on != rec.enabled:
+        rec.enabled = on; engine.set_probes(on); st.rerun()
+    if st.button("Reset timings"): rec.reset()
+
+    st.write("### Recent reruns")
+    runs = list(rec.runs)[::-1]
+    if runs:
+        pick = st.selectbox("Breakdown of", range(len(runs)), format_func=lambda i: f"{runs[i].label} at {datetime.fromtimestamp(runs[i].started):%H:%M:%S} — {runs[i].total_ns/1e6:.1f} ms")
+        spans = pd.DataFrame([{"span": n, "calls": c, "ms": ns / 1e6} for n, (c, ns) in runs[pick].spans.items()], columns=["span","calls","ms"])
+        if not spans.empty: st.bar_chart(spans.sort_values("ms", ascending=False).set_index("span")["ms"], horizontal=True)
+        st.dataframe(pd.DataFrame([{"run": label, "reruns": s.count, "p50 ms": s.quantile(0.5)*1e3, "p95 ms": s.quantile(0.95)*1e3, "max ms": s.max_ns/1e6}
+                                   for label, s in sorted(rec.run_stats.items())]), use_container_width=True)
+    else:
+        st.info("No reruns recorded yet — turn on recording and use the app.")
+
+    st.write("### Calls")
+    summary = rec.summary()
+    if summary:
+        st.dataframe(pd.DataFrame(summary).round(3), use_container_width=True)
+        name = st.selectbox("Latency histogram", [r["name"] for r in summary] + sorted(rec.run_stats))
+        hist = rec.histogram(name)
+        st.bar_chart(pd.DataFrame({"calls": [n for _, n in hist]}, index=[f"≤{ms:.3g} ms" for ms, _ in hist]))
+
+    st.write("### Session state")
+    if st.button("Measure session state"): st.session_state["diag_sizes"] = session_state_sizes()
+    if "diag_sizes" in st.session_state:
+        sizes = st.session_state.diag_sizes
+        st.caption(f"{sizes['MiB'].sum():.1f} MiB reachable, {sizes.loc[~sizes['shared'], 'MiB'].sum():.2f} MiB of it private to this session")
+        st.dataframe(sizes.sort_values("MiB", ascending=False).round(3), use_container_width=True)
+
+    st.write("### Export")
+    c1, c2 = st.columns(2)
+    with c1:
+        prom_path = st.text_input("Prometheus text file", value=DB_PATH + ".prom")
+        if st.button("Write metrics file"):
+            rec.write_prometheus(prom_path, diagnostics_gauges()); st.success(f"Wrote {prom_path}")
+        st.download_button("Download metrics", rec.prometheus(diagnostics_gauges()), file_name="walking_buddies.prom", mime="text/plain")
+    with c2:
+        prof_path = st.text_input("cProfile dump", value=DB_PATH + ".prof")
+        if st.button("Profile next rerun", disabled=not rec.enabled):
+            rec.profile_next_run(prof_path); st.info("The next rerun (any session) will be profiled.")
+        if rec.last_profile:
+            st.caption(f"Last profile: {rec.last_profile[0]}"); st.code(rec.last_profile[1], language="text")
+
+TABS = {"Dashboard": render_dashboard, "Log Walk": render_log_walk, "Leaderboards": render_leaderboards,
+        "Challenges": render_challenges, "Community": render_community, "Rewards": render_rewards,
+        "Routes": render_routes, "Messages": render_messages, "Privacy": render_privacy}
+if DIAGNOSTICS or st.query_params.get("diagnostics") == "1": TABS["Diagnostics"] = render_diagnostics
+if RENDER_ALL_TABS:
+    for tab, render in zip(st.tabs(list(TABS)), TABS.values()):
+        with tab: render()
+else:
+    # Only the selected tab is built, so a rerun costs what that tab costs
+    TABS[st.radio("Section", list(TABS), horizontal=True, key="active_tab", label_visibility="collapsed")]()
+
+# Persist everything this rerun changed in one transaction
+with probes.section("store.flush"): engine.store.flush()
+probes.RECORDER.end_run()
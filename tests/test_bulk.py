@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""award_walks_bulk against the same walks logged one by one with award_walk."""
+import random
+from datetime import date, datetime, timedelta
+import pytest
+from walking_buddies import core
+from walking_buddies.core import CHALLENGE_CATALOG, open_engine
+
+HISTORY = date(2026, 6, 1)   # a Monday: one week logged the same way on both engines,
+WEEK = date(2026, 6, 8)      # then a second week logged one by one on one and in bulk on the other
+
+
+class Clock(datetime):
+    current = datetime(2026, 6, 1)
+    @classmethod
+    def now(cls, tz=None): return cls.current
+
+class Today(date):
+    @classmethod
+    def today(cls): return Clock.current.date()
+
+
+def walks(rng, start, users):
+    """Seeded walks over the 7 days from ``start``, in time order; the first user walks every day (streak bonuses)."""
+    out = []
+    for i in range(7):
+        day = start + timedelta(days=i)
+        for n, uid in enumerate(users):
+            if n and rng.random() < 0.35: continue
+            for _ in range(rng.randint(1, 3)):
+                ts = datetime(day.year, day.month, day.day, rng.randrange(6, 22), rng.randrange(60), rng.randrange(60))
+                out.append({"user_id": uid, "minutes": rng.randint(5, 90), "steps": rng.randint(500, 12000), "miles": round(rng.uniform(0.2, 6.0), 2),
+                            "calories": rng.randint(20, 600), "is_group": rng.random() < 0.3, "shared_photo": rng.random() < 0.25,
+                            "mood": rng.choice([None, "happy", "tired"]), "ts": ts})
+    return sorted(out, key=lambda r: r["ts"])
+
+def one_by_one(e, records):
+    for r in records:
+        Clock.current = r["ts"]
+        e.award_walk(r["user_id"], r["minutes"], r["steps"], r["miles"], r["calories"], r["is_group"], r["shared_photo"], r["mood"])
+
+def outcome(e, users):
+    """Per user: points, badges, avatar, streak, walks, moods, photos and (progress, state) of every challenge (sums to 1e-9)."""
+    return {uid: (int(e.users[uid].points), sorted(e.badges.get(uid, ())), e.users[uid]["avatar_level"], core.calc_streak(e.users[uid]),
+                  sorted(e.users[uid].walk_dates), sorted(e.users[uid]["mood_log"].items()), sum(p["user_id"] == uid for p in e.photos),
+                  {ch["id"]: (round(e.challenge_progress(uid, ch), 9), e.challenge_state(uid, ch["id"])) for ch in CHALLENGE_CATALOG})
+            for uid in users}
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_bulk_award_matches_one_walk_at_a_time(seed, tmp_path, monkeypatch):
+    monkeypatch.setattr(core, "datetime", Clock); monkeypatch.setattr(core, "date", Today)
+    rng = random.Random(seed); users = [f"u{i}" for i in range(6)]
+    history, week = walks(rng, HISTORY, users), walks(rng, WEEK, users)
+    Clock.current = datetime.combine(HISTORY, datetime.min.time())
+    seq, bulk = (open_engine(str(tmp_path / f"{name}.db")) for name in ("seq", "bulk"))
+    for e in (seq, bulk):
+        one_by_one(e, history)
+        Clock.current = datetime.combine(WEEK, datetime.min.time())
+        for uid in users:
+            for ch in CHALLENGE_CATALOG:
+                if ch["period"] != "daily": e.join_challenge(uid, ch["id"])   # a daily goal can pay every day one by one, once in bulk
+    one_by_one(seq, week)
+    totals = bulk.award_walks_bulk(week).set_index("user_id")
+    assert outcome(bulk, users) == outcome(seq, users)
+    assert any(r["is_group"] for r in week) and any(r["shared_photo"] for r in week)
+    assert core.calc_streak(seq.users[users[0]]) == 14   # the bonus days were in the batch
+    assert any(st["completed"] for _, st in outcome(seq, users)[users[0]][-1].values())
+    for uid in totals.index: assert totals.loc[uid, "points"] == seq.users[uid].points
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Buddy search against filtering every user's profile on each query."""
+import random
+import pytest
+from walking_buddies.directory import BuddyDirectory, normalize
+
+CITIES = ("Austin", "Boston", "Bostonia", "New York", "Newark", "Paris")
+COMPANIES = ("Acme", "Globex", "")
+TIMES = ("Mornings", "Evenings", "Lunch")
+
+
+@pytest.fixture(scope="module")
+def population():
+    rng = random.Random(1); d = BuddyDirectory(); entries = {}
+    for _ in range(3000):
+        uid = f"u{rng.randrange(1500):05d}"
+        if rng.random() < 0.05: d.remove(uid); entries.pop(uid, None); continue
+        e = (rng.choice(CITIES), rng.choice(COMPANIES), rng.choice(TIMES), rng.random() < 0.6, rng.random() < 0.6)
+        d.sync(uid, *e); entries[uid] = e
+    return d, entries
+
+
+def scan(entries, city_query, company_query, time):
+    q, cq = normalize(city_query), normalize(company_query); out = set()
+    for uid, (city, company, times, by_city, by_company) in entries.items():
+        if q and not (by_city and q in normalize(city)): continue
+        if not q and not cq and not by_city: continue   # no filter at all: everyone discoverable by city
+        if cq and not (by_company and normalize(company) == cq): continue
+        if time and time != "Any" and times != time: continue
+        out.add(uid)
+    return out
+
+
+QUERIES = [(c, co, t) for c in ("", "bos", "new", "ar", "zzz", "PARIS ") for co in ("", "acme", "nope") for t in (None, "Any", "Lunch")]
+
+
+@pytest.mark.parametrize("city,company,time", QUERIES)
+def test_candidates_and_pages_match_scan(population, city, company, time):
+    d, entries = population
+    expected = scan(entries, city, company, time)
+    assert d.candidates(city, company, time) == expected
+    got, after = [], None
+    while True:
+        page, after = d.search(city, company, time, limit=7, after=after); got += page
+        if after is None: break
+    assert got == sorted(expected)
+
+
+def test_company_only_search_finds_users_discoverable_only_by_company():
+    d = BuddyDirectory()
+    d.sync("a", "Austin", "Acme", "Lunch", False, True)   # hidden from city search
+    d.sync("b", "Austin", "Acme", "Lunch", True, False)   # hidden from company search
+    assert d.search(company_query="acme")[0] == ["a"]
+    assert d.search(city_query="austin")[0] == ["b"]
+    assert d.search(city_query="austin", company_query="acme")[0] == []
+
+
+def test_search_skips_viewer_and_invisible_profiles(population):
+    d, entries = population
+    expected = sorted(scan(entries, "bos", "", None))
+    hidden = set(expected[::3]); me = expected[1]
+    got, after = [], None
+    while True:
+        page, after = d.search("bos", exclude=me, visible=lambda uid: uid not in hidden, limit=5, after=after); got += page
+        if after is None: break
+    assert got == [u for u in expected if u not in hidden and u != me]
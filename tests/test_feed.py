@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Feed timelines against filtering every post by the viewer's relationships on each read."""
+import random
+from datetime import datetime, timedelta
+import pytest
+from walking_buddies.feed import FeedService
+
+START = datetime(2026, 1, 1)
+
+
+def world(seed, fanout_limit):
+    rng = random.Random(seed); users = [f"u{i:02d}" for i in range(40)]
+    team = {u: rng.choice(["red", "blue", None]) for u in users}   # fixed: team posts are fanned out to members at posting time
+    friends = {u: set() for u in users}
+    feed = FeedService(friends_of=lambda u: friends[u], team_of=team.get,
+                       members_of=lambda t: {u for u in users if team[u] == t}, expire_days_of=lambda u: 0, fanout_limit=fanout_limit)
+    for step in range(1500):
+        if rng.random() < 0.15:   # buddies made later see the author's earlier friends-only posts
+            a, b = rng.sample(users, 2)
+            if b not in friends[a]: friends[a].add(b); friends[b].add(a); feed.add_buddies([(a, b)])
+        else:
+            owner = rng.choice(users)
+            feed.publish({"user_id": owner, "audience": rng.choice(["friends", "friends", "team", "public", "private"]),
+                          "ts": (START + timedelta(minutes=step)).isoformat(), "n": step})
+    return feed, users, team, friends
+
+
+def sees(post, viewer, team, friends):
+    owner, aud = post["user_id"], post["audience"]
+    return (owner == viewer or aud == "public" or (aud == "friends" and viewer in friends[owner])
+            or (aud == "team" and team[owner] is not None and team[owner] == team[viewer]))
+
+
+@pytest.mark.parametrize("fanout_limit", [1000, 3])   # pushed to timelines, and pulled from shared lists on read
+def test_pages_match_filtering_all_posts(fanout_limit):
+    feed, users, team, friends = world(5, fanout_limit); now = START + timedelta(days=30)
+    for viewer in users[::3]:
+        expected = [p["n"] for p in reversed(feed.posts) if sees(p, viewer, team, friends)]
+        got, before = [], None
+        while True:
+            page, before = feed.page(viewer, 9, before, now=now); got += [p["n"] for p in page]
+            if before is None: break
+        assert got == expected
+
+
+def test_backfill_is_limited_to_recent_posts():
+    friends = {"a": set(), "b": set()}
+    feed = FeedService(friends_of=lambda u: friends[u], team_of=lambda u: None, members_of=lambda t: set(),
+                       expire_days_of=lambda u: 0, backfill=5)
+    for i in range(12): feed.publish({"user_id": "a", "audience": "friends", "ts": (START + timedelta(minutes=i)).isoformat(), "n": i})
+    friends["a"].add("b"); friends["b"].add("a"); feed.add_buddies([("a", "b")])
+    assert [p["n"] for p in feed.page("b", 20, now=START)[0]] == [11, 10, 9, 8, 7]
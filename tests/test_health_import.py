@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Health imports from small synthetic Apple Health and Google Fit exports."""
+import io, json, random
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+import pytest
+from walking_buddies import health_import
+from walking_buddies.core import open_engine
+from walking_buddies.health_import import DailyAggregator, parse_export
+
+DAYS = [date.today() - timedelta(days=i) for i in range(5)]
+
+
+def samples(rng, devices, n=60):
+    """[(device, day, metric, value in our units)] spread over DAYS."""
+    return [(rng.choice(devices), rng.choice(DAYS), rng.choice(health_import.METRICS), rng.randint(1, 400)) for _ in range(n)]
+
+def expected(rows, metrics=health_import.METRICS):
+    """Per day, each metric's largest per-device sum, the way the merge rounds it."""
+    per = defaultdict(float)
+    for dev, day, m, v in rows: per[(dev, day, m)] += v
+    out = {}
+    for (dev, day, m), v in per.items():
+        if m in metrics: out[(day, m)] = max(out.get((day, m), 0), v)
+    return {k: round(v, 3) if k[1] == "miles" else int(round(v)) for k, v in out.items()}
+
+def apple_xml(rows)->bytes:
+    types = {v: k for k, v in health_import._APPLE_TYPES.items()}
+    units = {"steps": ("count", 1), "miles": ("km", 1 / 0.621371), "calories": ("kJ", 1 / 0.239006), "minutes": ("min", 1)}
+    recs = [f'<Record type="{types[m]}" sourceName="{dev}" unit="{units[m][0]}" value="{v * units[m][1]!r}" '
+            f'startDate="{day.isoformat()} 08:{i % 60:02d}:00 -0400" endDate="{day.isoformat()} 09:00:00 -0400"/>'
+            for i, (dev, day, m, v) in enumerate(rows)]
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n<HealthData locale="en_US">\n<ExportDate value="2026-06-01"/>\n'
+            + "\n".join(recs) + '\n<Workout workoutActivityType="HKWorkoutActivityTypeWalking"/>\n</HealthData>\n').encode()
+
+def fit_csv(rows)->bytes:
+    cols = {m: c for c, (m, _) in health_import._FIT_CSV_COLUMNS.items()}
+    out = ["Date," + ",".join(cols.values())]
+    for dev, day, m, v in rows:
+        cells = ["" if mm != m else repr(v / 0.000621371 if m == "miles" else v) for mm in cols]
+        out.append(day.isoformat() + "," + ",".join(cells))
+    return ("\ufeff" + "\n".join(out) + "\n").encode()
+
+def fit_json(rows)->bytes:
+    types = {m: k for k, (m, _) in health_import._FIT_TYPES.items()}
+    points = [{"dataTypeName": types[m], "originDataSourceId": dev,
+               "startTimeNanos": str(int(datetime(day.year, day.month, day.day, 12).timestamp() * 1e9)),
+               "fitValue": [{"value": {"fpVal": v / 0.000621371} if m == "miles" else {"intVal": v}}]} for dev, day, m, v in rows]
+    return json.dumps({"Data Source": "merged", "Data Points": points}, indent=1).encode()
+
+def totals(aggs, metrics=health_import.METRICS):
+    days = health_import.resolve(aggs)
+    return expected([("merged", date.fromordinal(o), m, v) for o, row in days.items() for m, v in zip(health_import.METRICS, row) if v], metrics)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_daily_totals_from_each_format(seed):
+    rng = random.Random(seed)
+    apple = samples(rng, ["iPhone", "Watch"]); csv_rows = samples(rng, ["googleFit"]); json_rows = samples(rng, ["phone", "band"])
+    for name, data, rows in (("export.xml", apple_xml(apple), apple), ("daily.csv", fit_csv(csv_rows), csv_rows), ("All Data.json", fit_json(json_rows), json_rows)):
+        aggs = {s: DailyAggregator() for s in health_import.SOURCES}
+        assert parse_export(io.BytesIO(data), name, aggs) == len(rows)
+        got = totals(aggs)
+        assert got.keys() == expected(rows).keys()
+        assert all(got[k] == pytest.approx(v, abs=1e-3) for k, v in expected(rows).items())   # unit conversions round-trip
+
+
+def test_disabled_sharing_flags_skip_that_source_and_metric(tmp_path):
+    rng = random.Random(7); apple = samples(rng, ["iPhone"]); fit = samples(rng, ["googleFit"])
+    e = open_engine(str(tmp_path / "wb.db")); e.ensure_user("ann", "Ann")
+    e.set_privacy("ann", e.users["ann"].privacy.with_changes({("health", "googleFit", "steps"): False, ("health", "appleHealth", "distance"): True}))
+    changed, aggs = e.import_health("ann", [("export.xml", io.BytesIO(apple_xml(apple))), ("daily.csv", io.BytesIO(fit_csv(fit)))])
+    assert aggs["googleFit"].samples == 0 and aggs["googleFit"].skipped == len(fit)
+    want = expected(apple, {"steps", "miles"})
+    log = e.users["ann"].activity
+    assert {(d, m): log.get(m, d.toordinal(), 0) for d in DAYS for m in health_import.METRICS if log.get(m, d.toordinal(), 0)} == pytest.approx(want)
+    assert changed == len({d for d, _ in want})
+
+
+def test_reimport_and_hand_logged_days_are_not_counted_twice(tmp_path):
+    rng = random.Random(3); rows = samples(rng, ["iPhone", "Watch"], n=100)
+    e = open_engine(str(tmp_path / "wb.db")); e.ensure_user("ann", "Ann")
+    e.award_walk("ann", 30, 10, 0.5, 100, False, False)   # today, by hand, with fewer steps than the devices counted
+    files = lambda: [("export.xml", io.BytesIO(apple_xml(rows)))]
+    changed, _ = e.import_health("ann", files())
+    log = e.users["ann"].activity; want = expected(rows, {"steps"})
+    assert (date.today(), "steps") in want and changed == len(want)
+    assert {d: log.get("steps", d.toordinal(), 0) for d in DAYS} == {d: v for (d, _), v in want.items()}   # the larger count, not the sum
+    assert log.get("minutes", date.today().toordinal()) == 30   # not shared: the hand-logged value stays
+    before = {d: log.get("steps", d.toordinal(), 0) for d in DAYS}; points = e.users["ann"].points
+    assert e.import_health("ann", files())[0] == 0   # a second upload of the same export changes nothing
+    assert {d: log.get("steps", d.toordinal(), 0) for d in DAYS} == before and e.users["ann"].points == points
+    assert log.check_totals() == {}
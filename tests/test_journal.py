@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Journal replay against the live engine state it was recorded from."""
+import json, os
+from datetime import date
+from walking_buddies.core import CHALLENGE_CATALOG, REMINDER_DEFAULTS, open_engine
+from walking_buddies.journal import Journal, rescore, segments
+
+
+def snapshot(e):
+    users = {uid: (u.name, u.city, u.company, u.available_times, u.team, int(u.points), int(u.photos_this_week),
+                   sorted(u.get("routes_completed_month") or ()), sorted(u.walk_dates), json.dumps(u.privacy.overrides, sort_keys=True))
+             for uid, u in e.users.items()}
+    return {"users": users, "teams": {n: (sorted(t["members"]), t["roles"]) for n, t in e.teams.items()},
+            "photos": [p["ts"] + p["user_id"] for p in e.photos], "messages": [(m["from"], m["to"], m["text"]) for m in e.messages],
+            "routes": {uid: sorted(r["name"] for r in e.list_routes(uid)) for uid in e.users},
+            "buddies": sorted(e.social.edges()), "challenges": json.dumps(e.user_challenges, sort_keys=True)}
+
+
+def session(e):
+    for uid in ("ann", "bob", "cy"): e.ensure_user(uid, uid.title())
+    e.store.flush()   # the snapshot replay starts from
+    e.update_profile("ann", "Ann A", "Austin", "Acme", "Evenings")
+    e.set_privacy("ann", e.users["ann"].privacy.with_changes({("photos", "defaultAudience"): "public", ("leaderboards", "public"): True}))
+    e.join_team("ann", "Tigers", "Austin", "Acme"); e.join_team("bob", "Tigers"); e.join_team("bob", "Lions")
+    e.add_buddies([("ann", "bob"), ("bob", "cy")])
+    for ch in CHALLENGE_CATALOG: e.join_challenge("bob", ch["id"])
+    e.leave_challenge("bob", CHALLENGE_CATALOG[-1]["id"])
+    for _ in range(3): e.award_walk("ann", 60, 8000, 4.0, 300, True, True)
+    e.award_walk("bob", 600, 80000, 40.0, 3000, False, True)
+    e.add_points("cy", 40, "welcome"); e.redeem("ann", {"id": "coupon_cafe", "cost": 150})
+    e.add_route("ann", "loop", 3.2, "", "public"); e.add_route("ann", "gone", 1, "", "public"); e.delete_route("ann", "gone")
+    e.send_message("bob", "ann", "hi"); e.ensure_user("dee", "Dee")
+
+
+def test_replay_after_a_crash_rebuilds_the_live_state(tmp_path):
+    db = str(tmp_path / "wb.db"); events = db + ".events"
+    live = open_engine(db, events); session(live); before = snapshot(live)
+    assert json.loads(before["challenges"])["bob"]   # some challenges were completed and paid
+    live.store.journal.sync()   # crash: every event is durable, nothing after the first flush is in the database
+    replayed = open_engine(db, events)
+    assert snapshot(replayed) == before
+    replayed.close()
+    assert snapshot(open_engine(db, events)) == before   # the replay was flushed; nothing is applied twice
+
+
+def test_recorded_points_match_the_ledger(tmp_path):
+    db = str(tmp_path / "wb.db"); e = open_engine(db, db + ".events"); session(e)
+    res = rescore(e.store.journal.events())
+    for uid in ("ann", "bob", "cy"): assert res[uid]["recorded"] == e.users[uid].points
+    assert res["ann"]["rescored"] == res["ann"]["recorded"]   # same rules, same score
+
+
+def test_torn_tail_is_cut_on_open(tmp_path):
+    j = Journal(str(tmp_path / "j"), fsync=False)
+    for i in range(5): j.append("points", {"uid": "a", "delta": i})
+    j.close()
+    path = segments(j.directory)[-1][1]; size = os.path.getsize(path)
+    with open(path, "ab") as fp: fp.write(b"\x40\x00\x00\x00garbage")
+    j = Journal(j.directory, fsync=False)
+    assert j.seq == 5 and os.path.getsize(path) == size
+    assert [ev.data["delta"] for ev in j.events()] == list(range(5))
+
+
+def test_unflushed_battle_roles_reminders_and_custom_challenges_replay(tmp_path):
+    db = str(tmp_path / "wb.db"); events = db + ".events"
+    live = open_engine(db, events)
+    for uid in ("ann", "bob", "cy"): live.ensure_user(uid, uid.title())
+    live.join_team("ann", "Tigers"); live.join_team("bob", "Tigers"); live.join_team("cy", "Lions")
+    live.store.flush()   # nothing below reaches the database
+    today = date.today().isoformat()
+    battle = {"id": "b1", "name": "Derby", "home": "Tigers", "away": "Lions", "start": today, "end": today,
+              "reward_points": 100, "winner_awarded": False}
+    live.create_battle(battle)
+    live.award_walk("ann", 60, 9000, 5.0, 300, False, False); live.award_walk("cy", 10, 1000, 0.5, 40, False, False)
+    live.award_battle_points(battle)
+    live.set_role("bob", "Tigers", "Captain")
+    live.update_reminders("ann", {**REMINDER_DEFAULTS, "walk_every_min": 45})
+    live.add_challenge({"id": "c_ann", "name": "Ann's 5k", "desc": "", "custom": True, "scope": "individual", "metric": "steps",
+                        "target_value": 5000, "period": "weekly", "reward_points": 10, "creator": "ann"})
+    assert battle["winner_awarded"]
+    before = snapshot(live); points = {uid: int(u.points) for uid, u in live.users.items()}
+    live.store.journal.sync()   # crash before the next flush
+
+    replayed = open_engine(db, events)
+    assert snapshot(replayed) == before and {uid: int(u.points) for uid, u in replayed.users.items()} == points
+    b = next(b for b in replayed.team_battles if b["id"] == "b1")
+    assert b["winner_awarded"]
+    replayed.award_battle_points(b)   # already paid before the crash: no second payout
+    assert {uid: int(u.points) for uid, u in replayed.users.items()} == points
+    assert replayed.teams["Tigers"]["captain"] == "bob" and replayed.teams["Tigers"]["roles"]["bob"] == "Captain"
+    assert replayed.reminder_settings("ann")["walk_every_min"] == 45
+    assert replayed.get_challenge_by_id("c_ann") is not None
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Ranked boards against sorting every user's points on each query."""
+import random
+from walking_buddies.leaderboard import Leaderboards
+
+
+def ranked(scores):
+    return [(i, k, s) for i, (k, s) in enumerate(sorted(scores.items(), key=lambda kv: (-kv[1], kv[0])))]
+
+
+def build(seed, n=300, updates=2000):
+    rng = random.Random(seed); lb = Leaderboards(); points = {}; team = {}
+    teams = [f"team{i}" for i in range(8)] + [None]
+    for _ in range(updates):
+        uid = f"u{rng.randrange(n):03d}"
+        points[uid] = points.get(uid, 0) + rng.randint(-20, 60) if rng.random() < 0.8 else rng.randint(0, 500)
+        if rng.random() < 0.2 or uid not in team: team[uid] = rng.choice(teams)
+        lb.sync(uid, points[uid], team[uid])
+    return lb, points, team
+
+
+def test_user_board_matches_full_sort():
+    lb, points, _ = build(1)
+    expected = ranked(points)
+    assert lb.users.top(len(points)) == expected
+    for r, uid, _ in expected[::17]: assert lb.users.rank(uid) == r
+
+
+def test_filtered_pages_match_filtering_the_sorted_list():
+    lb, points, _ = build(2)
+    visible = lambda uid: int(uid[1:]) % 3 != 0
+    expected = [row for row in ranked(points) if visible(row[1])]
+    got, start = [], 0
+    while start is not None:
+        rows, start = lb.users.page(start, 25, visible); got += rows
+    assert got == expected
+
+
+def test_around_matches_neighbours_in_the_sorted_list():
+    lb, points, _ = build(3)
+    visible = lambda uid: int(uid[1:]) % 2 == 0
+    rows = ranked(points)
+    for r, uid, pts in rows[::23]:
+        above = [row for row in rows[:r] if visible(row[1])][-2:]
+        below = [row for row in rows[r + 1:] if visible(row[1])][:2]
+        assert lb.users.around(uid, 2, visible) == above + [(r, uid, pts)] + below
+
+
+def test_team_boards_are_member_sums():
+    lb, points, team = build(4)
+    totals = {}
+    for uid, t in team.items():
+        if t: totals[t] = totals.get(t, 0) + points[uid]
+    assert lb.teams.top(100) == ranked(totals)
+    for t in totals:
+        assert lb.members[t].top(1000) == ranked({uid: points[uid] for uid, tt in team.items() if tt == t})
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""ReminderScheduler driven by hand through tick() on a fake clock."""
+import json, random
+from datetime import datetime
+import pytest
+from walking_buddies.reminders import FileSink, MemorySink, ReminderScheduler, quiet_until
+
+T0 = datetime(2026, 6, 8, 21, 0).timestamp()   # local time, like the quiet-hours window
+
+
+class Clock:
+    def __init__(self, now=T0): self.now = now
+    def __call__(self): return self.now
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_delivered_in_due_order(seed, tmp_path):
+    rng = random.Random(seed); clock = Clock(); path = str(tmp_path / "out.jsonl")
+    memory, file = (ReminderScheduler(sink, clock=clock) for sink in (MemorySink(), FileSink(path)))
+    firsts = {f"u{i}": rng.uniform(1, 50) for i in range(20)}
+    for s in (memory, file):
+        for uid, first in firsts.items(): s.schedule(uid, "walk", 120, first_in_min=first)
+    clock.now = T0 + 60 * 30
+    fired = memory.tick(); assert file.tick() == fired
+    assert [r.uid for r in fired] == sorted((u for u, f in firsts.items() if f <= 30), key=firsts.get)
+    assert all(r.fired_at == clock.now and r.due <= clock.now for r in fired)
+    assert [json.loads(line)["uid"] for line in open(path, encoding="utf-8")] == [r.uid for r in fired]
+    assert {uid for uid in firsts if memory.sink.pending(uid)} == {r.uid for r in fired}
+    clock.now = T0 + 60 * 60
+    assert [r.uid for r in memory.tick()] == sorted((u for u, f in firsts.items() if 30 < f <= 60), key=firsts.get)   # nothing fires twice
+    assert memory.delivered == len(firsts) and len(memory) == len(firsts)
+
+
+def test_quiet_hours_across_midnight_defer_to_the_end_of_the_window():
+    clock = Clock(); sink = MemorySink()
+    s = ReminderScheduler(sink, quiet_hours_of=lambda uid: "22:00-07:00" if uid == "ann" else None, clock=clock)
+    s.schedule("ann", "walk", 120); s.schedule("bob", "walk", 120)   # both due at 23:00
+    clock.now = T0 + 2 * 3600
+    assert [r.uid for r in s.tick()] == ["bob"] and s.deferred == 1
+    s.cancel("bob", "walk")
+    morning = datetime(2026, 6, 9, 7, 0).timestamp()
+    assert s.next_due("ann", "walk") == morning == quiet_until(clock.now, "22:00-07:00")
+    clock.now = morning - 60
+    assert s.tick() == [] and "walk" not in sink.pending("ann")
+    clock.now = morning
+    (r,) = s.tick()
+    assert (r.uid, r.due, r.fired_at) == ("ann", morning, morning) and s.next_due("ann", "walk") == morning + 7200
+
+
+def test_repeated_snoozes_coalesce_into_one_pending_reminder(tmp_path):
+    clock = Clock(); path = str(tmp_path / "out.jsonl"); s = ReminderScheduler(FileSink(path), clock=clock)
+    s.schedule("ann", "stand", 30)
+    for _ in range(50):
+        clock.now += 60; s.snooze("ann", "stand", 10)
+    assert len(s) == 1 and s.next_due("ann", "stand") == clock.now + 600
+    clock.now += 599; assert s.tick() == []   # the original and every earlier snooze are gone
+    clock.now += 1
+    assert [(r.uid, r.kind) for r in s.tick()] == [("ann", "stand")]
+    assert len(open(path, encoding="utf-8").readlines()) == 1
+    assert s.next_due("ann", "stand") == clock.now + 1800   # back on the usual interval
+    s.cancel("ann", "stand"); s.snooze("ann", "stand", 10)
+    assert len(s) == 0 and s.tick(clock.now + 3600) == []
+
+
+def test_memory_sink_keeps_one_unacknowledged_reminder_per_kind():
+    clock = Clock(); sink = MemorySink(); s = ReminderScheduler(sink, clock=clock)
+    s.schedule("ann", "walk", 10); s.schedule("ann", "stand", 15)
+    for _ in range(6):
+        clock.now += 600; s.tick()
+    assert sorted(sink.pending("ann")) == ["stand", "walk"] and s.delivered == 6 + 3   # a walk every tick, a stand at 20, 40 and 60 min
+    assert sink.pending("ann")["walk"].fired_at == clock.now
+    sink.ack("ann", "walk"); sink.ack("ann", "stand")
+    assert sink.pending("ann") == {}
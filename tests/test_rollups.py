@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Materialized rollups against summing the activity logs, and incremental updates against a rebuild."""
+import random
+from datetime import date, timedelta
+import numpy as np
+import pytest
+from walking_buddies import synth
+from walking_buddies.rollups import GRAINS, GROUP_SCOPES, WINDOWS, Rollups, bucket, current_bucket
+from walking_buddies.timeseries import METRICS
+
+TODAY = date(2026, 10, 14)   # a Wednesday
+
+
+def window(grain):
+    cur = current_bucket(grain, TODAY)
+    return range(cur - WINDOWS[grain] + 1, cur + 1)
+
+
+def log_totals(users, keys_of):
+    """{(key, grain, bucket): metric vector} straight from each user's activity log."""
+    out = {}; first = TODAY - timedelta(days=500)
+    for uid, u in users.items():
+        for o in range(first.toordinal(), TODAY.toordinal() + 1):
+            if not u.activity.has(o): continue
+            vec = np.array([u.activity.get(m, o, 0) for m in METRICS], dtype=float)
+            for g in GRAINS:
+                b = bucket(g, o)
+                if b is None or b not in window(g): continue
+                for key in keys_of(uid, u):
+                    out[(key, g, b)] = out.get((key, g, b), 0.0) + vec
+    return out
+
+
+def assert_matches(ru, scope, expected, keys):
+    table = ru.tables[scope]
+    for key in keys:
+        for g in GRAINS:
+            for b in window(g):
+                want = expected.get((key, g, b), np.zeros(len(METRICS)))
+                got = [ru.seq.read(lambda: table.get(key, g, b, m)) for m in METRICS]
+                assert got == pytest.approx(want.tolist(), abs=1e-6), (scope, key, g, b)
+
+
+@pytest.fixture(scope="module")
+def state():
+    return synth.generate(60, seed=3, years=1.5, today=TODAY)
+
+
+def test_build_matches_log_sums(state):
+    users = state["users"]; ru = Rollups.build(users, state["teams"], TODAY)
+    assert_matches(ru, "user", log_totals(users, lambda uid, u: [uid]), users)
+    for scope in GROUP_SCOPES:
+        keys = {getattr(u, scope) for u in users.values() if getattr(u, scope)}
+        assert_matches(ru, scope, log_totals(users, lambda uid, u: [getattr(u, scope)] if getattr(u, scope) else []), keys)
+
+
+def test_incremental_updates_match_rebuild():
+    state = synth.generate(60, seed=4, years=0.5, today=TODAY)
+    users, teams = state["users"], state["teams"]; ru = Rollups.build(users, teams, TODAY)
+    rng = random.Random(4); uids = sorted(users); names = sorted(teams); cities = sorted({u.city for u in users.values()})
+    for _ in range(400):
+        uid = rng.choice(uids); u = users[uid]; op = rng.random()
+        if op < 0.7:   # a walk on a recent day
+            day = TODAY.toordinal() - rng.randrange(80); minutes = rng.randrange(10, 90); miles = round(minutes / 20, 2)
+            u.activity.add(day, minutes, minutes * 100, miles, minutes * 4, walks=1)
+            ru.record(uid, u, day, minutes, minutes * 100, miles, minutes * 4, walks=1)
+        elif op < 0.9:   # switch (or leave) team
+            old, new = u.team, rng.choice(names + [None])
+            if old == new: continue
+            ru.move(uid, u.activity, "team", old, new)
+            if old: teams[old]["members"].discard(uid)
+            if new: teams[new]["members"].add(uid)
+            u.team = new
+        else:
+            old, new = u.city, rng.choice(cities)
+            if old != new: ru.move(uid, u.activity, "city", old, new); u.city = new
+    rebuilt = Rollups.build(users, teams, TODAY)
+    for scope in ("user",) + GROUP_SCOPES:
+        keys = set(rebuilt.tables[scope].rows) | set(ru.tables[scope].rows)
+        for key in keys:
+            for g in GRAINS:
+                last = current_bucket(g, TODAY)
+                want = rebuilt.tables[scope].series(key, g, last, WINDOWS[g])
+                assert ru.tables[scope].series(key, g, last, WINDOWS[g]) == pytest.approx(want, abs=1e-6), (scope, key, g)
+    for name in names:
+        for start in (TODAY - timedelta(days=6), TODAY - timedelta(days=60), TODAY - timedelta(days=170)):
+            assert ru.team_miles.miles(name, start, TODAY) == pytest.approx(rebuilt.team_miles.miles(name, start, TODAY), abs=1e-6)
+
+
+def test_trend_and_period_total_read_the_current_buckets(state):
+    users = state["users"]; ru = Rollups.build(users, state["teams"], TODAY); uid = sorted(users)[0]
+    starts, totals = ru.trend("user", uid, "weekly", 4, TODAY)
+    assert starts[-1] == TODAY - timedelta(days=TODAY.weekday()) and len(totals) == 4
+    week = sum(users[uid].activity.get("steps", o, 0) for o in range(starts[-1].toordinal(), TODAY.toordinal() + 1))
+    assert ru.period_total("user", uid, "steps", "weekly", TODAY) == pytest.approx(week)
+    too_old = current_bucket("weekly", TODAY) - WINDOWS["weekly"]
+    assert ru.tables["user"].get(uid, "weekly", too_old, "steps") is None
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Route geometry and RouteIndex.near against straightforward haversine scans."""
+import math, random
+import numpy as np
+import pytest
+from walking_buddies.routes import (EARTH_KM, KM_PER_DEG, RouteIndex, decode_polyline, densify, encode_polyline,
+                                    simplify, track_fields)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+def random_track(rng, lat0=40.70, lon0=-74.00, spread_km=15.0):
+    """A wandering walk of 100 m steps starting somewhere within ``spread_km`` of (lat0, lon0)."""
+    lat = lat0 + rng.uniform(-1, 1) * spread_km / KM_PER_DEG; lon = lon0 + rng.uniform(-1, 1) * spread_km / KM_PER_DEG
+    heading = rng.uniform(0, 2 * math.pi); pts = [(lat, lon)]
+    for _ in range(rng.randint(2, 150)):
+        heading += rng.gauss(0, 0.4)
+        lat += 0.1 * math.cos(heading) / KM_PER_DEG; lon += 0.1 * math.sin(heading) / (KM_PER_DEG * math.cos(math.radians(lat)))
+        pts.append((lat, lon))
+    lat, lon = zip(*pts)
+    return np.array(lat), np.array(lon)
+
+
+# ---------- polyline codec ----------
+def test_polyline_matches_the_published_example():
+    lat, lon = np.array([38.5, 40.7, 43.252]), np.array([-120.2, -120.95, -126.453])
+    assert encode_polyline(lat, lon) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert np.allclose(decode_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@"), (lat, lon))
+
+@pytest.mark.parametrize("seed", range(10))
+def test_polyline_round_trip(seed):
+    rng = random.Random(seed); lat, lon = random_track(rng)
+    text = encode_polyline(lat, lon); dlat, dlon = decode_polyline(text)
+    assert len(dlat) == len(lat)
+    assert np.abs(dlat - lat).max() <= 0.5e-5 + 1e-12 and np.abs(dlon - lon).max() <= 0.5e-5 + 1e-12
+    assert encode_polyline(dlat, dlon) == text   # decoded points are on the grid: exact from here on
+    assert encode_polyline(lat[:1], lon[:1]) and len(decode_polyline("")[0]) == 0
+
+
+# ---------- simplify ----------
+def line_km(lat, lon, i, j, m, k):
+    """Distance of point m from the line through points i and j, equirectangular with cos(latitude) ``k``."""
+    x = lambda n: ((lon[n] - lon[i]) * k * KM_PER_DEG, (lat[n] - lat[i]) * KM_PER_DEG)
+    (sx, sy), (px, py) = x(j), x(m)
+    norm = math.hypot(sx, sy)
+    return math.hypot(px, py) if norm == 0 else abs(sx * py - sy * px) / norm
+
+@pytest.mark.parametrize("seed", range(10))
+def test_simplify_keeps_every_dropped_point_within_tolerance(seed):
+    rng = random.Random(seed); lat, lon = random_track(rng); k = math.cos(math.radians(float(np.mean(lat))))
+    kept_at = {}
+    for tol in (0.0, 1.0, 5.0, 25.0, 100.0):
+        slat, slon = simplify(lat, lon, tol)
+        idx = [int(np.flatnonzero((lat == a) & (lon == b))[0]) for a, b in zip(slat, slon)]
+        assert idx == sorted(idx) and idx[0] == 0 and idx[-1] == len(lat) - 1   # a subsequence, ends kept
+        for i, j in zip(idx, idx[1:]):
+            assert all(line_km(lat, lon, i, j, m, k) * 1000 <= tol + 1e-9 for m in range(i + 1, j))
+        kept_at[tol] = set(idx)
+    assert kept_at[100.0] <= kept_at[25.0] <= kept_at[5.0] <= kept_at[1.0] <= kept_at[0.0]
+
+def test_simplify_straight_line_to_its_ends():
+    lat, lon = np.linspace(40.0, 40.1, 50), np.linspace(-74.0, -74.0, 50)
+    slat, slon = simplify(lat, lon, 1.0)
+    assert list(slat) == [40.0, 40.1] and list(slon) == [-74.0, -74.0]
+
+
+# ---------- distance from geometry ----------
+@pytest.mark.parametrize("seed", range(5))
+def test_distance_is_the_haversine_length_of_the_raw_track(seed):
+    rng = random.Random(seed); lat, lon = random_track(rng)
+    f = track_fields(lat, lon, tolerance_m=25.0)
+    want = sum(haversine(lat[n], lon[n], lat[n + 1], lon[n + 1]) for n in range(len(lat) - 1))
+    assert f["distance_km"] == pytest.approx(want, abs=1e-3)
+    assert f["distance_km"] == pytest.approx(0.1 * (len(lat) - 1), rel=1e-3)   # 100 m steps, not the simplified line
+    assert f["points"] == len(decode_polyline(f["polyline"])[0]) <= len(lat)
+
+def test_one_degree_of_latitude():
+    assert track_fields(np.array([10.0, 11.0]), np.array([5.0, 5.0]))["distance_km"] == pytest.approx(KM_PER_DEG, abs=1e-3)
+
+
+# ---------- RouteIndex.near ----------
+def brute_near(tracks, lat, lon):
+    """km from (lat, lon) to the nearest point of each track, densified to ~20 m and measured by haversine."""
+    out = {}
+    for name, (tlat, tlon) in tracks.items():
+        dlat, dlon = densify(tlat, tlon, 0.02 / KM_PER_DEG)
+        out[name] = min(haversine(lat, lon, a, b) for a, b in zip(dlat.tolist(), dlon.tolist()))
+    return out
+
+@pytest.mark.parametrize("seed", range(5))
+def test_near_agrees_with_a_brute_force_haversine_filter(seed):
+    rng = random.Random(seed); tracks = {}; routes = []
+    for n in range(40):
+        f = track_fields(*random_track(rng), tolerance_m=0.0)
+        routes.append({"user_id": f"u{n % 7}", "name": f"r{n}", **f})
+        tracks[f"r{n}"] = decode_polyline(f["polyline"])
+    index = RouteIndex(routes); hits = 0; eps = 0.02   # projection and densification error at these distances
+    for _ in range(10):
+        lat = 40.70 + rng.uniform(-0.2, 0.2); lon = -74.00 + rng.uniform(-0.2, 0.2); radius = rng.uniform(0.2, 6.0)
+        got = {r["name"]: km for km, r in index.near(lat, lon, radius, limit=len(routes))}
+        want = brute_near(tracks, lat, lon)
+        assert {n for n, km in want.items() if km <= radius - eps} <= set(got) <= {n for n, km in want.items() if km <= radius + eps}
+        assert all(got[n] == pytest.approx(want[n], abs=eps) for n in got)
+        assert list(got.values()) == sorted(got.values()); hits += len(got)
+    assert hits   # the queries did find routes
+    hidden = index.near(40.70, -74.00, 50.0, visible=lambda r: r["user_id"] != "u0", limit=len(routes))
+    assert len(hidden) == sum(r["user_id"] != "u0" for r in routes)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""The CSR buddy graph against plain adjacency sets."""
+import random
+import numpy as np
+import pytest
+from walking_buddies.social import SocialGraph
+
+
+def graph(seed, n=200, m=900, compact_every=64):
+    rng = random.Random(seed); names = [f"u{i:03d}" for i in range(n)]
+    adj = {u: set() for u in names}; g = SocialGraph(compact_every=compact_every)
+    for u in names: g.add_user(u)
+    for _ in range(m // 30):   # batches, some duplicates and self-loops, some left pending
+        batch = [(rng.choice(names), rng.choice(names)) for _ in range(30)]
+        new = {(a, b) for a, b in batch if a != b and b not in adj[a]}
+        added = g.add_edges(batch)
+        assert {frozenset(p) for p in added} == {frozenset(p) for p in new}
+        for a, b in batch:
+            if a != b: adj[a].add(b); adj[b].add(a)
+    return g, adj, names
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_point_queries_match_sets(seed):
+    g, adj, names = graph(seed); rng = random.Random(seed)
+    for u in names:
+        assert sorted(g.friends(u)) == sorted(adj[u]) and g.degree(u) == len(adj[u])
+    for _ in range(2000):
+        a, b = rng.choice(names), rng.choice(names)
+        assert g.is_friend(a, b) == (b in adj[a])
+        assert g.within_two_hops(a, b) == (b in adj[a] or bool(adj[a] & adj[b]))
+
+
+def test_bulk_queries_match_sets():
+    g, adj, names = graph(7)
+    for u in names[::9]:
+        two = set().union(adj[u], *(adj[f] for f in adj[u])) - {u}
+        assert g.reachable_two_hops(u, names).tolist() == [n in two for n in names]
+        assert g.mutual_counts(u, names).tolist() == [len(adj[u] & adj[n]) for n in names]
+        counts = {n: len(adj[u] & adj[n]) for n in names if n != u and n not in adj[u] and adj[u] & adj[n]}
+        assert g.suggestions(u, 10) == sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))[:10]
+
+
+def test_edges_and_stats_after_compaction():
+    g, adj, names = graph(11)
+    assert sorted(g.edges()) == sorted((a, b) for a in names for b in adj[a] if a < b)
+    stats = g.degree_stats(); deg = np.array([len(adj[u]) for u in names])
+    assert stats["edges"] == deg.sum() // 2 and stats["max"] == deg.max()
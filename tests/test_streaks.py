@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""StreakState against a from-scratch scan of the active days."""
+import random
+import pytest
+from walking_buddies.streaks import StreakState
+
+
+def runs(days):
+    """(last day, run ending on it, longest run) the straightforward way."""
+    days = sorted(days); longest = run = 0; prev = None
+    for d in days:
+        run = run + 1 if prev is not None and d == prev + 1 else 1
+        longest = max(longest, run); prev = d
+    return prev, run, longest
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_record_in_any_order_matches_scan(seed):
+    rng = random.Random(seed)
+    days = rng.sample(range(1000, 1120), rng.randint(1, 90))
+    order = sorted(days) if seed % 4 == 0 else days   # in order, and with backfills
+    active = set(); s = StreakState()
+    for d in order:
+        active.add(d); s.record(d, active.__contains__)
+        assert (s.last_day, s.current, s.longest) == runs(active)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_rebuild_matches_scan(seed):
+    rng = random.Random(seed)
+    days = [rng.randrange(500, 700) for _ in range(150)]   # duplicates are one day
+    s = StreakState.rebuild(days)
+    assert (s.last_day, s.current, s.longest) == runs(set(days))
+
+
+def test_current_for_only_counts_a_streak_that_reaches_today():
+    s = StreakState.rebuild([10, 11, 12])
+    assert s.current_for(12) == 3 and s.current_for(13) == 0
+    assert StreakState().current_for(1) == 0
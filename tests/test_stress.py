@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""One shared engine hammered from a thread pool: points, journal and every index must stay consistent."""
+import numpy as np
+import pytest
+from walking_buddies import stress
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_concurrent_writers_keep_state_consistent(threads):
+    res = stress.run(300, 3000, threads, seed=threads)
+    assert res["problems"] == []
+
+
+def test_mix_includes_team_and_privacy_writers():
+    kinds = {k for k, _, _ in stress._ops(np.random.default_rng(0), ["a", "b"], 2000, 0.3)}
+    assert {"team", "privacy", "walk", "redeem"} <= kinds
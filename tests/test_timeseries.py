@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Running lifetime totals against re-summing every day after each write."""
+import random
+from datetime import date
+import numpy as np
+import pytest
+from walking_buddies.core import total_calories, total_miles, verify_totals
+from walking_buddies.timeseries import METRICS, ActivityLog
+from walking_buddies.users import UserRecord
+
+BASE = date(2026, 1, 1).toordinal()
+
+
+def resum(days):
+    """Lifetime totals the old way: sum every recorded day."""
+    return {m: sum(v[m] for v in days.values()) for m in METRICS}
+
+
+def assert_exact(log, days):
+    expected = resum(days)
+    for m in METRICS:
+        assert log.total(m) == pytest.approx(expected[m], abs=1e-6), m
+    assert log.check_totals() == {}
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_running_totals_equal_a_full_recompute_after_every_write(seed):
+    rng = random.Random(seed); log = ActivityLog(); days = {}   # ordinal -> {metric: value}
+    cols = log.view("steps")   # the legacy {iso_day: value} view, used for deletions
+    for _ in range(400):
+        op = rng.random(); o = BASE + rng.randrange(-60, 120)   # backfills before the first day too
+        row = days.setdefault(o, {m: 0 for m in METRICS}) if op < 0.6 else None
+        if op < 0.4:
+            vals = dict(minutes=rng.randrange(60), steps=rng.randrange(9000), miles=round(rng.random() * 4, 2),
+                        calories=rng.randrange(400), walks=rng.randrange(3))
+            log.add(o, **vals)
+            for m, v in vals.items(): row[m] += v
+        elif op < 0.6:
+            m = rng.choice(METRICS); v = round(rng.random() * 5, 2) if m == "miles" else rng.randrange(5000)
+            log.set(m, o, v); row[m] = v
+        elif op < 0.85:
+            n = rng.randrange(1, 20); ords = np.array([BASE + rng.randrange(-60, 120) for _ in range(n)])
+            steps = np.array([rng.randrange(5000) for _ in range(n)]); miles = np.round(np.random.default_rng(seed).random(n), 2)
+            log.add_many(ords, minutes=10, steps=steps, miles=miles, walks=1)
+            for k, d in enumerate(ords.tolist()):
+                r = days.setdefault(d, {m: 0 for m in METRICS})
+                r["minutes"] += 10; r["steps"] += int(steps[k]); r["miles"] += float(miles[k]); r["walks"] += 1
+        else:
+            iso = date.fromordinal(o).isoformat()
+            if o in days and log.has(o): del cols[iso]; del days[o]
+            else:
+                with pytest.raises(KeyError): del cols[iso]
+        assert_exact(log, days)
+
+
+def test_checker_reports_and_repairs_drift():
+    u = UserRecord("ann"); log = u.activity
+    log.add(BASE, 30, 3000, 1.5, 120, 1); log.add(BASE + 1, 20, 2000, 1.0, 80, 1)
+    assert verify_totals(u) == {}
+    log.totals["miles"] += 7.0; log.totals["calories"] -= 5   # drift, e.g. a write that bypassed the log API
+    bad = verify_totals(u)
+    assert set(bad) == {"miles", "calories"} and bad["miles"] == (pytest.approx(9.5), pytest.approx(2.5))
+    assert verify_totals(u) == {} and total_miles(u) == pytest.approx(2.5) and total_calories(u) == 200
+
+
+def test_recompute_after_loading_matches_the_running_sums():
+    rng = random.Random(3); live = ActivityLog(); loaded = ActivityLog()
+    for _ in range(200):
+        o = BASE + rng.randrange(365); vals = (rng.randrange(60), rng.randrange(9000), rng.random() * 3, rng.randrange(300))
+        live.add(o, *vals)
+        loaded.add(o, *vals)
+    loaded.totals = {m: 0 for m in METRICS}; loaded.recompute_totals()   # what Store.load does after bulk-filling columns
+    for m in METRICS: assert loaded.total(m) == pytest.approx(live.total(m))
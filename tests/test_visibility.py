@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Compiled visibility checks against reading each owner's privacy settings directly."""
+import random
+import pytest
+from walking_buddies.privacy import DEFAULT_PRIVACY
+from walking_buddies.visibility import KINDS, VisibilityService
+
+AUDIENCES = ("private", "friends", "team", "public")
+
+
+def audience(privacy, kind):
+    """What the original checks read, setting by setting."""
+    if kind == "profile": return privacy["profileVisibility"]
+    if kind == "photos": return privacy["photos"]["defaultAudience"]
+    if kind == "routes": return privacy["routes"]["defaultShare"]
+    lb = privacy["leaderboards"]
+    return "public" if lb["public"] else "team" if lb["teamVisible"] else "private"
+
+
+def allowed(aud, owner, viewer, friends, team):
+    if owner == viewer or aud == "public": return True
+    if aud == "friends": return viewer in friends[owner]
+    if aud == "team": return team[owner] is not None and team[owner] == team[viewer]
+    return False
+
+
+def random_privacy(rng):
+    if rng.random() < 0.3: return DEFAULT_PRIVACY
+    return DEFAULT_PRIVACY.with_changes({
+        ("profileVisibility",): rng.choice(AUDIENCES), ("photos", "defaultAudience"): rng.choice(AUDIENCES),
+        ("routes", "defaultShare"): rng.choice(AUDIENCES), ("leaderboards", "public"): rng.random() < 0.3,
+        ("leaderboards", "teamVisible"): rng.random() < 0.7})
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_checks_match_settings_after_changes(seed):
+    rng = random.Random(seed); users = [f"u{i:02d}" for i in range(60)]; teams = ["red", "blue", "green", None]
+    vis = VisibilityService(); privacy = {}; team = {}; friends = {u: set() for u in users}
+    for u in users:
+        privacy[u] = random_privacy(rng); team[u] = rng.choice(teams); vis.register(u, privacy[u], team[u])
+    for step in range(600):   # interleave privacy, team and buddy changes with checks
+        u, v = rng.sample(users, 2); op = rng.random()
+        if op < 0.25: privacy[u] = random_privacy(rng); vis.set_privacy(u, privacy[u])
+        elif op < 0.5: team[u] = rng.choice(teams); vis.set_team(u, team[u])
+        elif op < 0.8: friends[u].add(v); friends[v].add(u); vis.add_friendship(u, v)
+        else: friends[u].discard(v); friends[v].discard(u); vis.remove_friendship(u, v)
+        if step % 50: continue
+        for kind in KINDS:
+            for viewer in users[::7]:
+                expected = [o for o in users if allowed(audience(privacy[o], kind), o, viewer, friends, team)]
+                assert vis.visible_owners(kind, viewer, users) == expected
+                assert [o for o in users if vis.can_view(kind, o, viewer)] == expected
+
+
+def test_unknown_owner_is_hidden_and_version_moves_on_change():
+    vis = VisibilityService(); vis.register("a", DEFAULT_PRIVACY)
+    assert not vis.predicate("profile", "a")("ghost")
+    v = vis.version; vis.set_privacy("a", DEFAULT_PRIVACY); assert vis.version == v   # unchanged audiences
+    vis.set_privacy("a", DEFAULT_PRIVACY.with_changes({("profileVisibility",): "public"})); assert vis.version > v
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Walking Buddies engine: storage and indexes shared by every app session."""
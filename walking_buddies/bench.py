@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmarks for the app's hot paths over synthetic populations.
+
+Each population size runs in its own process: a ``synth`` population is indexed by a
+headless ``core.Engine`` over an empty temporary database, and every case calls the
+engine's own method on random users.
+Latency is measured per call (p50/p95/max); peak memory per call is measured separately
+under tracemalloc so it does not skew the timings, and the process peak RSS is reported per
+size. Memoized views are invalidated before each call, so they are timed cold. Results go
+to JSON; ``--compare`` reports cases that got slower than a previous run::
+
+    python -m walking_buddies.bench --sizes 1000,10000,100000 --out bench.json
+    python -m walking_buddies.bench --sizes 1000,10000 --compare bench.json
+"""
+import argparse, gc, json, os, platform, subprocess, sys, tempfile, time, tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from . import synth
+from .core import CHALLENGE_CATALOG, Engine
+from .storage import open_store
+
+try:
+    import resource
+except ImportError:   # not on Windows: no peak RSS
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+Case = Tuple[str, Callable[[np.random.Generator], Any]]
+
+
+def _peak_rss_mib()->Optional[float]:
+    if resource is None: return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)   # KiB on Linux
+
+def load_engine(state: Dict[str, Any], db: str)->Engine:
+    """An engine over ``state``, writing to the database at ``db``, with no event journal."""
+    return Engine(open_store(db), state)
+
+
+# ---------- cases ----------
+def cases(engine: Engine, state: Dict[str, Any], edges: List[Tuple[str, str]])->List[Case]:
+    users = list(state["users"]); store = engine.store
+    joined = [(uid, ch) for uid, chs in state["user_challenges"].items() for ch in chs] or [(users[0], CHALLENGE_CATALOG[0]["id"])]
+    battles = state["team_battles"]; edges = edges or [(users[0], users[-1])]
+    pairs = [(m["from"], m["to"]) for m in state["messages"][:10000]] or edges
+    pick = lambda rng, seq: seq[int(rng.integers(len(seq)))]
+    def cold(fn):   # memoized views: move the state version so each call recomputes
+        def run(rng): store.bump(); return fn(rng)
+        return run
+    def find(rng):
+        viewer = pick(rng, users); return engine.find_buddies(viewer, state["users"][viewer].city[:3])
+    out: List[Case] = [
+        ("award_walk", lambda rng: engine.award_walk(pick(rng, users), 30, 3500, 1.6, 120, bool(rng.random() < 0.2), False)),
+        ("update_challenges_after_walk", lambda rng: engine.update_challenges_after_walk(pick(rng, joined)[0])),
+        ("_ensure_user_challenge", lambda rng: engine._ensure_user_challenge(*pick(rng, joined))),
+        ("get_leaderboards", cold(lambda rng: engine.get_leaderboards(pick(rng, users)))),
+        ("my_leaderboard_position", cold(lambda rng: engine.my_leaderboard_position(pick(rng, users)))),
+        ("get_conversation", lambda rng: engine.get_conversation(*pick(rng, pairs))),
+        ("send_message", lambda rng: engine.send_message(*pick(rng, edges), "On my way")),
+        ("photo_feed", cold(lambda rng: engine.photo_feed(pick(rng, users)))),
+        ("find_buddies", cold(find)),
+    ]
+    if battles:
+        out += [("compute_battle_score", lambda rng: engine.compute_battle_score(pick(rng, battles))),
+                ("score_battles", cold(lambda rng: engine.score_battles(battles)))]
+    return out
+
+def measure(fn: Callable[[np.random.Generator], Any], rng: np.random.Generator, repeat: int, mem_repeat: int)->Dict[str, float]:
+    for _ in range(3): fn(rng)
+    t = np.empty(repeat)
+    gc.disable()
+    try:
+        for i in range(repeat):
+            t0 = time.perf_counter_ns(); fn(rng); t[i] = time.perf_counter_ns() - t0
+    finally:
+        gc.enable()
+    peak = 0
+    tracemalloc.start()
+    try:
+        for _ in range(mem_repeat):
+            tracemalloc.reset_peak(); base = tracemalloc.get_traced_memory()[0]
+            fn(rng); peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    t /= 1e3
+    return {"calls": repeat, "mean_us": round(float(t.mean()), 2), "p50_us": round(float(np.percentile(t, 50)), 2),
+            "p95_us": round(float(np.percentile(t, 95)), 2), "max_us": round(float(t.max()), 2), "peak_kib": round(peak / 1024.0, 1)}
+
+def run_size(n_users: int, seed: int = 0, years: float = 2.0, repeat: int = 200, mem_repeat: int = 20,
+             only: Optional[List[str]] = None)->Dict[str, Any]:
+    """Benchmark one population size in this process (which it leaves holding the population)."""
+    t0 = time.perf_counter()
+    state = synth.generate(n_users, seed, years, challenge_ids=[c["id"] for c in CHALLENGE_CATALOG])
+    edges = list(state["buddies"])   # consumed by the social graph build
+    with tempfile.TemporaryDirectory(prefix="wb-bench-") as tmp:   # the database, its WAL files and lock go with it
+        t1 = time.perf_counter(); engine = load_engine(state, os.path.join(tmp, "bench.db")); t2 = time.perf_counter()
+        rng = np.random.default_rng(seed); store = engine.store; results = {}
+        try:
+            for name, fn in cases(engine, state, edges):
+                if only and name not in only: continue
+                results[name] = measure(fn, rng, repeat, mem_repeat)
+                store.flush()   # outside the timings, so queued writes don't pile up across cases
+        finally:
+            store.close()
+    return {"users": n_users, "generate_s": round(t1 - t0, 3), "build_indexes_s": round(t2 - t1, 3),
+            "peak_rss_mib": _peak_rss_mib(), "cases": results}
+
+
+# ---------- driver ----------
+def _meta(args)->Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=ROOT).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"created": datetime.now().isoformat(timespec="seconds"), "commit": commit, "python": platform.python_version(),
+            "numpy": np.__version__, "machine": platform.machine(), "seed": args.seed, "years": args.years, "repeat": args.repeat}
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], threshold: float = 1.25)->List[str]:
+    """Lines for cases whose p50 or p95 grew by more than ``threshold``x between two result files."""
+    old = {(r["users"], c): v for r in base["results"] for c, v in r["cases"].items()}
+    lines = []
+    for r in new["results"]:
+        for c, v in r["cases"].items():
+            b = old.get((r["users"], c))
+            if b is None: continue
+            for q in ("p50_us", "p95_us"):
+                if b[q] > 0 and v[q] / b[q] > threshold:
+                    lines.append(f"{r['users']:>9} {c:<30} {q} {b[q]:>10.1f} -> {v[q]:>10.1f} us ({v[q] / b[q]:.2f}x)")
+    return lines
+
+def main(argv: Optional[List[str]] = None)->int:
+    ap = argparse.ArgumentParser(description="Benchmark Walking Buddies hot paths across synthetic population sizes.")
+    ap.add_argument("--sizes", default="1000,10000,100000", help="comma-separated user counts (1M users x 2 years needs ~30 GB; lower --years)")
+    ap.add_argument("--seed", type=int, default=0); ap.add_argument("--years", type=float, default=2.0)
+    ap.add_argument("--repeat", type=int, default=200); ap.add_argument("--mem-repeat", type=int, default=20)
+    ap.add_argument("--cases", default="", help="comma-separated case names (default: all)")
+    ap.add_argument("--out", help="write results JSON here")
+    ap.add_argument("--compare", help="previous results JSON; exit 1 if any case regressed")
+    ap.add_argument("--threshold", type=float, default=1.25); ap.add_argument("--verbose", action="store_true")
+    ap.add_argument("--one", type=int, help=argparse.SUPPRESS)   # child mode: one size, JSON as the last line of stdout
+    args = ap.parse_args(argv)
+    only = [c for c in args.cases.split(",") if c] or None
+    if args.one is not None:
+        print(json.dumps(run_size(args.one, args.seed, args.years, args.repeat, args.mem_repeat, only))); return 0
+
+    out = {"meta": _meta(args), "results": []}
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    for n in (int(s) for s in args.sizes.split(",") if s):
+        cmd = [sys.executable, "-m", "walking_buddies.bench", "--one", str(n), "--seed", str(args.seed), "--years", str(args.years),
+               "--repeat", str(args.repeat), "--mem-repeat", str(args.mem_repeat), "--cases", args.cases]
+        proc = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, stderr=None if args.verbose else subprocess.DEVNULL, text=True)
+        if proc.returncode: print(f"size {n}: benchmark process failed ({proc.returncode})", file=sys.stderr); return proc.returncode
+        res = json.loads(proc.stdout.strip().splitlines()[-1]); out["results"].append(res)
+        print(f"\n{n:,} users  (generate {res['generate_s']}s, indexes {res['build_indexes_s']}s, peak RSS {res['peak_rss_mib']} MiB)")
+        print(f"  {'case':<30} {'p50 us':>10} {'p95 us':>10} {'max us':>10} {'peak KiB':>10}")
+        for c, v in res["cases"].items():
+            print(f"  {c:<30} {v['p50_us']:>10.1f} {v['p95_us']:>10.1f} {v['max_us']:>10.1f} {v['peak_kib']:>10.1f}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fp: json.dump(out, fp, indent=1)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fp: slower = compare(json.load(fp), out, args.threshold)
+        print(f"\n{len(slower)} regression(s) over {args.threshold}x" + (":\n" + "\n".join(slower) if slower else ""))
+        if slower: return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
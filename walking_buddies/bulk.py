@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Vectorized scoring for batches of walks.
+
+``score_walks`` gives every walk in a batch the points ``award_walk`` would give it when
+logged on its own day: minutes, group and photo bonuses, and the streak bonus for the run
+of consecutive walked days ending that day. Runs are found for all users at once by
+sorting (user, day) keys together with each user's existing walk days, so a batch costs a
+few array passes rather than one Python call per walk. Walks within a batch count in
+timestamp order; feed a backfill chronologically when it spans several batches.
+"""
+from datetime import datetime
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, Mapping, Optional, Sequence, Union
+import numpy as np
+import pandas as pd
+
+COLUMNS = ("user_id", "minutes", "steps", "miles", "calories", "is_group", "shared_photo", "mood", "ts")
+_DEFAULTS = {"steps": 0, "miles": 0.0, "calories": 0, "is_group": False, "shared_photo": False, "mood": None}
+_EPOCH_ORDINAL = 719163   # date(1970, 1, 1).toordinal()
+Records = Union[pd.DataFrame, Iterable[Mapping[str, Any]], Iterable[Sequence]]
+
+
+def normalize(frame: pd.DataFrame, now: Optional[datetime] = None)->pd.DataFrame:
+    """Fill optional columns, coerce types the way ``award_walk`` does and add ``day`` ordinals; sorted by user then time."""
+    frame = frame.copy()
+    for col, default in _DEFAULTS.items():
+        if col not in frame: frame[col] = default
+    frame["ts"] = pd.to_datetime(frame["ts"]) if "ts" in frame else pd.Timestamp(now or datetime.now())
+    frame["ts"] = frame["ts"].fillna(pd.Timestamp(now or datetime.now()))
+    for col in ("minutes", "steps", "calories"): frame[col] = frame[col].fillna(0).astype(np.int64)   # int() truncation
+    frame["miles"] = frame["miles"].fillna(0.0).astype(float)
+    for col in ("is_group", "shared_photo"): frame[col] = frame[col].fillna(False).astype(bool)
+    frame["user_id"] = frame["user_id"].astype(str)
+    frame["day"] = frame["ts"].dt.floor("D").dt.tz_localize(None).to_numpy().astype("datetime64[D]").astype(np.int64) + _EPOCH_ORDINAL
+    return frame.sort_values(["user_id", "ts"], kind="stable", ignore_index=True)
+
+def chunks(records: Records, size: int = 100_000)->Iterator[pd.DataFrame]:
+    """DataFrames of at most ``size`` walks from a DataFrame, or an iterator of dicts or ``COLUMNS``-ordered tuples."""
+    if isinstance(records, pd.DataFrame):
+        for start in range(0, len(records), size): yield records.iloc[start:start + size]
+        return
+    it = iter(records)
+    while True:
+        rows = list(islice(it, size))
+        if not rows: return
+        yield pd.DataFrame(rows) if isinstance(rows[0], Mapping) else pd.DataFrame(rows, columns=COLUMNS[:len(rows[0])])
+
+
+def run_lengths(codes: np.ndarray, days: np.ndarray, history: Dict[int, np.ndarray])->np.ndarray:
+    """Length of the run of consecutive walked days ending on each (code, day), counting ``history`` days too."""
+    keys = (codes.astype(np.int64) << 32) | days
+    old = [(np.int64(c) << 32) | np.asarray(h, dtype=np.int64) for c, h in history.items() if len(h)]
+    walked = np.unique(np.concatenate([keys] + old))
+    starts = np.ones(len(walked), dtype=bool); starts[1:] = np.diff(walked) != 1   # user changes jump by ~2**32
+    pos = np.arange(len(walked))
+    run = pos - np.maximum.accumulate(np.where(starts, pos, 0)) + 1
+    return run[np.searchsorted(walked, keys)]
+
+def score_walks(frame: pd.DataFrame, history: Dict[str, np.ndarray], rules: Mapping[str, int])->pd.DataFrame:
+    """``frame`` (normalized) with ``streak`` and ``points`` columns; ``history`` maps user id -> existing walk-day ordinals."""
+    codes, users = pd.factorize(frame["user_id"], sort=True)
+    lookup = {u: i for i, u in enumerate(users)}
+    days = frame["day"].to_numpy(np.int64)
+    history = {lookup[u]: h for u, h in history.items() if u in lookup and len(h)}
+    streak = run_lengths(codes, days, history)
+    latest = np.full(len(users), np.iinfo(np.int64).min)
+    for c, h in history.items(): latest[c] = np.asarray(h).max()
+    streak[days < latest[codes]] = 0   # like StreakState.current_for: a day older than the last walk has no live streak
+    points = frame["minutes"].to_numpy(np.int64) * rules["base_per_minute"]
+    points += np.where(frame["is_group"].to_numpy(), rules["group_walk_bonus"], 0)
+    points += np.where(frame["shared_photo"].to_numpy(), rules["photo_share"], 0)
+    points += np.where(streak >= 30, rules["streak_30"], np.where(streak >= 7, rules["streak_7"], 0))
+    return frame.assign(streak=streak, points=points)
+
+def per_day(scored: pd.DataFrame)->pd.DataFrame:
+    """Activity sums and walk counts per (user, day), ready for ``ActivityLog.add_many``."""
+    return scored.groupby(["user_id", "day"], sort=False).agg(
+        minutes=("minutes", "sum"), steps=("steps", "sum"), miles=("miles", "sum"),
+        calories=("calories", "sum"), walks=("minutes", "size")).reset_index()
+
+def journal_columns(scored: pd.DataFrame)->Dict[str, list]:
+    """Scored walks as plain columns for a ``walks`` journal event (same fields as a single ``walk`` event)."""
+    return {"uid": scored["user_id"].tolist(), "ts": [t.isoformat(timespec="seconds") for t in scored["ts"]],
+            "minutes": scored["minutes"].tolist(), "steps": scored["steps"].tolist(), "miles": scored["miles"].tolist(),
+            "calories": scored["calories"].tolist(), "is_group": scored["is_group"].tolist(),
+            "shared_photo": scored["shared_photo"].tolist(), "mood": [m if isinstance(m, str) else None for m in scored["mood"]],
+            "gained": scored["points"].tolist()}
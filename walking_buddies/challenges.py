@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Challenge rules compiled once and evaluated only when their metric changes.
+
+Every challenge (built-in or personalized) becomes a Rule: which metrics feed it, how to
+read its progress from a user record and what target completes it. Activity totals for a
+week, weekend or month are read from the user's materialized rollups when the caller passes
+them (``totals``), and summed from the activity log otherwise. The engine indexes
+rules by id and keeps, per user, the joined rules subscribed to each metric, so an
+activity event only evaluates challenges the user joined whose metric it touched.
+"""
+import calendar
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+PERIODS = ("daily", "weekly", "weekend", "monthly")
+WALK_METRICS = frozenset({"steps", "minutes", "miles", "calories", "walks"})
+
+
+class PeriodCalendar:
+    """Period keys and inclusive day bounds for one calendar day."""
+    __slots__ = ("today", "keys", "bounds_by_period")
+
+    def __init__(self, today: date):
+        self.today = today
+        y, w, _ = today.isocalendar()
+        monday = date.fromisocalendar(y, w, 1)
+        wd = today.weekday()
+        saturday = today + timedelta(days=(5 - wd)) if wd <= 5 else today - timedelta(days=(wd - 5))
+        month_end = date(today.year, today.month, calendar.monthrange(today.year, today.month)[1])
+        self.keys = {"daily": today.isoformat(), "weekly": f"{y}-W{w:02d}",
+                     "weekend": f"weekend-{saturday.isoformat()}", "monthly": f"{today.year}-{today.month:02d}"}
+        self.bounds_by_period = {"daily": (today, today), "weekly": (monday, monday + timedelta(days=6)),
+                                 "weekend": (saturday, saturday + timedelta(days=1)),
+                                 "monthly": (date(today.year, today.month, 1), month_end)}
+
+    def key(self, period: str)->str:
+        return self.keys.get(period, "alltime")
+
+    def bounds(self, period: str)->Tuple[date, date]:
+        return self.bounds_by_period.get(period, (self.today, self.today))
+
+@lru_cache(maxsize=8)
+def period_calendar(today: date)->PeriodCalendar:
+    return PeriodCalendar(today)
+
+
+# (metric, period, calendar) -> the user's total for that period, or None when it is not materialized
+Totals = Callable[[str, str, PeriodCalendar], Optional[float]]
+Reader = Callable[[Dict[str, Any], Dict[str, Any], PeriodCalendar, Optional[Totals]], float]
+
+def _activity_sum(metric: str, period: Optional[str] = None)->Reader:
+    def read(u, ch, cal, totals):
+        p = period or ch.get("period", "weekly")
+        v = totals(metric, p, cal) if totals is not None else None
+        return v if v is not None else u["activity"].sum(metric, *cal.bounds(p))
+    return read
+
+# Built-in challenge types -> (metrics that feed them, progress reader, target field)
+TYPE_RULES: Dict[str, Tuple[Tuple[str, ...], Reader, str]] = {
+    "daily_steps": (("steps",), _activity_sum("steps", "daily"), "target"),
+    "distance_period": (("miles",), _activity_sum("miles"), "target_miles"),
+    "boolean_weekly": (("photos",), lambda u, ch, cal, totals: int(u.get("photos_this_week", 0)), "target"),
+    "count_monthly": (("invites",), lambda u, ch, cal, totals: int(u.get("invites_this_month", 0)), "target"),
+    "distinct_routes_monthly": (("routes",), lambda u, ch, cal, totals: len(u.get("routes_completed_month", ())), "target_count"),
+}
+CUSTOM_METRICS = ("steps", "minutes", "miles", "walks")
+
+
+class Rule:
+    __slots__ = ("id", "challenge", "period", "metrics", "reader", "target")
+
+    def __init__(self, ch: Dict[str, Any]):
+        self.id = ch["id"]; self.challenge = ch; self.period = ch.get("period", "weekly")
+        self.metrics: Tuple[str, ...] = (); self.reader: Optional[Reader] = None; self.target = 0.0
+        if ch.get("custom", False):
+            metric = ch.get("metric", "steps")
+            if metric in CUSTOM_METRICS:
+                self.metrics = (metric,); self.reader = _activity_sum(metric)
+            self.target = float(ch.get("target_value", 0))
+        elif ch.get("type") in TYPE_RULES:
+            self.metrics, self.reader, field = TYPE_RULES[ch["type"]]
+            self.target = float(ch.get(field, 0))
+
+    def progress(self, u: Dict[str, Any], cal: PeriodCalendar, totals: Optional[Totals] = None)->float:
+        return self.reader(u, self.challenge, cal, totals) if self.reader else 0.0
+
+    def satisfied(self, u: Dict[str, Any], cal: PeriodCalendar, totals: Optional[Totals] = None)->bool:
+        return self.reader is not None and self.progress(u, cal, totals) >= self.target
+
+
+class ChallengeEngine:
+    def __init__(self, challenges: Iterable[Dict[str, Any]] = (), user_challenges: Optional[Dict[str, Dict[str, dict]]] = None):
+        self.rules: Dict[str, Rule] = {}
+        self._pos: Dict[str, int] = {}
+        self.subs: Dict[str, Dict[str, set]] = {}   # uid -> metric -> joined challenge ids
+        for ch in challenges: self.add(ch)
+        for uid, ucs in (user_challenges or {}).items():
+            for ch_id, state in ucs.items():
+                if state.get("joined"): self.subscribe(uid, ch_id)
+
+    def add(self, ch: Dict[str, Any])->Rule:
+        rule = self.rules[ch["id"]] = Rule(ch)
+        self._pos.setdefault(ch["id"], len(self._pos))
+        return rule
+
+    def get(self, ch_id: str)->Optional[Dict[str, Any]]:
+        rule = self.rules.get(ch_id)
+        return rule.challenge if rule else None
+
+    def challenges(self)->List[Dict[str, Any]]:
+        return [r.challenge for r in self.rules.values()]
+
+    def subscribe(self, uid: str, ch_id: str):
+        rule = self.rules.get(ch_id)
+        if rule is None: return
+        by_metric = self.subs.setdefault(uid, {})
+        for m in rule.metrics: by_metric.setdefault(m, set()).add(ch_id)
+
+    def unsubscribe(self, uid: str, ch_id: str):
+        by_metric = self.subs.get(uid, {})
+        for ids in by_metric.values(): ids.discard(ch_id)
+
+    def candidates(self, uid: str, touched: Iterable[str])->List[Rule]:
+        """Joined rules fed by any of the ``touched`` metrics, in catalog order."""
+        by_metric = self.subs.get(uid)
+        if not by_metric: return []
+        ids = set()
+        for m in touched: ids |= by_metric.get(m, set())
+        return [self.rules[i] for i in sorted(ids, key=self._pos.__getitem__)]
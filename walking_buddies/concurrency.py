@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Locks for sharing one engine between concurrent sessions.
+
+``LockStripes`` maps keys (user ids, team names) onto a fixed set of reentrant locks, so
+writes for different users rarely wait on each other and memory does not grow with the
+population; several stripes are always taken in index order, so two writers cannot
+deadlock. ``SharedLock`` lets any number of writers run while the store is not flushing:
+a flush takes it exclusively so it never snapshots half an operation. ``SeqLock`` guards
+indexes that are read far more often than written: writers serialize and bump a sequence
+number around each change, readers run without locking and retry if a write overlapped.
+"""
+import threading
+from contextlib import contextmanager
+from typing import Callable, Hashable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class LockStripes:
+    def __init__(self, n: int = 64):
+        self._locks = [threading.RLock() for _ in range(n)]
+
+    def index(self, key: Hashable)->int:
+        return hash(key) % len(self._locks)
+
+    @contextmanager
+    def hold(self, *keys: Hashable)->Iterator[None]:
+        """Hold the stripes of all ``keys`` (None is ignored); reentrant for the holding thread."""
+        stripes = sorted({self.index(k) for k in keys if k is not None})
+        for i in stripes: self._locks[i].acquire()
+        try: yield
+        finally:
+            for i in reversed(stripes): self._locks[i].release()
+
+
+class SharedLock:
+    """Many shared holders or one exclusive holder; a waiting exclusive holder blocks new shared ones.
+
+    Shared holds are reentrant per thread (a thread that holds it shared never waits for it again),
+    so operations can nest freely inside one another.
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._shared = 0; self._exclusive = False; self._waiting = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def shared(self)->Iterator[None]:
+        depth = getattr(self._local, "depth", 0)
+        if depth == 0:
+            with self._cond:
+                while self._exclusive or self._waiting: self._cond.wait()
+                self._shared += 1
+        self._local.depth = depth + 1
+        try: yield
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                with self._cond:
+                    self._shared -= 1
+                    if not self._shared: self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self)->Iterator[None]:
+        with self._cond:
+            self._waiting += 1
+            while self._exclusive or self._shared: self._cond.wait()
+            self._waiting -= 1; self._exclusive = True
+        try: yield
+        finally:
+            with self._cond: self._exclusive = False; self._cond.notify_all()
+
+
+class SeqLock:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.seq = 0   # odd while a write is in progress
+
+    @contextmanager
+    def write(self)->Iterator[None]:
+        with self._lock:
+            self.seq += 1
+            try: yield
+            finally: self.seq += 1
+
+    def read(self, fn: Callable[[], T], prepare: Optional[Callable[[], None]] = None, retries: int = 8)->T:
+        """``fn()`` computed without a write overlapping it.
+
+        Runs optimistically and retries when the sequence moved (a torn read may also raise, which
+        counts as a retry); after ``retries`` attempts it runs under the writers' lock. ``prepare`` is
+        called before each attempt, e.g. to bring lazily maintained data up to date under ``write``.
+        """
+        for _ in range(retries):
+            if prepare is not None: prepare()
+            start = self.seq
+            if start & 1: continue
+            try: out = fn()
+            except Exception: continue
+            if self.seq == start: return out
+        with self._lock:
+            if prepare is not None: prepare()
+            return fn()
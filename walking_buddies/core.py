@@ -0,0 +1,719 @@
+# -*- coding: utf-8 -*-
+"""The Walking Buddies domain engine, without any UI.
+
+An Engine works on a store's shared state (``Store.state``, or an explicit state dict with
+the same shape) and owns the indexes derived from it. Every domain operation of the app is
+a method: walks, points, badges, challenges, teams and battles, leaderboards, buddies and
+messages, routes, health imports, redemptions and reminders. Writes go through the store as
+usual (``touch_*`` queues them and ``store.flush()`` persists them), and nothing starts on
+import or construction: the reminder timer thread starts only when the caller starts it.
+User-facing notices (e.g. "+20 pts") go to ``notify``; results that the app shows as
+errors are returned instead.
+
+One engine can serve every session of a process. A write holds the store open for writing
+(``Store.writing``), then the lock stripes of the users and teams it changes, then at most
+short leaf locks inside the indexes; nothing waits for an outer lock while holding an inner
+one, so writers to different users run side by side and cannot deadlock. Leaderboard pages,
+feed pages and battle scores are read without locking from sequence-locked indexes.
+
+The module imports without Streamlit or pandas (``award_walks_bulk`` loads pandas when
+called), so workers and scripts can use it directly. Its import time is checked with::
+
+    python -m walking_buddies.core --budget-ms 250
+"""
+import argparse, re, subprocess, sys, threading
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+from . import health_import, probes, routes
+from .challenges import ChallengeEngine, WALK_METRICS, period_calendar
+from .concurrency import LockStripes
+from .directory import BuddyDirectory
+from .feed import FeedService
+from .leaderboard import Leaderboards
+from .memo import VersionedCache
+from .messages import MessageIndex
+from .privacy import PrivacySettings
+from .reminders import DEFAULT_SETTINGS as REMINDER_DEFAULTS, MemorySink, ReminderScheduler
+from .rollups import GRAINS, METRICS, Rollups
+from .social import SocialGraph
+from .storage import Store, open_store
+from .users import UserRecord
+from .visibility import VisibilityService
+
+POINT_RULES = {"base_per_minute":1,"streak_7":10,"streak_30":50,"group_walk_bonus":20,"invite_bonus":50,"photo_share":5}
+TIERS=[("Platinum",5000),("Gold",1000),("Silver",500),("Bronze",0)]
+ROLES=["Captain","Co-Captain","Player"]
+
+# Built-in challenge catalog
+CHALLENGE_CATALOG = [
+    {"id":"daily_5000","name":"Daily Step Goal","desc":"Hit 5,000 steps today","type":"daily_steps","target":5000,"period":"daily","reward_points":50},
+    {"id":"weekend_walkathon","name":"Weekend Walkathon","desc":"Walk 10 miles Sat–Sun","type":"distance_period","target_miles":10.0,"period":"weekend","reward_points":150},
+    {"id":"photo_share","name":"Photo Challenge","desc":"Share a scenic walk photo this week","type":"boolean_weekly","target":1,"period":"weekly","reward_points":20},
+    {"id":"invite_3","name":"Invite Challenge","desc":"Invite 3 friends this month","type":"count_monthly","target":3,"period":"monthly","reward_points":100},
+    {"id":"team_100_miles","name":"Team Mileage Goal","desc":"Teams aim for 100 miles combined this week","type":"team_distance_weekly","target_miles":100.0,"period":"weekly","reward_points":300},
+    {"id":"relay_pass_baton","name":"Relay Challenge","desc":"Each member walks 2 miles this week","type":"team_each_member_distance_weekly","target_miles":2.0,"period":"weekly","reward_points":200},
+    {"id":"city_explorer","name":"City Explorer","desc":"Walk 5 distinct neighborhoods this month","type":"distinct_routes_monthly","target_count":5,"period":"monthly","reward_points":120},
+]
+
+REWARD_CATALOG = [
+    {"id":"badge_10_walks","type":"badge","name":"First 10 Walks","cost":0,"desc":"Milestone badge after 10 walks"},
+    {"id":"badge_100_miles","type":"badge","name":"100 Miles Club","cost":0,"desc":"Milestone badge after 100 miles"},
+    {"id":"coupon_sneakers","type":"coupon","name":"Sneaker Discount $10","cost":300,"desc":"$10 off partner sneakers"},
+    {"id":"coupon_cafe","type":"coupon","name":"Local Cafe $5","cost":150,"desc":"$5 voucher at partner cafe"},
+    {"id":"giftcard","type":"gift","name":"Gift Card $20","cost":800,"desc":"Generic gift card"},
+    {"id":"premium_challenge","type":"unlock","name":"Exclusive Challenge Pack","cost":400,"desc":"Unlock premium challenge set"},
+]
+
+# send_message refusals
+BLOCKED = "blocked"; NOT_ALLOWED = "not_allowed"
+
+
+# ---------- per-user helpers ----------
+def calc_streak(u)->int:
+    return u.streak.current_for(date.today().toordinal())
+
+def tier_for_points(p:int)->str:
+    for name, th in TIERS:
+        if p>=th: return name
+    return "Bronze"
+
+# Lifetime totals are running sums kept by the activity log, so these are O(1)
+def total_walks(u): return len(u.get("walk_dates",[]))
+def total_miles(u): return u["activity"].total("miles")
+def total_calories(u): return u["activity"].total("calories")
+
+def verify_totals(u)->Dict[str,tuple]:
+    # Compare running totals against a full recompute; repair and report any drift
+    bad = u["activity"].check_totals()
+    if bad: u["activity"].recompute_totals()
+    return bad
+
+def leaderboard_display_name(u: Dict[str,Any])->str:
+    alias = (u["privacy"].lookup("leaderboards", "alias") or "").strip()
+    if alias: return alias
+    name = (u.get("name") or "User").strip()
+    parts = name.split()
+    if len(parts)>=2: return f"{parts[0]} {parts[1][0]}."
+    return name
+
+def _directory_entry(u: Dict[str,Any]):
+    p = u["privacy"]
+    return (u.get("city",""), u.get("company",""), u.get("available_times",""), p.lookup("discoverability", "byCity"), p.lookup("discoverability", "byCompany"))
+
+def _period_key(period: str)->str:
+    return period_calendar(date.today()).key(period)
+
+def _battle_result(battle: Dict[str,Any], home_m: float, away_m: float)->Dict[str,Any]:
+    # rounded so prefix-sum differences of equal totals still compare as a tie
+    home_m = round(float(home_m), 6); away_m = round(float(away_m), 6)
+    winner = None
+    if home_m > away_m: winner = battle["home"]
+    elif away_m > home_m: winner = battle["away"]
+    return {"home_miles": home_m, "away_miles": away_m, "winner": winner}
+
+
+# ---------- index builders ----------
+def _build_social(state)->SocialGraph:
+    # the loaded edge list is only needed to build the graph, which is the in-memory record from then on
+    social = SocialGraph(state.pop("buddies", ()))
+    for uid in state["users"]: social.add_user(uid)
+    social.compact()
+    return social
+
+def _build_feed(state, social: SocialGraph)->FeedService:
+    users, teams = state["users"], state["teams"]
+    feed = FeedService(
+        friends_of=social.friends,
+        team_of=lambda uid: users[uid].get("team") if uid in users else None,
+        members_of=lambda team: teams.get(team, {}).get("members", set()),
+        expire_days_of=lambda uid: users[uid]["privacy"].lookup("photos", "autoExpireDays", default=365) if uid in users else 365)
+    for ph in state["photos"]: feed.publish(ph)
+    return feed
+
+def _build_directory(state)->BuddyDirectory:
+    directory = BuddyDirectory()
+    for uid, u in state["users"].items(): directory.sync(uid, *_directory_entry(u))
+    return directory
+
+def _build_reminders(state)->ReminderScheduler:
+    # per-user settings live on the user record, due times only in the scheduler; its timer thread is started by the caller
+    users = state["users"]
+    sched = ReminderScheduler(MemorySink(), quiet_hours_of=lambda uid: users[uid]["privacy"].lookup("notifications", "quietHours") if uid in users else None)
+    for uid, u in users.items():
+        if u.get("reminders"): sched.configure(uid, u["reminders"])
+    return sched
+
+def _build_routes(state)->routes.RouteIndex:
+    # per-owner lookup plus the spatial grid behind "routes near me"; the index is the record from then on
+    return routes.RouteIndex(state.pop("routes", ()))
+
+def _build_visibility(state, social: SocialGraph)->VisibilityService:
+    vis = VisibilityService()
+    for uid, u in state["users"].items(): vis.register(uid, u["privacy"], u.get("team"), social.friends(uid))
+    return vis
+
+
+class Engine:
+    # methods wrapped by timing probes while recording is on (see set_probes)
+    PROBED = ("add_points", "find_buddies", "photo_feed", "add_buddies", "_ensure_user_challenge", "challenge_progress",
+              "evaluate_challenges", "award_walk", "award_walks_bulk", "import_health", "redeem", "add_route", "routes_near",
+              "send_message", "get_conversation", "get_leaderboards", "my_leaderboard_position", "join_team",
+              "compute_battle_score", "score_battles", "award_battle_points", "update_reminders")
+
+    def __init__(self, store: Store, state: Optional[Dict[str,Any]] = None, catalog: List[Dict[str,Any]] = CHALLENGE_CATALOG,
+                 rules: Dict[str,int] = POINT_RULES, notify: Optional[Callable[[str], Any]] = None):
+        """Index ``state`` (default: ``store.state``, which it becomes) for the domain operations below.
+
+        Building consumes the state's ``buddies`` and ``routes`` lists: the social graph and the route
+        index are the in-memory record from then on.
+        """
+        if state is not None: store.state = state
+        state = store.state
+        self.store = store; self.catalog = catalog; self.rules = rules
+        self.notify = notify or (lambda message: None)
+        # Shared, persisted collections: users, teams, messages, photos ([{'user_id','miles','notes','ts','audience'}]),
+        # team_battles, custom_challenges, user_challenges, badges
+        # team -> {"captain": uid, "members": set(), "roles": {uid: "Captain|Co-Captain|Player"}, ...}
+        # user_challenges: {uid: {challenge_id: {"joined":bool,"completed":bool,"last_reset":periodKey}}}
+        self.users: Dict[str, UserRecord] = state["users"]; self.teams = state["teams"]
+        self.messages = state["messages"]; self.photos = state["photos"]; self.team_battles = state["team_battles"]
+        self.custom_challenges = state["custom_challenges"]; self.user_challenges = state["user_challenges"]; self.badges = state["badges"]
+        # Derived indexes, kept current by the methods below
+        self.social = _build_social(state); self.feed = _build_feed(state, self.social); self.directory = _build_directory(state)
+        self.leaderboards = Leaderboards.build(self.users)
+        self.rollups = Rollups.build(self.users, self.teams, date.today())   # period totals per user/team/city/company, team daily miles
+        self.challenges = ChallengeEngine(catalog + self.custom_challenges, self.user_challenges)
+        self.conversations = MessageIndex(self.messages); self.visibility = _build_visibility(state, self.social)
+        self.reminder_scheduler = _build_reminders(state); self.route_index = _build_routes(state)
+        self.views = VersionedCache()
+        # Locks: stripes per user id / ("team", name); the index lock guards social, directory, messages, routes and challenges
+        self.locks = LockStripes(); self._index_lock = threading.RLock(); self._battle_lock = threading.Lock()
+        if probes.RECORDER.enabled: self.set_probes(True)
+
+    def set_probes(self, on: bool):
+        """Time the PROBED methods of this engine into ``probes.RECORDER`` (on) or restore the bare methods (off)."""
+        if on: probes.instrument(self, self.PROBED)
+        else: probes.uninstrument(self, self.PROBED)
+
+    def close(self):
+        self.reminder_scheduler.stop(); self.store.flush(); self.store.close()
+
+    # ---------- helpers & user model ----------
+    @contextmanager
+    def _write(self, *keys: Hashable)->Iterator[None]:
+        # A change to the records of ``keys`` (uids, ("team", name)): no flush in between, one writer per record
+        with self.store.writing(), self.locks.hold(*keys): yield
+
+    def mark_dirty(self, uid: str):
+        self.store.touch_user(uid)
+
+    def state_version(self)->int:
+        # Moves on every recorded write and every effective privacy, team or buddy change
+        return self.store.version + self.visibility.version
+
+    def memo_view(self, key, compute):
+        # Derived data (scores, feed pages, board rows) reused until the state version moves; treat results as read-only
+        return self.views.get(key, self.state_version(), compute)
+
+    def ensure_user(self, uid: str, name: Optional[str]=None)->UserRecord:
+        user = self.users.get(uid)
+        if user is None:
+            with self._write(uid):
+                user = self.users.get(uid)
+                if user is not None: return user
+                # slotted record: walk_dates/streak/activity plus {iso_day: value} *_log views over the activity log;
+                # privacy starts as the shared immutable defaults and edits swap in a copy-on-write PrivacySettings
+                with self.store.journaled("user", uid=uid, name=name or uid): user = UserRecord(name or uid)
+                self.leaderboards.sync(uid, int(user.points), user.team); self.visibility.register(uid, user.privacy)
+                with self._index_lock: self.directory.sync(uid, *_directory_entry(user)); self.social.add_user(uid)
+                self.users[uid] = user; self.mark_dirty(uid)   # published to other sessions once indexed
+        return user
+
+    def update_profile(self, uid: str, name: str, city: str, company: str, available_times: str)->UserRecord:
+        u=self.ensure_user(uid, name)
+        with self._write(uid), self.store.journaled("profile", uid=uid, name=name, city=city, company=company, available_times=available_times):
+            for scope, new in (("city", city), ("company", company)):
+                old = u[scope]
+                if old != new: self.rollups.move(uid, u.activity, scope, old or None, new or None)
+            u["name"]=name; u["city"]=city; u["company"]=company; u["available_times"]=available_times
+            self.mark_dirty(uid); self.index_user(uid)
+        return u
+
+    def set_privacy(self, uid: str, settings):
+        # edits apply live; the visibility service recompiles only when an audience changed
+        u=self.ensure_user(uid)
+        overrides = settings.overrides if isinstance(settings, PrivacySettings) else settings
+        with self._write(uid), self.store.journaled("privacy", uid=uid, settings=overrides):
+            u["privacy"]=settings; self.index_user(uid); self.visibility.set_privacy(uid, settings)
+        self.store.bump()   # e.g. a new alias must show on memoized leaderboards
+
+    def rank_user(self, uid: str):
+        # Re-rank after a points or team change: O(log n) in the leaderboards index
+        u = self.users[uid]
+        self.leaderboards.sync(uid, int(u.points), u.team)
+
+    def index_user(self, uid: str):
+        # Re-index city/company/availability/discoverability for buddy search; no-op when unchanged
+        with self._index_lock: self.directory.sync(uid, *_directory_entry(self.users[uid]))
+
+    def find_buddies(self, viewer_id: str, city_query: str = "", company_query: str = "", time: Optional[str] = None, limit: int = 20, after: Optional[str] = None):
+        # Page of discoverable users matching the filters, profile privacy checked only for the page; (ids, next cursor)
+        with self._index_lock:
+            return self.directory.search(city_query, company_query, time, exclude=viewer_id,
+                                         visible=self.visibility.predicate("profile", viewer_id), limit=limit, after=after)
+
+    def add_points(self, uid, pts, reason=""):
+        u=self.ensure_user(uid,uid)
+        with self._write(uid), self.store.journaled("points", uid=uid, delta=int(pts), reason=reason):
+            u.points=int(u.points)+int(pts); self.mark_dirty(uid); self.rank_user(uid)
+        if reason: self.notify(f"+{pts} pts: {reason}")
+
+    def redeem(self, uid: str, item: Dict[str,Any])->bool:
+        # Spend points on a catalog item; False (nothing changes) when the user can't afford it
+        u=self.ensure_user(uid,uid); cost=int(item["cost"])
+        with self._write(uid):   # the balance check and the deduction are one step
+            if int(u.points) < cost: return False
+            with self.store.journaled("redeem", uid=uid, item=item["id"], cost=cost):
+                u.points=int(u.points)-cost; self.mark_dirty(uid); self.rank_user(uid)
+        return True
+
+    def evolve_avatar(self, user_id: str):
+        u = self.ensure_user(user_id, user_id)
+        miles = total_miles(u); streak = calc_streak(u)
+        level = 1
+        if miles >= 50 or streak >= 14: level = 2
+        if miles >= 150 or streak >= 30: level = 3
+        if miles >= 300 or streak >= 60: level = 4
+        u["avatar_level"] = level
+
+    def check_and_award_badges(self, user_id: str):
+        u = self.ensure_user(user_id, user_id)
+        b = self.badges.setdefault(user_id, set())
+        if total_walks(u) >= 10: b.add("badge_10_walks")
+        if total_miles(u) >= 100.0: b.add("badge_100_miles")
+        self.mark_dirty(user_id)
+        self.evolve_avatar(user_id)
+
+    # Privacy helpers: answered by the compiled visibility service, kept current by add_buddies, join_team and set_privacy
+    def is_friend(self, a, b)->bool:
+        return self.visibility.is_friend(a, b)
+    def same_team(self, a, b)->bool:
+        return self.visibility.same_team(a, b)
+    def can_view_photo(self, ph: Dict[str,Any], viewer_id: str)->bool:
+        return self.visibility.can_see(ph.get("audience","friends"), ph["user_id"], viewer_id)
+    def can_view_profile(self, owner_id: str, viewer_id: str)->bool:
+        return self.visibility.can_view("profile", owner_id, viewer_id)
+
+    def photo_feed(self, viewer_id: str, limit: int = 20, before: Optional[int] = None):
+        # Newest-first page of the viewer's timeline, plus the cursor for older posts (None when exhausted)
+        return self.memo_view(("feed", viewer_id, limit, before, date.today()),
+                              lambda: self.feed.page(viewer_id, limit, before, visible=self.can_view_photo))
+
+    def add_buddies(self, pairs: List[tuple]):
+        # One batch into the social graph; only edges that are actually new get persisted and re-checked for privacy
+        for a, b in pairs: self.ensure_user(a); self.ensure_user(b)
+        with self.store.writing(), self._index_lock, self.store.journaled("buddies") as event:
+            added = self.social.add_edges(pairs); event["pairs"] = added
+            for a, b in added: self.visibility.add_friendship(a, b)
+            self.feed.add_buddies(added); self.store.add_buddies(added)
+        return added
+
+    # ---------- challenges (built-in + personalized) ----------
+    def get_challenge_by_id(self, ch_id: str):
+        return self.challenges.get(ch_id)
+
+    def add_challenge(self, ch: Dict[str,Any]):
+        # a personalized challenge: {"id","name","desc","custom":True,"scope","metric","target_value","period","reward_points","creator"}
+        with self.store.writing(), self._index_lock, self.store.journaled("new_challenge", **ch):
+            self.custom_challenges.append(ch); self.store.touch_challenge(ch); self.challenges.add(ch)
+
+    def _ensure_user_challenge(self, uid: str, ch_id: str):
+        uc = self.user_challenges.setdefault(uid, {})
+        if ch_id not in uc:
+            uc[ch_id] = {"joined": False, "completed": False, "last_reset": None}
+        ch = self.get_challenge_by_id(ch_id)
+        if ch:
+            p = ch.get("period","weekly")
+            key=_period_key(p)
+            if uc[ch_id]["last_reset"] != key:
+                uc[ch_id]["completed"] = False
+                uc[ch_id]["last_reset"] = key
+                self.mark_dirty(uid)
+        return uc[ch_id]
+
+    def challenge_state(self, uid, ch_id)->Dict[str,Any]:
+        # {"joined","completed","last_reset"} for this period, as a snapshot for display
+        with self._write(uid): return dict(self._ensure_user_challenge(uid, ch_id))
+
+    def challenge_progress(self, uid, ch)->float:
+        rule = self.challenges.rules.get(ch["id"])
+        if rule is None: return 0.0
+        today = date.today()
+        return self.memo_view(("progress", uid, ch["id"], today),
+                              lambda: rule.progress(self.ensure_user(uid, uid), period_calendar(today), self._period_totals(uid)))
+
+    def _period_totals(self, uid: str):
+        # The user's materialized week/weekend/month totals for challenge rules; other periods fall back to the activity log
+        rollups = self.rollups
+        return lambda metric, period, cal: rollups.period_total("user", uid, metric, period, cal.today) if period in GRAINS else None
+
+    def join_challenge(self, uid, ch_id):
+        with self._write(uid):
+            uc=self._ensure_user_challenge(uid, ch_id)
+            with self.store.journaled("challenge", uid=uid, id=ch_id, action="join", period=uc["last_reset"]): uc["joined"]=True; self.mark_dirty(uid)
+            self.challenges.subscribe(uid, ch_id)
+
+    def leave_challenge(self, uid, ch_id):
+        with self._write(uid):
+            uc=self._ensure_user_challenge(uid, ch_id)
+            with self.store.journaled("challenge", uid=uid, id=ch_id, action="leave", period=uc["last_reset"]): uc["joined"]=False; self.mark_dirty(uid)
+            self.challenges.unsubscribe(uid, ch_id)
+
+    def complete_challenge_if_eligible(self, uid, ch):
+        # the completion and its reward are one journaled event, so a replay marks it done and pays it once
+        u = self.ensure_user(uid, uid)
+        with self._write(uid):
+            uc = self._ensure_user_challenge(uid, ch["id"])
+            if uc["completed"] or not uc["joined"]:
+                return False
+            rule = self.challenges.rules.get(ch["id"])
+            if not (rule and rule.satisfied(u, period_calendar(date.today()), self._period_totals(uid))): return False
+            pts = int(ch.get("reward_points",0))
+            with self.store.journaled("challenge", uid=uid, id=ch["id"], action="complete", period=uc["last_reset"], reward=pts):
+                uc["completed"] = True; u.points=int(u.points)+pts; self.mark_dirty(uid); self.rank_user(uid)
+        if pts: self.notify(f"+{pts} pts: {ch['name']}")
+        return True
+
+    def evaluate_challenges(self, uid, touched):
+        # Only the challenges this user joined whose metric was touched by the event
+        for rule in self.challenges.candidates(uid, touched):
+            self.complete_challenge_if_eligible(uid, rule.challenge)
+
+    def update_challenges_after_walk(self, uid, shared_photo=False):
+        self.evaluate_challenges(uid, WALK_METRICS | {"photos"} if shared_photo else WALK_METRICS)
+
+    # ---------- logging & points ----------
+    def award_walk(self, uid, minutes, steps, miles, calories, is_group, shared_photo, mood=None):
+        u=self.ensure_user(uid,uid); store=self.store; rules=self.rules; now=datetime.now(); today=now.date().isoformat()
+        with self._write(uid):
+            with store.journaled("walk", uid=uid, ts=now.isoformat(timespec="seconds"), minutes=int(minutes), steps=int(steps), miles=float(miles),
+                                 calories=int(calories), is_group=bool(is_group), shared_photo=bool(shared_photo), mood=mood) as event:
+                # append walk and logs
+                day=now.date().toordinal(); log=u.activity; first_today=not log.walked(day)
+                u.walk_dates.append(day); store.add_walk(uid, now); store.touch_day(uid, today)
+                log.add(day, minutes, steps, miles, calories, walks=1)
+                if first_today: u.streak.record(day, log.walked)
+                self.rollups.record(uid, u, day, minutes, steps, miles, calories, walks=1)
+                # points
+                gained=int(minutes)*rules["base_per_minute"]
+                if is_group: gained+=rules["group_walk_bonus"]
+                if shared_photo:
+                    gained+=rules["photo_share"]
+                    audience = u.privacy.lookup("photos", "defaultAudience")
+                    photo = {"user_id": uid, "miles": miles, "notes": "Shared a scenic photo", "ts": now.isoformat(timespec="seconds"), "audience": audience}
+                    with store.journaled("photo", **photo):
+                        u.photos_this_week=int(u.photos_this_week)+1; self.photos.append(photo); store.add_photo(photo); self.feed.publish(photo)
+                s=calc_streak(u)
+                if s>=30: gained+=rules["streak_30"]
+                elif s>=7: gained+=rules["streak_7"]
+                u.points=int(u.points)+gained; self.rank_user(uid); event["gained"]=gained
+                # mood
+                if mood: u["mood_log"][today]=mood
+            self.check_and_award_badges(uid)
+            self.update_challenges_after_walk(uid, shared_photo)
+        return gained, u.points, s
+
+    def award_walks_bulk(self, records, chunk_size=100_000):
+        # Backfills: same points as award_walk per walk (streak bonus as of the walk's day), written per (user, day);
+        # records is a DataFrame or iterator of dicts/tuples with bulk.COLUMNS, ts defaulting to now.
+        # Badges, avatars, ranks and challenges run once per affected user at the end. Returns a per-user totals DataFrame.
+        import pandas as pd
+        from . import bulk
+        from .streaks import StreakState
+        store=self.store; rollups=self.rollups; feed=self.feed; users=self.users
+        totals={}
+        for chunk in bulk.chunks(records, chunk_size):
+            frame=bulk.normalize(chunk)
+            uids=frame["user_id"].unique()
+            for uid in uids: self.ensure_user(uid, uid)
+            with self._write(*uids):
+                scored=bulk.score_walks(frame, {uid: users[uid].walk_dates for uid in uids}, self.rules)
+                with store.journaled("walks", **bulk.journal_columns(scored)):
+                    store.add_walks(zip(scored["user_id"], scored["ts"].tolist()))
+                    days=bulk.per_day(scored)
+                    store.touch_days((uid, date.fromordinal(d).isoformat()) for uid, d in zip(days["user_id"], days["day"]))
+                    for uid, g in days.groupby("user_id", sort=False):
+                        u=users[uid]; o=g["day"].to_numpy(); cols=[g[m].to_numpy() for m in METRICS]
+                        u.activity.add_many(o, *cols); rollups.record_many(uid, u, o, *cols)
+                    for uid, g in scored.groupby("user_id", sort=False):
+                        u=users[uid]; u.walk_dates.extend(g["day"].tolist()); u.streak=StreakState.rebuild(u.walk_dates)
+                        u.points=int(u.points)+int(g["points"].sum())
+                        t=totals.setdefault(uid, [0, 0, False]); t[0]+=len(g); t[1]+=int(g["points"].sum()); t[2]=t[2] or bool(g["shared_photo"].any())
+                    for row in scored[scored["shared_photo"]].itertuples(index=False):
+                        u=users[row.user_id]
+                        photo={"user_id": row.user_id, "miles": row.miles, "notes": "Shared a scenic photo", "ts": row.ts.isoformat(timespec="seconds"),
+                               "audience": u.privacy.lookup("photos", "defaultAudience")}
+                        with store.journaled("photo", **photo):
+                            u.photos_this_week=int(u.photos_this_week)+1; self.photos.append(photo); store.add_photo(photo); feed.publish(photo)
+                    for row in scored[scored["mood"].notna()].itertuples(index=False):
+                        users[row.user_id]["mood_log"][date.fromordinal(row.day).isoformat()]=row.mood
+        for uid, (n, gained, photos) in totals.items():
+            with self._write(uid): self.rank_user(uid); self.check_and_award_badges(uid); self.update_challenges_after_walk(uid, photos)
+        return pd.DataFrame([(uid, n, gained, users[uid].points, calc_streak(users[uid]))
+                             for uid, (n, gained, _) in totals.items()], columns=["user_id","walks","gained","points","streak"])
+
+    def import_health(self, uid, files):
+        # files: [(name, binary file object)]; parsed as a stream, only the metrics this user shares per source are kept
+        u=self.ensure_user(uid,uid); store=self.store
+        aggs=health_import.aggregators_for(u.privacy)
+        for name, fp in files: health_import.parse_export(fp, name, aggs)
+        with self._write(uid):
+            touched=set()
+            with store.journaled("activity", uid=uid) as event:
+                changed=health_import.merge_days(u.activity, health_import.resolve(aggs))
+                event["days"]={date.fromordinal(day).isoformat(): {m: u.activity.get(m, day) for m in inc} for day, inc in changed}
+                for day, inc in changed:
+                    store.touch_day(uid, date.fromordinal(day).isoformat()); touched.update(inc)
+                    self.rollups.record(uid, u, day, **inc)
+            if not changed: return 0, aggs
+            self.mark_dirty(uid); self.check_and_award_badges(uid); self.evaluate_challenges(uid, touched)
+        return len(changed), aggs
+
+    # ---------- routes & messaging ----------
+    def add_route(self, uid, name, distance_km, notes, audience, track=None):
+        # track: optional (lat, lon) arrays, e.g. from a GPX file; stored simplified, and its geometry sets the distance
+        route = {"user_id": uid, "name": name, "distance_km": float(distance_km), "notes": notes, "created_at": datetime.now().isoformat(timespec="seconds"), "audience": audience}
+        if track is not None and len(track[0]): route.update(routes.track_fields(*track))
+        u = self.ensure_user(uid, uid)
+        with self._write(uid):
+            with self._index_lock, self.store.journaled("route", **route):
+                if self.route_index.remove(uid, name) is not None: self.store.delete_route(uid, name)   # re-adding a name replaces the route
+                self.route_index.add(route); self.store.add_route(route)
+                # City Explorer counts the neighborhoods a GPS route passed through; a route without a track counts as one
+                u["routes_completed_month"].update(route.get("neighborhoods") or (name,)); self.mark_dirty(uid)
+            self.evaluate_challenges(uid, {"routes"})
+        return route
+
+    def list_routes(self, uid):
+        with self._index_lock: return self.route_index.of_user(uid)
+
+    def delete_route(self, uid, name):
+        with self.store.writing(), self._index_lock, self.store.journaled("route_delete", uid=uid, name=name):
+            self.route_index.remove(uid, name); self.store.delete_route(uid, name)
+
+    def routes_near(self, viewer_id, lat, lon, radius_km, limit=50):
+        # [(km, route)] of other users' routes passing within radius_km that the viewer may see, nearest first
+        vis = self.visibility
+        with self._index_lock:
+            return self.route_index.near(lat, lon, radius_km, limit=limit,
+                                         visible=lambda r: r["user_id"] != viewer_id and vis.can_see(r.get("audience", "private"), r["user_id"], viewer_id))
+
+    def send_message(self, sender_id, recipient_id, text)->Optional[str]:
+        # Respect messaging privacy: block list + who can message. None when sent, else BLOCKED or NOT_ALLOWED
+        recip = self.ensure_user(recipient_id)
+        msg_policy = recip["privacy"]["messaging"]
+        if sender_id in msg_policy["blocked"]: return BLOCKED
+        allow = msg_policy["allowRequests"]
+        ok = False
+        with self.store.writing(), self._index_lock:
+            if allow == "anyone": ok = True
+            elif allow == "friends_of_friends":
+                # friend or shares any buddy in common
+                ok = self.social.within_two_hops(sender_id, recipient_id)
+            elif allow == "friends_only":
+                ok = self.social.is_friend(recipient_id, sender_id)
+            if not ok: return NOT_ALLOWED
+            msg = {"from": sender_id, "to": recipient_id, "text": text, "ts": datetime.now().isoformat(timespec="seconds")}
+            with self.store.journaled("message", **msg): self.messages.append(msg); self.conversations.append(msg); self.store.add_message(msg)
+        return None
+
+    def mark_read(self, reader, other):
+        with self._index_lock: self.conversations.mark_read(reader, other)
+
+    def get_conversation(self, a, b, limit=50, before=None):
+        # One page of the a<->b log, oldest first, plus the cursor for the next older page (None at the start)
+        with self._index_lock: return self.conversations.page(a, b, limit, before)
+
+    # ---------- leaderboards (privacy-aware) ----------
+    def _leaderboard_visibility(self, viewer_id: str):
+        # Predicate for "may viewer see uid on a leaderboard?"; a few O(1) lookups per owner
+        return self.visibility.predicate("leaderboard", viewer_id)
+
+    def get_leaderboards(self, viewer_id: str, page: int = 0, page_size: int = 25, members_per_team: int = 10):
+        # (individual rows, team rows, team member rows) for one page of each board, as lists of dicts
+        return self.memo_view(("leaderboards", viewer_id, page, page_size, members_per_team),
+                              lambda: self._leaderboards_page(viewer_id, page, page_size, members_per_team))
+
+    def _leaderboards_page(self, viewer_id: str, page: int, page_size: int, members_per_team: int):
+        # One page of each board, read from the ranked index: O(log n + page) instead of scanning every user;
+        # a consistent snapshot taken without locking (see Leaderboards.read)
+        return self.leaderboards.read(lambda: self._read_leaderboards_page(viewer_id, page, page_size, members_per_team))
+
+    def _read_leaderboards_page(self, viewer_id: str, page: int, page_size: int, members_per_team: int):
+        users = self.users; boards = self.leaderboards
+        visible = self._leaderboard_visibility(viewer_id)
+        user_rows, _ = boards.users.page(page*page_size, page_size, visible)
+        users_out = [{"rank": r+1, "user": leaderboard_display_name(users[uid]), "points": pts, "team": users[uid].get("team") or ""}
+                     for r, uid, pts in user_rows]
+        team_rows, _ = boards.teams.page(page*page_size, page_size)
+        teams_out = [{"rank": r+1, "team": t, "points": pts} for r, t, pts in team_rows]
+
+        members_out=[]
+        for _, tname, _ in sorted(team_rows, key=lambda row: row[1]):
+            roles = self.teams.get(tname, {}).get("roles", {})
+            members, _ = boards.members[tname].page(0, members_per_team, visible)
+            for _, member, pts in members:
+                members_out.append({"team": tname, "user": leaderboard_display_name(users[member]), "points": pts, "role": roles.get(member, "Player")})
+        members_out.sort(key=lambda row: (row["team"], row["role"], -row["points"]))
+        return users_out, teams_out, members_out
+
+    def my_leaderboard_position(self, viewer_id: str, radius: int = 2):
+        # (1-based rank, population size, neighbour rows) for the viewer on the individual board
+        self.ensure_user(viewer_id)
+        return self.memo_view(("position", viewer_id, radius), lambda: self._leaderboard_position(viewer_id, radius))
+
+    def _leaderboard_position(self, viewer_id: str, radius: int):
+        users = self.users; board = self.leaderboards.users; visible = self._leaderboard_visibility(viewer_id)
+        def read():
+            rows = board.around(viewer_id, radius, visible)
+            around = [{"rank": r+1, "user": "You" if uid == viewer_id else leaderboard_display_name(users[uid]), "points": pts}
+                      for r, uid, pts in rows]
+            return board.rank(viewer_id)+1, len(board), around
+        return self.leaderboards.read(read)
+
+    # ---------- teams & team battles ----------
+    def join_team(self, uid: str, team_name: str, team_city: str = "", team_company: str = ""):
+        u = self.ensure_user(uid, uid); teams = self.teams
+        while True:
+            old = u.get("team")
+            with self._write(uid, ("team", old) if old else None, ("team", team_name)):
+                if u.get("team") != old: continue   # moved by another session meanwhile: lock its new team instead
+                with self.store.journaled("team", uid=uid, team=team_name, city=team_city, company=team_company):
+                    leaving = old if old and old != team_name and old in teams else None
+                    if leaving:
+                        # leave the previous team so battles and boards only count current members
+                        teams[old]["members"].discard(uid); teams[old].get("roles", {}).pop(uid, None); self.store.touch_team(old)
+                    team=teams.setdefault(team_name, {"captain":uid,"members":set(),"roles":{}, "city":team_city,"company":team_company})
+                    # carry the member's totals over to the new team's rollups and battle mileage
+                    self.rollups.move(uid, u.activity, "team", leaving, None if uid in team["members"] else team_name)
+                    u["team"]=team_name; self.mark_dirty(uid); self.rank_user(uid); self.visibility.set_team(uid, team_name)
+                    team["members"].add(uid); team["city"]=team_city; team["company"]=team_company
+                    if not team.get("roles"): team["roles"][uid] = "Captain"; team["captain"]=uid
+                    else: team["roles"].setdefault(uid, "Player")
+                    self.store.touch_team(team_name)
+                    return
+
+    def set_role(self, uid: str, team_name: str, role: str):
+        with self._write(("team", team_name)), self.store.journaled("role", uid=uid, team=team_name, role=role):
+            team = self.teams[team_name]
+            team["roles"][uid] = role
+            if role == "Captain": team["captain"] = uid
+            self.store.touch_team(team_name)
+
+    def create_battle(self, battle: Dict[str,Any]):
+        # {'id','name','home','away','start','end','reward_points','winner_awarded'}
+        with self.store.writing(), self._battle_lock, self.store.journaled("new_battle", **battle):
+            self.team_battles.append(battle); self.store.touch_battle(battle)
+
+    def _sum_team_miles_for_range(self, team_name: str, start_iso: str, end_iso: str)->float:
+        return self.rollups.team_miles.miles(team_name, date.fromisoformat(start_iso), date.fromisoformat(end_iso))
+
+    def compute_battle_score(self, battle: Dict[str,Any])->Dict[str,Any]:
+        home_m = self._sum_team_miles_for_range(battle["home"], battle["start"], battle["end"])
+        away_m = self._sum_team_miles_for_range(battle["away"], battle["start"], battle["end"])
+        return _battle_result(battle, home_m, away_m)
+
+    def score_battles(self, battles: List[Dict[str,Any]])->List[Dict[str,Any]]:
+        if not battles: return []
+        return self.memo_view(("battles", tuple(b["id"] for b in battles)), lambda: self._score_battles(battles))
+
+    def _score_battles(self, battles: List[Dict[str,Any]])->List[Dict[str,Any]]:
+        # Every battle's home and away totals in one vectorized prefix-sum lookup
+        teams = [b["home"] for b in battles] + [b["away"] for b in battles]
+        starts = [date.fromisoformat(b["start"]) for b in battles] * 2
+        ends = [date.fromisoformat(b["end"]) for b in battles] * 2
+        miles = self.rollups.team_miles.miles_many(teams, starts, ends); n = len(battles)
+        return [_battle_result(b, miles[i], miles[n + i]) for i, b in enumerate(battles)]
+
+    def award_battle_points(self, battle: Dict[str,Any]):
+        if battle.get("winner_awarded"): return
+        res = self.compute_battle_score(battle)
+        winner = res["winner"]
+        if not winner: return
+        pts = int(battle.get("reward_points", 200))
+        members = list(self.teams.get(winner, {}).get("members", ()))
+        # the battle lock makes the award once-only; the members' stripes are taken together, as join_team does
+        with self.store.writing(), self._battle_lock, self.locks.hold(("team", winner), *members):
+            if battle.get("winner_awarded"): return
+            with self.store.journaled("battle", id=battle["id"], winner=winner):
+                for uid in members:
+                    self.add_points(uid, pts//max(1,len(members)), f"Team Battle win: {battle['name']}")
+                battle["winner_awarded"] = True
+                self.store.touch_battle(battle)
+
+    # ---------- period rollups ----------
+    def activity_trend(self, scope: str, key: str, grain: str = "weekly", periods: int = 12)->List[Dict[str,Any]]:
+        # Totals per week, weekend or month for a user or a team/city/company, oldest first: O(periods) from the rollups
+        starts, totals = self.rollups.trend(scope, key, grain, periods, date.today())
+        return [dict(period=d, **{m: float(v) for m, v in zip(METRICS, row)}) for d, row in zip(starts, totals)]
+
+    def rebuild_rollups(self):
+        # Recompute every rollup from the activity logs, with writes held off meanwhile (e.g. after repairing logs)
+        with self.store.quiesced(): self.rollups = Rollups.build(self.users, self.teams, date.today())
+
+    # ---------- reminders ----------
+    def reminder_settings(self, uid)->Dict[str,Any]:
+        # {"walk_enabled","walk_every_min","stand_enabled","stand_every_min","snooze_minutes"}; saved on the user record
+        return dict(self.ensure_user(uid, uid).get("reminders") or REMINDER_DEFAULTS)
+
+    def update_reminders(self, uid, settings, reset=False):
+        # Re-times only the kinds whose interval or on/off changed, unless reset restarts both from now
+        u=self.ensure_user(uid,uid); sched=self.reminder_scheduler
+        with self._write(uid):
+            if settings != (u.get("reminders") or REMINDER_DEFAULTS):
+                with self.store.journaled("reminders", uid=uid, settings=dict(settings)): u["reminders"]=dict(settings); self.mark_dirty(uid)
+            if reset:
+                for kind in ("walk","stand"): sched.cancel(uid, kind)
+            sched.configure(uid, settings)
+
+
+def open_engine(db_path: str, journal_dir: Optional[str] = None, **kwargs)->Engine:
+    """Open the store at ``db_path`` and build an engine over it.
+
+    Opening replays journaled events newer than the database; the rules in force are journaled for offline rescoring.
+    """
+    store = open_store(db_path, journal_dir)
+    with store.journaled("rules", **kwargs.get("rules", POINT_RULES)): pass
+    return Engine(store, **kwargs)
+
+
+# ---------- import-time budget ----------
+HEAVY = ("streamlit", "pandas")   # must not load with the core
+
+def import_profile(module: str = "walking_buddies.core")->Tuple[float, List[Tuple[float, str]], List[str]]:
+    """(cumulative ms, [(self ms, module)] slowest first, heavy modules loaded) for importing ``module`` in a fresh interpreter."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True)
+    rows = []; total = 0.0
+    for line in proc.stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", line)
+        if m is None: continue
+        rows.append((int(m.group(1)) / 1e3, m.group(4).strip()))
+        if m.group(4) == module: total = int(m.group(2)) / 1e3
+    heavy = sorted({name for _, name in rows if name.split(".")[0] in HEAVY})
+    return total, sorted(rows, reverse=True), heavy
+
+def main(argv=None)->int:
+    ap = argparse.ArgumentParser(description="Measure the import time of the headless Walking Buddies engine.")
+    ap.add_argument("--budget-ms", type=float, default=250.0); ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--top", type=int, default=10)
+    args = ap.parse_args(argv)
+    runs = [import_profile() for _ in range(max(1, args.runs))]
+    total, rows, heavy = min(runs, key=lambda r: r[0])   # best of N: the least disturbed by other load
+    print(f"import walking_buddies.core: {total:.1f} ms (best of {len(runs)}), budget {args.budget_ms:.0f} ms")
+    for ms, name in rows[:args.top]: print(f"  {ms:8.1f} ms  {name}")
+    if heavy: print(f"heavy modules loaded: {', '.join(heavy)}")
+    return 1 if heavy or total > args.budget_ms else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Inverted index behind Find Local Buddies.
+
+Users are indexed by normalized city (when discoverable by city), company (when
+discoverable by company) and usual walk time. City names are also indexed by trigram,
+so a partial city search narrows to matching city names without scanning users. Posting
+lists are kept sorted by user id, so a page is read by walking the smallest matching list
+from the cursor and testing the other filters per user; nothing is re-sorted per page.
+"""
+import heapq
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from sortedcontainers import SortedSet
+
+def normalize(text: str)->str:
+    return " ".join((text or "").casefold().split())
+
+def trigrams(text: str)->Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class BuddyDirectory:
+    def __init__(self):
+        self.by_city: Dict[str, SortedSet] = {}
+        self.by_company: Dict[str, SortedSet] = {}
+        self.by_time: Dict[str, SortedSet] = {}
+        self.city_grams: Dict[str, Set[str]] = {}   # trigram -> normalized city names
+        self.discoverable = SortedSet()             # everyone findable by city
+        self._entries: Dict[str, Tuple[str, str, str, bool, bool]] = {}
+
+    def _post(self, index: Dict[str, SortedSet], key: str, uid: str, add: bool):
+        if add:
+            index.setdefault(key, SortedSet()).add(uid)
+            if index is self.by_city and len(index[key]) == 1:
+                for g in trigrams(key): self.city_grams.setdefault(g, set()).add(key)
+        elif key in index:
+            index[key].discard(uid)
+            if not index[key]:
+                del index[key]
+                if index is self.by_city:
+                    for g in trigrams(key):
+                        cities = self.city_grams.get(g)
+                        if cities is not None:
+                            cities.discard(key)
+                            if not cities: del self.city_grams[g]
+
+    def _apply(self, uid: str, entry: Tuple[str, str, str, bool, bool], add: bool):
+        city, company, times, by_city, by_company = entry
+        if by_city:
+            self._post(self.by_city, city, uid, add)
+            (self.discoverable.add if add else self.discoverable.discard)(uid)
+        if by_company and company: self._post(self.by_company, company, uid, add)
+        self._post(self.by_time, times, uid, add)
+
+    def sync(self, uid: str, city: str, company: str, times: str, by_city: bool, by_company: bool):
+        """(Re)index one user; a no-op when nothing relevant changed."""
+        entry = (normalize(city), normalize(company), times or "", bool(by_city), bool(by_company))
+        old = self._entries.get(uid)
+        if old == entry: return
+        if old is not None: self._apply(uid, old, False)
+        self._apply(uid, entry, True); self._entries[uid] = entry
+
+    def remove(self, uid: str):
+        old = self._entries.pop(uid, None)
+        if old is not None: self._apply(uid, old, False)
+
+    def _cities_matching(self, q: str)->List[str]:
+        if len(q) < 3:
+            return [c for c in self.by_city if q in c]
+        grams = sorted((self.city_grams.get(g, set()) for g in trigrams(q)), key=len)
+        if not grams or not grams[0]: return []
+        return [c for c in set.intersection(*grams) if q in c]
+
+    def _walk(self, city_query: str, company_query: str, time: Optional[str], after: Optional[str])->Iterator[str]:
+        """Matching user ids in id order, strictly after ``after``."""
+        lists: List[Tuple[int, Iterable[SortedSet]]] = []; tests: List[Callable[[str], bool]] = []
+        q = normalize(city_query); cq = normalize(company_query); entries = self._entries
+        if q:
+            matched = self._cities_matching(q)
+            if not matched: return
+            posts = [self.by_city[c] for c in matched]; cities = set(matched)
+            lists.append((sum(map(len, posts)), posts))
+            tests.append(lambda uid: entries[uid][3] and entries[uid][0] in cities)
+        elif not cq:
+            lists.append((len(self.discoverable), [self.discoverable])); tests.append(self.discoverable.__contains__)
+        for index, key in ((self.by_company, cq), (self.by_time, time if time != "Any" else None)):
+            if not key: continue
+            post = index.get(key)
+            if post is None: return
+            lists.append((len(post), [post])); tests.append(post.__contains__)
+        best = min(range(len(lists)), key=lambda k: lists[k][0])
+        rest = tests[:best] + tests[best + 1:]
+        runs = [p.irange(minimum=after, inclusive=(False, True)) if after is not None else iter(p) for p in lists[best][1]]
+        for uid in (runs[0] if len(runs) == 1 else heapq.merge(*runs)):
+            if all(t(uid) for t in rest): yield uid
+
+    def candidates(self, city_query: str = "", company_query: str = "", time: Optional[str] = None)->Set[str]:
+        return set(self._walk(city_query, company_query, time, None))
+
+    def search(self, city_query: str = "", company_query: str = "", time: Optional[str] = None, exclude: Optional[str] = None,
+               visible: Optional[Callable[[str], bool]] = None, limit: int = 20, after: Optional[str] = None)->Tuple[List[str], Optional[str]]:
+        """Page of matching user ids in id order, starting after cursor ``after``; returns (ids, next cursor or None).
+
+        A city query matches discoverable-by-city users; a company query alone matches everyone
+        discoverable by that company. ``visible`` (profile privacy) is only evaluated for
+        candidates walked to fill the page.
+        """
+        out: List[str] = []
+        for uid in self._walk(city_query, company_query, time, after):
+            if uid == exclude: continue
+            if visible is not None and not visible(uid): continue
+            if len(out) == limit: return out, out[-1]
+            out.append(uid)
+        return out, None
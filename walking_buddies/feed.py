@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Photo feed timelines: fan-out on write, with pull-on-read for wide audiences.
+
+A new post is pushed onto the timeline of every viewer its audience reaches (the owner,
+their buddies, or their teammates). Public posts, and posts whose audience is larger than
+``fanout_limit``, are kept in shared lists instead and merged in when a viewer reads. When
+two users become buddies, each side's most recent ``backfill`` friends-only posts are merged
+into the other's timeline, so a new buddy sees what a buddy of old would.
+Timelines hold post sequence numbers in posting order, so a page is a k-way merge walking
+backwards from a cursor: O(page) no matter how many posts exist. Publishing and trimming
+serialize on a sequence lock; pages are read without locking and retried if one overlapped.
+"""
+import heapq
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from .concurrency import SeqLock
+
+Post = Dict[str, Any]
+
+
+class FeedService:
+    def __init__(self, friends_of: Callable[[str], Set[str]], team_of: Callable[[str], Optional[str]],
+                 members_of: Callable[[str], Set[str]], expire_days_of: Callable[[str], int], fanout_limit: int = 1000,
+                 backfill: int = 200):
+        self.friends_of = friends_of; self.team_of = team_of; self.members_of = members_of
+        self.expire_days_of = expire_days_of; self.fanout_limit = fanout_limit; self.backfill = backfill
+        self.posts: List[Post] = []
+        self.posted_at: List[datetime] = []
+        self.timelines: Dict[str, List[int]] = {}
+        self.public: List[int] = []
+        self.team_posts: Dict[str, List[int]] = {}     # team-audience posts of very large teams
+        self.author_posts: Dict[str, List[int]] = {}   # friends-audience posts of authors with very many buddies
+        self.friend_posts: Dict[str, List[int]] = {}   # every friends-audience post per author, to backfill new buddies
+        self.seq = SeqLock()
+
+    def _push(self, viewer: str, seq: int):
+        self.timelines.setdefault(viewer, []).append(seq)
+
+    def publish(self, photo: Post)->int:
+        with self.seq.write(): return self._publish(photo)
+
+    def _publish(self, photo: Post)->int:
+        seq = len(self.posts)
+        self.posts.append(photo); self.posted_at.append(datetime.fromisoformat(photo["ts"]))
+        owner = photo["user_id"]; audience = photo.get("audience", "friends")
+        self._push(owner, seq)
+        if audience == "public":
+            self.public.append(seq)
+        elif audience == "friends":
+            self.friend_posts.setdefault(owner, []).append(seq)
+            buddies = self.friends_of(owner)
+            if len(buddies) > self.fanout_limit: self.author_posts.setdefault(owner, []).append(seq)
+            else:
+                for b in buddies: self._push(b, seq)
+        elif audience == "team":
+            team = self.team_of(owner)
+            if team:
+                members = self.members_of(team)
+                if len(members) > self.fanout_limit: self.team_posts.setdefault(team, []).append(seq)
+                else:
+                    for m in members:
+                        if m != owner: self._push(m, seq)
+        return seq
+
+    def add_buddies(self, pairs: Iterable[Tuple[str, str]], now: Optional[datetime] = None):
+        """New buddy links: each side's recent friends-only posts join the other's timeline."""
+        now = now or datetime.now()
+        with self.seq.write():
+            for a, b in pairs: self._backfill(b, a, now); self._backfill(a, b, now)
+
+    def _backfill(self, viewer: str, author: str, now: datetime):
+        new = [s for s in self.friend_posts.get(author, ())[-self.backfill:] if not self._expired(s, now)]
+        if not new: return
+        tl = self.timelines.get(viewer, [])
+        if not tl or tl[-1] < new[0]: self.timelines[viewer] = tl + new; return
+        merged = []
+        for s in heapq.merge(tl, new):
+            if not merged or merged[-1] != s: merged.append(s)
+        self.timelines[viewer] = merged   # swapped in whole: lock-free readers see the old list or the new one
+
+    def _expired(self, seq: int, now: datetime)->bool:
+        days = int(self.expire_days_of(self.posts[seq]["user_id"]) or 0)   # 0 keeps posts forever
+        return days > 0 and self.posted_at[seq] < now - timedelta(days=days)
+
+    def trim(self, viewer: str, now: datetime):
+        """Drop expired posts from the old end of a viewer's timeline."""
+        tl = self.timelines.get(viewer)
+        if not tl or not self._expired(tl[0], now): return
+        with self.seq.write():
+            k = 0
+            while k < len(tl) and self._expired(tl[k], now): k += 1
+            if k: del tl[:k]
+
+    def _sources(self, viewer: str)->List[List[int]]:
+        sources = [self.timelines.get(viewer, []), self.public]
+        team = self.team_of(viewer)
+        if team in self.team_posts: sources.append(self.team_posts[team])
+        if self.author_posts:
+            sources.extend(self.author_posts[f] for f in self.friends_of(viewer) if f in self.author_posts)
+        return sources
+
+    def page(self, viewer: str, limit: int = 20, before: Optional[int] = None, now: Optional[datetime] = None,
+             visible: Optional[Callable[[Post, str], bool]] = None)->Tuple[List[Post], Optional[int]]:
+        """Newest-first page of up to ``limit`` posts older than cursor ``before``; returns (posts, next cursor or None).
+
+        ``visible`` re-checks audience rules on the returned posts, so relationship changes since posting are honoured.
+        """
+        now = now or datetime.now()
+        self.trim(viewer, now)
+        return self.seq.read(lambda: self._page(viewer, limit, before, now, visible))
+
+    def _page(self, viewer: str, limit: int, before: Optional[int], now: datetime,
+              visible: Optional[Callable[[Post, str], bool]])->Tuple[List[Post], Optional[int]]:
+        def backwards(src: List[int])->Iterator[int]:
+            end = len(src) if before is None else bisect_left(src, before)
+            return (src[i] for i in range(end - 1, -1, -1))
+        out: List[Post] = []; last = None
+        for seq in heapq.merge(*(backwards(s) for s in self._sources(viewer)), key=lambda s: -s):
+            if seq == last: continue
+            last = seq
+            if self._expired(seq, now): continue
+            post = self.posts[seq]
+            if visible is not None and not visible(post, viewer): continue
+            out.append(post)
+            if len(out) == limit: return out, seq
+        return out, None
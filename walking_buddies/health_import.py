@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""Streaming import of Apple Health and Google Fit exports into daily activity totals.
+
+Exports are read incrementally (``iterparse`` for Apple's export.xml, line by line for
+Google Fit CSV, one data point at a time for Google Fit JSON), so memory is bounded by
+the number of days and sources seen, never by the number of samples. Samples are summed
+per (source, day, metric); when several devices report the same day (a phone and a
+watch both counting steps) the largest source wins instead of double counting. Only the
+metrics the user shares for that source are kept.
+
+Merging into an ActivityLog takes the larger of the recorded and imported value per day
+and metric, so re-importing the same export is a no-op and walks logged by hand are
+never counted twice.
+
+Command line, for exports too large to upload through the app::
+
+    python -m walking_buddies.health_import --db walking_buddies.db --user martha export.zip
+
+It goes through the engine exactly like an upload (journal, rollups, team miles, badges,
+challenges), so it refuses to run while the app has the database open; stop the app first.
+"""
+import argparse, contextlib, csv, io, json, os, zipfile
+import xml.etree.ElementTree as ET
+from datetime import date, datetime
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from .timeseries import ActivityLog
+
+METRICS = ("minutes", "steps", "miles", "calories")
+SOURCES = ("appleHealth", "googleFit")
+_FLAG = {"minutes": "minutes", "steps": "steps", "miles": "distance", "calories": "calories"}   # privacy flag per metric
+_MI_PER = {"mi": 1.0, "km": 0.621371, "m": 0.000621371, "ft": 0.000189394, "yd": 0.000568182}
+_KCAL_PER = {"kcal": 1.0, "Cal": 1.0, "cal": 0.001, "kJ": 0.239006}
+
+_APPLE_TYPES = {
+    "HKQuantityTypeIdentifierStepCount": "steps",
+    "HKQuantityTypeIdentifierDistanceWalkingRunning": "miles",
+    "HKQuantityTypeIdentifierActiveEnergyBurned": "calories",
+    "HKQuantityTypeIdentifierAppleExerciseTime": "minutes",
+}
+_FIT_TYPES = {   # dataTypeName -> (metric, scale to our unit)
+    "com.google.step_count.delta": ("steps", 1.0),
+    "com.google.distance.delta": ("miles", _MI_PER["m"]),
+    "com.google.calories.expended": ("calories", 1.0),
+    "com.google.active_minutes": ("minutes", 1.0),
+}
+_FIT_CSV_COLUMNS = {"Step count": ("steps", 1.0), "Distance (m)": ("miles", _MI_PER["m"]),
+                    "Calories (kcal)": ("calories", 1.0), "Move Minutes count": ("minutes", 1.0)}
+
+
+def shared_metrics(privacy, source: str)->Set[str]:
+    """Metrics the user shares from ``source`` (``privacy.health.<source>.<flag>``); unknown flags count as not shared."""
+    return {m for m, flag in _FLAG.items() if privacy.lookup("health", source, flag, default=False) is True}
+
+
+class DailyAggregator:
+    """Per (source, day) sums of each metric; ``days()`` resolves overlapping sources."""
+
+    def __init__(self, metrics: Iterable[str] = METRICS):
+        self.metrics = set(metrics)
+        self.by_source: Dict[Any, Dict[int, List[float]]] = {}
+        self.samples = 0; self.skipped = 0
+        self._ordinals: Dict[str, int] = {}
+
+    def ordinal(self, iso: str)->int:
+        o = self._ordinals.get(iso)
+        if o is None: o = self._ordinals[iso] = date.fromisoformat(iso).toordinal()
+        return o
+
+    def add(self, source: str, ordinal: int, metric: str, value: float):
+        if metric not in self.metrics: self.skipped += 1; return
+        row = self.by_source.setdefault(source, {}).get(ordinal)
+        if row is None: row = self.by_source[source][ordinal] = [0.0] * len(METRICS)
+        row[METRICS.index(metric)] += value; self.samples += 1
+
+    def days(self)->Dict[int, List[float]]:
+        out: Dict[int, List[float]] = {}
+        for per_day in self.by_source.values():
+            for o, row in per_day.items():
+                best = out.setdefault(o, [0.0] * len(METRICS))
+                for i, v in enumerate(row):
+                    if v > best[i]: best[i] = v
+        return out
+
+
+# ---------- parsers ----------
+def parse_apple_health(fp: IO[bytes], agg: DailyAggregator)->int:
+    """Stream ``<Record>`` samples from an Apple Health export.xml; returns records read."""
+    n = 0; root = None
+    for event, elem in ET.iterparse(fp, events=("start", "end")):
+        if root is None: root = elem; continue
+        if event != "end" or elem.tag != "Record": continue
+        metric = _APPLE_TYPES.get(elem.get("type"))
+        if metric is not None:
+            n += 1
+            try: value = float(elem.get("value"))
+            except (TypeError, ValueError): value = None
+            start = elem.get("startDate") or ""
+            if value is not None and len(start) >= 10:
+                unit = elem.get("unit", "")
+                if metric == "miles": value *= _MI_PER.get(unit, 1.0)
+                elif metric == "calories": value *= _KCAL_PER.get(unit, 1.0)
+                agg.add(elem.get("sourceName") or "apple", agg.ordinal(start[:10]), metric, value)
+        root.clear()   # drop processed records so memory stays flat
+    return n
+
+def parse_google_fit_csv(fp: IO[bytes], agg: DailyAggregator, day: Optional[str] = None, source: str = "googleFit")->int:
+    """Google Fit daily-metrics CSV; rows carry a ``Date`` column, or are intervals of the file's ``day``."""
+    n = 0
+    for row in csv.DictReader(io.TextIOWrapper(fp, encoding="utf-8-sig", newline="")):
+        iso = (row.get("Date") or day or "")[:10]
+        if len(iso) < 10: continue
+        o = agg.ordinal(iso); n += 1
+        for col, (metric, scale) in _FIT_CSV_COLUMNS.items():
+            v = row.get(col)
+            if v not in (None, ""): agg.add(source, o, metric, float(v) * scale)
+    return n
+
+def _json_array_items(fp: IO[bytes], key: str, chunk: int = 1 << 16)->Iterator[dict]:
+    """Yield the objects of the top-level array ``key`` one at a time, reading ``chunk`` characters at a time."""
+    reader = io.TextIOWrapper(fp, encoding="utf-8"); decoder = json.JSONDecoder()
+    buf = ""; eof = False; marker = f'"{key}"'
+    def more()->bool:
+        nonlocal buf, eof
+        data = reader.read(chunk)
+        if not data: eof = True; return False
+        buf += data; return True
+    while True:   # find the array start
+        k = buf.find(marker)
+        if k >= 0:
+            b = buf.find("[", k)
+            if b >= 0: buf = buf[b + 1:]; break
+        elif len(buf) > len(marker): buf = buf[-len(marker):]
+        if not more(): return
+    while True:
+        i = 0
+        while True:
+            while i < len(buf) and buf[i] in " \t\r\n,": i += 1
+            if i < len(buf) or not more(): break
+        if i >= len(buf) or buf[i] == "]": return
+        try:
+            obj, end = decoder.raw_decode(buf, i)
+        except json.JSONDecodeError:
+            if eof or not more(): raise
+            continue
+        buf = buf[end:]
+        yield obj
+
+def parse_google_fit_json(fp: IO[bytes], agg: DailyAggregator)->int:
+    """Google Fit data-point JSON (Takeout "All Data" files); returns points read."""
+    n = 0
+    for p in _json_array_items(fp, "Data Points"):
+        spec = _FIT_TYPES.get(p.get("dataTypeName"))
+        if spec is None or not p.get("fitValue"): continue
+        value = p["fitValue"][0].get("value", {})
+        v = value.get("intVal", value.get("fpVal"))
+        if v is None: continue
+        metric, scale = spec; n += 1
+        day = datetime.fromtimestamp(int(p.get("startTimeNanos", 0)) / 1e9).date().toordinal()
+        agg.add(p.get("originDataSourceId") or "googleFit", day, metric, float(v) * scale)
+    return n
+
+def source_of(name: str)->Optional[str]:
+    low = name.lower()
+    if low.endswith(".xml"): return "appleHealth"
+    if low.endswith((".csv", ".json")): return "googleFit"
+    return None
+
+def parse_export(fp: IO[bytes], name: str, aggs: Dict[str, DailyAggregator])->int:
+    """Dispatch one file (or every export file inside a zip) to its parser and the aggregator of its source."""
+    low = name.lower()
+    if low.endswith(".zip"):
+        n = 0
+        with zipfile.ZipFile(fp) as z:
+            for member in z.namelist():
+                base = os.path.basename(member).lower()
+                if base.endswith("export_cda.xml") or source_of(base) is None: continue
+                if source_of(base) == "appleHealth" and base != "export.xml": continue
+                with z.open(member) as inner: n += parse_export(inner, member, aggs)
+        return n
+    source = source_of(low)
+    if source is None or source not in aggs: return 0
+    if source == "appleHealth": return parse_apple_health(fp, aggs[source])
+    if low.endswith(".json"): return parse_google_fit_json(fp, aggs[source])
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return parse_google_fit_csv(fp, aggs[source], day=stem if len(stem) == 10 and stem[4] == "-" else None)
+
+
+# ---------- merge ----------
+def merge_days(log: ActivityLog, days: Dict[int, List[float]])->List[Tuple[int, Dict[str, float]]]:
+    """Raise each day's metrics to the imported totals; returns [(ordinal, {metric: increase})] for changed days."""
+    changed = []
+    for o in sorted(days):
+        inc = {}
+        for metric, v in zip(METRICS, days[o]):
+            v = round(v, 3) if metric == "miles" else int(round(v))
+            cur = log.get(metric, o, 0)
+            if v > cur: log.set(metric, o, v); inc[metric] = v - cur
+        if inc: changed.append((o, inc))
+    return changed
+
+def aggregators_for(privacy)->Dict[str, DailyAggregator]:
+    return {s: DailyAggregator(shared_metrics(privacy, s)) for s in SOURCES}
+
+def resolve(aggs: Dict[str, DailyAggregator])->Dict[int, List[float]]:
+    """Days from all sources of one import; Apple and Google are treated as overlapping devices too."""
+    combined = DailyAggregator()
+    for name, agg in aggs.items():
+        for src, per_day in agg.by_source.items(): combined.by_source[(name, src)] = per_day
+    return combined.days()
+
+
+def main(argv: Optional[List[str]] = None)->int:
+    from .core import open_engine
+    from .storage import StoreInUse
+    ap = argparse.ArgumentParser(description="Import Apple Health / Google Fit exports into a Walking Buddies database.")
+    ap.add_argument("--db", required=True); ap.add_argument("--user", required=True); ap.add_argument("files", nargs="+")
+    ap.add_argument("--journal", help="event journal directory (default: <db>.events when it exists)")
+    args = ap.parse_args(argv)
+    journal = args.journal or (args.db + ".events" if os.path.isdir(args.db + ".events") else None)
+    try: engine = open_engine(args.db, journal)
+    except StoreInUse as e: ap.error(f"{e}; stop the app or upload the export through it")
+    try:
+        if args.user not in engine.users: ap.error(f"unknown user {args.user!r}")
+        with contextlib.ExitStack() as stack:
+            files = [(path, stack.enter_context(open(path, "rb"))) for path in args.files]
+            changed, aggs = engine.import_health(args.user, files)
+    finally:
+        engine.close()
+    print(f"{sum(a.samples for a in aggs.values())} samples, {sum(a.skipped for a in aggs.values())} not shared, {changed} days updated")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
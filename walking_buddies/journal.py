@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""Append-only event journal for every change the app makes to its shared state.
+
+Each change (a walk, a point award, a redemption, a new battle or its payout, an import, a
+new user, a profile, privacy or reminder edit, a team join or role, a buddy link, a photo, a
+message, a route, a custom challenge, a challenge join or completion) is appended as one
+length-prefixed record, ``<u32 length><u32 crc32><json [seq, ts, kind, data]>``, to the
+current segment file. The SQLite store is the snapshot: every flush records the
+last sequence number it contains, so a restart loads the database and replays only the
+events after it, and cold start is bounded by the database, not by history. A torn record
+at the end of the newest segment (a crash mid-write) is cut off on open. Segments roll over
+at ``segment_bytes`` and are kept for auditing and offline replay. A challenge completion
+is one event carrying its reward, so replay marks it completed and pays it exactly once.
+Badges and avatar levels are derived and recomputed on the user's next walk::
+
+    python -m walking_buddies.journal walking_buddies.db.events --rules '{"base_per_minute": 2}'
+"""
+import argparse, json, os, struct, threading, zlib
+from collections import namedtuple
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from .privacy import PrivacySettings
+from .streaks import StreakState
+from .timeseries import day_ordinal
+from .users import UserRecord
+
+Event = namedtuple("Event", "seq ts kind data")
+_HEADER = struct.Struct("<II")
+_SUFFIX = ".wbj"
+
+
+def _segment_name(first_seq: int)->str:
+    return f"{first_seq:016d}{_SUFFIX}"
+
+def read_segment(path: str)->Iterator[Tuple[int, Event]]:
+    """(end offset, event) for each intact record; stops at the first short or corrupt one."""
+    with open(path, "rb") as fp:
+        pos = 0
+        while True:
+            head = fp.read(_HEADER.size)
+            if len(head) < _HEADER.size: return
+            n, crc = _HEADER.unpack(head); payload = fp.read(n)
+            if len(payload) < n or zlib.crc32(payload) != crc: return
+            pos += _HEADER.size + n
+            yield pos, Event(*json.loads(payload))
+
+def segments(directory: str)->List[Tuple[int, str]]:
+    """[(first seq, path)] in order."""
+    names = sorted(n for n in os.listdir(directory) if n.endswith(_SUFFIX))
+    return [(int(n[:-len(_SUFFIX)]), os.path.join(directory, n)) for n in names]
+
+def iter_events(directory: str, after: int = 0)->Iterator[Event]:
+    """Events with ``seq > after``, skipping whole segments that end before it. Read-only; safe while a writer appends."""
+    segs = segments(directory)
+    for i, (first, path) in enumerate(segs):
+        if i + 1 < len(segs) and segs[i + 1][0] <= after + 1: continue
+        for _, ev in read_segment(path):
+            if ev.seq > after: yield ev
+
+
+class Journal:
+    def __init__(self, directory: str, segment_bytes: int = 64 << 20, fsync: bool = True):
+        self.directory = directory; self.segment_bytes = segment_bytes; self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.seq = 0; self._fp = None
+        segs = segments(directory)
+        if segs:
+            first, path = segs[-1]; end = 0; self.seq = first - 1
+            for end, ev in read_segment(path): self.seq = ev.seq
+            if end != os.path.getsize(path):
+                with open(path, "r+b") as fp: fp.truncate(end)   # torn tail from a crash mid-append
+            self._fp = open(path, "ab")
+        else:
+            self._roll()
+
+    def _roll(self):
+        if self._fp is not None:
+            self._sync(); self._fp.close()
+            if not os.path.getsize(self._fp.name): os.remove(self._fp.name)
+        self._fp = open(os.path.join(self.directory, _segment_name(self.seq + 1)), "ab")
+
+    def advance(self, seq: int):
+        """Continue numbering after ``seq`` (a snapshot newer than this journal, e.g. after the journal was cleared)."""
+        with self._lock:
+            if seq > self.seq: self.seq = seq; self._roll()
+
+    def append(self, kind: str, data: Dict[str, Any])->int:
+        """Buffer one event; durable after the next ``sync``. Returns its sequence number."""
+        with self._lock:
+            self.seq += 1
+            payload = json.dumps([self.seq, datetime.now().isoformat(timespec="seconds"), kind, data],
+                                 separators=(",", ":"), default=str).encode("utf-8")
+            self._fp.write(_HEADER.pack(len(payload), zlib.crc32(payload))); self._fp.write(payload)
+            if self._fp.tell() >= self.segment_bytes: self._roll()
+            return self.seq
+
+    def _sync(self):
+        self._fp.flush()
+        if self.fsync: os.fsync(self._fp.fileno())
+
+    def sync(self):
+        with self._lock: self._sync()
+
+    def events(self, after: int = 0)->Iterator[Event]:
+        with self._lock: self._fp.flush()
+        return iter_events(self.directory, after)
+
+    def close(self):
+        with self._lock:
+            if self._fp is not None: self._sync(); self._fp.close(); self._fp = None
+
+
+# ---------- restart replay ----------
+def _user(store, uid: str)->UserRecord:
+    users = store.state["users"]
+    if uid not in users: users[uid] = UserRecord(uid)
+    return users[uid]
+
+def _apply_walk(store, d: Dict[str, Any]):
+    u = _user(store, d["uid"]); ts = datetime.fromisoformat(d["ts"]); day = ts.date().toordinal(); log = u.activity
+    first = not log.walked(day)
+    u.walk_dates.append(day); log.add(day, d["minutes"], d["steps"], d["miles"], d["calories"], walks=1)
+    if first: u.streak.record(day, log.walked)
+    u.points = int(u.points) + int(d["gained"])
+    if d.get("mood"): u["mood_log"][ts.date().isoformat()] = d["mood"]
+    store.add_walk(d["uid"], ts); store.touch_day(d["uid"], ts.date().isoformat())
+
+def _apply_walks(store, d: Dict[str, Any]):
+    keys = list(d)
+    for row in zip(*d.values()): _apply_walk(store, dict(zip(keys, row)))
+
+def _apply_points(store, d: Dict[str, Any]):
+    u = _user(store, d["uid"]); u.points = int(u.points) + int(d["delta"]); store.touch_user(d["uid"])
+
+def _apply_redeem(store, d: Dict[str, Any]):
+    u = _user(store, d["uid"]); u.points = int(u.points) - int(d["cost"]); store.touch_user(d["uid"])
+
+def _apply_battle(store, d: Dict[str, Any]):
+    for b in store.state["team_battles"]:
+        if b.get("id") == d["id"]: b["winner_awarded"] = True; store.touch_battle(b)
+
+def _apply_activity(store, d: Dict[str, Any]):
+    u = _user(store, d["uid"])
+    for day, values in d["days"].items():
+        for metric, v in values.items(): u.activity.set(metric, day_ordinal(day), v)
+        store.touch_day(d["uid"], day)
+
+def _apply_user(store, d: Dict[str, Any]):
+    users = store.state["users"]
+    if d["uid"] not in users: users[d["uid"]] = UserRecord(d["name"]); store.touch_user(d["uid"])
+
+def _apply_profile(store, d: Dict[str, Any]):
+    u = _user(store, d["uid"])
+    for k in ("name", "city", "company", "available_times"): u[k] = d[k]
+    store.touch_user(d["uid"])
+
+def _apply_privacy(store, d: Dict[str, Any]):
+    _user(store, d["uid"])["privacy"] = PrivacySettings.from_dict(d["settings"]); store.touch_user(d["uid"])
+
+def _apply_team(store, d: Dict[str, Any]):
+    uid, name = d["uid"], d["team"]; u = _user(store, uid); teams = store.state["teams"]; old = u.team
+    if old and old != name and old in teams:
+        teams[old]["members"].discard(uid); teams[old].get("roles", {}).pop(uid, None); store.touch_team(old)
+    team = teams.setdefault(name, {"captain": uid, "members": set(), "roles": {}, "city": d["city"], "company": d["company"]})
+    team["members"].add(uid); team["city"] = d["city"]; team["company"] = d["company"]
+    if not team.get("roles"): team["roles"][uid] = "Captain"; team["captain"] = uid
+    else: team["roles"].setdefault(uid, "Player")
+    u.team = name; store.touch_team(name); store.touch_user(uid)
+
+def _apply_buddies(store, d: Dict[str, Any]):
+    pairs = [tuple(p) for p in d["pairs"]]
+    store.state.setdefault("buddies", []).extend(pairs); store.add_buddies(pairs)
+
+def _apply_photo(store, d: Dict[str, Any]):
+    u = _user(store, d["user_id"]); u.photos_this_week = int(u.photos_this_week) + 1
+    store.state["photos"].append(dict(d)); store.add_photo(dict(d)); store.touch_user(d["user_id"])
+
+def _apply_message(store, d: Dict[str, Any]):
+    store.state["messages"].append(dict(d)); store.add_message(dict(d))
+
+def _apply_route(store, d: Dict[str, Any]):
+    route = dict(d); uid, name = route["user_id"], route["name"]; routes = store.state["routes"]
+    routes[:] = [r for r in routes if r["user_id"] != uid or r["name"] != name]   # re-adding a name replaces the route
+    routes.append(route); store.delete_route(uid, name); store.add_route(route)
+    _user(store, uid)["routes_completed_month"].update(route.get("neighborhoods") or (name,)); store.touch_user(uid)
+
+def _apply_route_delete(store, d: Dict[str, Any]):
+    routes = store.state["routes"]
+    routes[:] = [r for r in routes if r["user_id"] != d["uid"] or r["name"] != d["name"]]; store.delete_route(d["uid"], d["name"])
+
+def _apply_new_battle(store, d: Dict[str, Any]):
+    battles = store.state["team_battles"]
+    if not any(b.get("id") == d["id"] for b in battles):
+        battle = dict(d); battles.append(battle); store.touch_battle(battle)
+
+def _apply_new_challenge(store, d: Dict[str, Any]):
+    custom = store.state["custom_challenges"]
+    if not any(c.get("id") == d["id"] for c in custom):
+        ch = dict(d); custom.append(ch); store.touch_challenge(ch)
+
+def _apply_role(store, d: Dict[str, Any]):
+    team = store.state["teams"].get(d["team"])
+    if team is None: return
+    team.setdefault("roles", {})[d["uid"]] = d["role"]
+    if d["role"] == "Captain": team["captain"] = d["uid"]
+    store.touch_team(d["team"])
+
+def _apply_reminders(store, d: Dict[str, Any]):
+    _user(store, d["uid"])["reminders"] = dict(d["settings"]); store.touch_user(d["uid"])
+
+def _apply_challenge(store, d: Dict[str, Any]):
+    uc = store.state["user_challenges"].setdefault(d["uid"], {}).setdefault(d["id"], {"joined": False, "completed": False, "last_reset": None})
+    if uc["last_reset"] != d["period"]: uc["completed"] = False; uc["last_reset"] = d["period"]
+    if d["action"] == "complete":
+        u = _user(store, d["uid"]); uc["completed"] = True; u.points = int(u.points) + int(d["reward"])
+    else:
+        uc["joined"] = d["action"] == "join"
+    store.touch_user(d["uid"])
+
+APPLY = {"walk": _apply_walk, "walks": _apply_walks, "points": _apply_points, "redeem": _apply_redeem,
+         "battle": _apply_battle, "activity": _apply_activity, "user": _apply_user, "profile": _apply_profile,
+         "privacy": _apply_privacy, "team": _apply_team, "buddies": _apply_buddies, "photo": _apply_photo,
+         "message": _apply_message, "route": _apply_route, "route_delete": _apply_route_delete, "challenge": _apply_challenge,
+         "new_battle": _apply_new_battle, "new_challenge": _apply_new_challenge, "role": _apply_role, "reminders": _apply_reminders}
+
+def replay(store, events: Iterable[Event])->int:
+    """Re-apply events to ``store.state`` (and queue their writes); returns events applied."""
+    n = 0
+    for ev in events:
+        fn = APPLY.get(ev.kind)
+        if fn is not None: fn(store, ev.data); n += 1
+    return n
+
+
+# ---------- offline rescoring ----------
+def walk_points(rules: Dict[str, int], minutes, is_group: bool, shared_photo: bool, streak: int)->int:
+    """award_walk's formula."""
+    gained = int(minutes) * rules["base_per_minute"]
+    if is_group: gained += rules["group_walk_bonus"]
+    if shared_photo: gained += rules["photo_share"]
+    if streak >= 30: gained += rules["streak_30"]
+    elif streak >= 7: gained += rules["streak_7"]
+    return gained
+
+def rescore(events: Iterable[Event], overrides: Optional[Dict[str, int]] = None)->Dict[str, Dict[str, int]]:
+    """Per user ``{"recorded": points, "rescored": points}`` over the journal, walks re-scored under the rules in force
+    (``rules`` events) with ``overrides`` applied on top. Awards, challenge rewards and redemptions count as recorded;
+    streaks start at the first journaled walk."""
+    rules: Dict[str, int] = {}; out: Dict[str, Dict[str, int]] = {}
+    streaks: Dict[str, Tuple[StreakState, set]] = {}
+    def walk(d):
+        day = datetime.fromisoformat(d["ts"]).date().toordinal()
+        streak, walked = streaks.setdefault(d["uid"], (StreakState(), set()))
+        if day not in walked: walked.add(day); streak.record(day, walked.__contains__)
+        r = out.setdefault(d["uid"], {"recorded": 0, "rescored": 0})
+        r["recorded"] += int(d["gained"])
+        r["rescored"] += walk_points({**rules, **(overrides or {})}, d["minutes"], d["is_group"], d["shared_photo"], streak.current_for(day))
+    for ev in events:
+        d = ev.data
+        if ev.kind == "rules": rules = dict(d)
+        elif ev.kind == "walk": walk(d)
+        elif ev.kind == "walks":
+            keys = list(d)
+            for row in zip(*d.values()): walk(dict(zip(keys, row)))
+        elif ev.kind in ("points", "redeem") or (ev.kind == "challenge" and d["action"] == "complete"):
+            delta = int(d["delta"]) if ev.kind == "points" else -int(d["cost"]) if ev.kind == "redeem" else int(d["reward"])
+            r = out.setdefault(d["uid"], {"recorded": 0, "rescored": 0}); r["recorded"] += delta; r["rescored"] += delta
+    return out
+
+
+def main(argv: Optional[List[str]] = None)->int:
+    ap = argparse.ArgumentParser(description="Recompute points from a Walking Buddies journal under different point rules.")
+    ap.add_argument("directory"); ap.add_argument("--rules", default="{}", help="JSON overrides for POINT_RULES")
+    ap.add_argument("--json", action="store_true", help="print per-user results as JSON")
+    args = ap.parse_args(argv)
+    if not os.path.isdir(args.directory): ap.error(f"no journal at {args.directory!r}")
+    res = rescore(iter_events(args.directory), json.loads(args.rules))
+    if args.json: print(json.dumps(res, indent=1, sort_keys=True)); return 0
+    print(f"{'user':<24} {'recorded':>10} {'rescored':>10} {'change':>10}")
+    for uid in sorted(res, key=lambda k: res[k]["rescored"] - res[k]["recorded"]):
+        r = res[uid]; print(f"{uid:<24} {r['recorded']:>10} {r['rescored']:>10} {r['rescored'] - r['recorded']:>+10}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
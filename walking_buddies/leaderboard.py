@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Ranked leaderboards kept up to date as points change.
+
+RankedBoard keeps (score, key) pairs in a SortedList, so updates, rank lookups and
+slicing a page are O(log n). Viewer-specific privacy filtering is applied while walking
+a page, never to the whole population. Syncs from concurrent sessions serialize on a
+sequence lock; ``read`` runs a query without locking and retries if a sync overlapped it.
+"""
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+from sortedcontainers import SortedList
+from .concurrency import SeqLock
+
+Row = Tuple[int, str, int]  # (0-based rank, key, score)
+T = TypeVar("T")
+
+
+class RankedBoard:
+    __slots__ = ("_scores", "_order")
+
+    def __init__(self, items: Iterable[Tuple[str, int]] = ()):
+        self._scores: Dict[str, int] = dict(items)
+        self._order = SortedList((-s, k) for k, s in self._scores.items())  # highest score first, ties by key
+
+    def __len__(self)->int: return len(self._scores)
+    def __contains__(self, key)->bool: return key in self._scores
+
+    def score(self, key: str, default=None):
+        return self._scores.get(key, default)
+
+    def set(self, key: str, score: int):
+        old = self._scores.get(key)
+        if old == score: return
+        if old is not None: self._order.remove((-old, key))
+        self._scores[key] = score; self._order.add((-score, key))
+
+    def add(self, key: str, delta: int):
+        self.set(key, self._scores.get(key, 0) + delta)
+
+    def discard(self, key: str):
+        old = self._scores.pop(key, None)
+        if old is not None: self._order.remove((-old, key))
+
+    def rank(self, key: str)->Optional[int]:
+        s = self._scores.get(key)
+        return None if s is None else self._order.index((-s, key))
+
+    def top(self, k: int)->List[Row]:
+        return [(i, key, -neg) for i, (neg, key) in enumerate(self._order.islice(0, k))]
+
+    def page(self, start: int, size: int, visible: Optional[Callable[[str], bool]] = None)->Tuple[List[Row], Optional[int]]:
+        """Up to ``size`` visible rows from position ``start``; returns (rows, cursor for the next page or None)."""
+        rows: List[Row] = []
+        for pos, (neg, key) in enumerate(self._order.islice(start), start):
+            if len(rows) == size: return rows, pos
+            if visible is None or visible(key): rows.append((pos, key, -neg))
+        return rows, None
+
+    def around(self, key: str, radius: int = 2, visible: Optional[Callable[[str], bool]] = None)->List[Row]:
+        """``key`` and up to ``radius`` visible neighbours on each side."""
+        r = self.rank(key)
+        if r is None: return []
+        above: List[Row] = []
+        for pos in range(r - 1, -1, -1):
+            if len(above) == radius: break
+            neg, k = self._order[pos]
+            if visible is None or visible(k): above.append((pos, k, -neg))
+        below, _ = self.page(r + 1, radius, visible)
+        return above[::-1] + [(r, key, self._scores[key])] + below
+
+
+class Leaderboards:
+    """Individual, team-aggregate and per-team member boards, synced one user at a time."""
+
+    def __init__(self):
+        self.users = RankedBoard()
+        self.teams = RankedBoard()
+        self.members: Dict[str, RankedBoard] = {}
+        self._team_of: Dict[str, Optional[str]] = {}
+        self.seq = SeqLock()
+
+    @classmethod
+    def build(cls, users: Dict[str, dict])->"Leaderboards":
+        lb = cls()
+        for uid, u in users.items():
+            lb.sync(uid, int(u.get("points", 0)), u.get("team"))
+        return lb
+
+    def sync(self, uid: str, points: int, team: Optional[str]):
+        if self.users.score(uid) == points and self._team_of.get(uid) == team: return
+        with self.seq.write():
+            old = self.users.score(uid); old_team = self._team_of.get(uid)
+            self.users.set(uid, points)
+            if old_team:
+                self.teams.add(old_team, -(old or 0))
+                board = self.members[old_team]; board.discard(uid)
+                if not len(board): del self.members[old_team]; self.teams.discard(old_team)
+            if team:
+                self.teams.add(team, points)
+                self.members.setdefault(team, RankedBoard()).set(uid, points)
+            self._team_of[uid] = team
+
+    def read(self, query: Callable[[], T])->T:
+        """``query()`` (which reads these boards) on a consistent view, without blocking syncs."""
+        return self.seq.read(query)
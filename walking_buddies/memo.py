@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""Derived views memoized against a monotonically increasing state version.
+
+An entry is reused only while the version it was computed at is still current, so any
+write makes every view lazily stale without tracking which views it affected. Entries
+are evicted least-recently-used once ``maxsize`` is reached.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Tuple
+
+
+class VersionedCache:
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self.hits = 0; self.misses = 0
+        self._data: "OrderedDict[Hashable, Tuple[int, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, version: int, compute: Callable[[], Any])->Any:
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is not None and hit[0] == version:
+                self._data.move_to_end(key); self.hits += 1
+                return hit[1]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._data[key] = (version, value); self._data.move_to_end(key)
+            while len(self._data) > self.maxsize: self._data.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock: self._data.clear()
+
+    def __len__(self)->int:
+        return len(self._data)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Direct messages stored as one append-only, time-ordered log per conversation.
+
+Conversations are keyed by the unordered user pair. Pages are read backwards from a
+cursor (a position in the conversation log), so showing a conversation costs O(page)
+regardless of how many messages exist. Unread counts are kept per recipient and sender.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+Key = Tuple[str, str]
+
+def conversation_key(a: str, b: str)->Key:
+    return (a, b) if a <= b else (b, a)
+
+
+class MessageIndex:
+    def __init__(self, messages: Iterable[Dict[str, Any]] = ()):
+        self.convs: Dict[Key, List[Dict[str, Any]]] = {}
+        self.unread: Dict[str, Dict[str, int]] = {}   # recipient -> sender -> count
+        for m in messages:  # history loaded from storage counts as read
+            self.convs.setdefault(conversation_key(m["from"], m["to"]), []).append(m)
+
+    def append(self, msg: Dict[str, Any]):
+        self.convs.setdefault(conversation_key(msg["from"], msg["to"]), []).append(msg)
+        by_sender = self.unread.setdefault(msg["to"], {})
+        by_sender[msg["from"]] = by_sender.get(msg["from"], 0) + 1
+
+    def count(self, a: str, b: str)->int:
+        return len(self.convs.get(conversation_key(a, b), ()))
+
+    def page(self, a: str, b: str, limit: int = 50, before: Optional[int] = None)->Tuple[List[Dict[str, Any]], Optional[int]]:
+        """Up to ``limit`` messages ending just before cursor ``before`` (latest when None), oldest first.
+
+        Returns (messages, cursor for the next older page or None when the start was reached).
+        """
+        log = self.convs.get(conversation_key(a, b), [])
+        end = len(log) if before is None else max(0, min(before, len(log)))
+        start = max(0, end - limit)
+        return log[start:end], (start if start > 0 else None)
+
+    def mark_read(self, reader: str, other: str):
+        self.unread.get(reader, {}).pop(other, None)
+
+    def unread_count(self, reader: str, other: Optional[str] = None)->int:
+        by_sender = self.unread.get(reader, {})
+        return by_sender.get(other, 0) if other is not None else sum(by_sender.values())
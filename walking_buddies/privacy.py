@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Privacy settings as an immutable default layer plus a sparse per-user override map.
+
+A PrivacySettings is a read-only Mapping: lookups fall through the user's overrides to
+the shared defaults, nested sections resolve the same way. Edits never mutate it;
+``with_changes`` returns a new object that copies only the sections along the edited
+paths. Users who never changed anything all share ``DEFAULT_PRIVACY``.
+"""
+from collections.abc import Mapping
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+Path = Tuple[str, ...]
+
+def _freeze(value):
+    if isinstance(value, dict): return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list): return tuple(_freeze(v) for v in value)
+    return value
+
+def _thaw(value):
+    if isinstance(value, Mapping): return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple): return [_thaw(v) for v in value]
+    return value
+
+DEFAULTS = _freeze({
+    "profileVisibility": "private",  # private | friends | team | public
+    "showCity": True,
+    "showCompany": False,
+    "leaderboards": {"public": False, "alias": "", "teamVisible": True},
+    "discoverability": {"byCity": True, "byCompany": False},
+    "routes": {"defaultShare": "private"},  # private | friends | team | public
+    "photos": {"defaultAudience": "friends", "stripEXIF": True, "autoExpireDays": 365},
+    "messaging": {"allowRequests": "friends_of_friends", "readReceipts": False, "blocked": []},
+    "notifications": {"genericContent": True, "quietHours": "22:00-07:00"},
+    "health": {"appleHealth": {"steps": True, "distance": False, "minutes": False, "calories": False},
+               "googleFit": {"steps": True, "distance": False, "minutes": False, "calories": False}},
+    "analytics": {"crash": True, "performance": True, "researchProgram": False},
+    "security": {"appLock": False, "twoFA": False},
+})
+
+_EMPTY: Mapping = MappingProxyType({})
+_MISSING = object()
+
+
+def _diff(value, base)->Tuple[bool, Any]:
+    """(differs, sparse override) of ``value`` against ``base``."""
+    if isinstance(value, Mapping) and isinstance(base, Mapping):
+        out = {}
+        for k, v in value.items():
+            differs, sub = _diff(v, base[k]) if k in base else (True, _thaw(v))
+            if differs: out[k] = sub
+        return bool(out), out
+    if isinstance(base, tuple) and isinstance(value, (list, tuple)):
+        return tuple(_freeze(list(value))) != base, _thaw(tuple(value))
+    return value != base, _thaw(value)
+
+
+class PrivacySettings(Mapping):
+    __slots__ = ("_over", "_base")
+
+    def __init__(self, overrides: Optional[Dict[str, Any]] = None, base: Mapping = DEFAULTS):
+        self._over = overrides or _EMPTY; self._base = base
+
+    # ---------- layered lookups ----------
+    def __getitem__(self, key: str):
+        o = self._over.get(key, _MISSING); b = self._base.get(key, _MISSING)
+        if o is _MISSING and b is _MISSING: raise KeyError(key)
+        if isinstance(o, Mapping) or (o is _MISSING and isinstance(b, Mapping)):
+            return PrivacySettings(None if o is _MISSING else o, b if isinstance(b, Mapping) else _EMPTY)
+        return b if o is _MISSING else o
+
+    def __iter__(self)->Iterator[str]:
+        yield from self._base
+        for k in self._over:
+            if k not in self._base: yield k
+
+    def __len__(self)->int:
+        return len(self._base) + sum(1 for k in self._over if k not in self._base)
+
+    def __repr__(self)->str:
+        return f"PrivacySettings({dict(self._over)!r})"
+
+    def lookup(self, *path: str, default: Any = None)->Any:
+        """Value at a nested path, e.g. ``lookup("photos", "defaultAudience")``, without building section views."""
+        over, base = self._over, self._base
+        for i, k in enumerate(path):
+            o = over.get(k, _MISSING); b = base.get(k, _MISSING)
+            if o is _MISSING and b is _MISSING: return default
+            last = i == len(path) - 1
+            if not isinstance(o, Mapping) and (o is not _MISSING or not isinstance(b, Mapping)):
+                return (b if o is _MISSING else o) if last else default
+            if last: return PrivacySettings(None if o is _MISSING else o, b if isinstance(b, Mapping) else _EMPTY)
+            over = _EMPTY if o is _MISSING else o; base = b if isinstance(b, Mapping) else _EMPTY
+        return self
+
+    # ---------- copy-on-write edits ----------
+    @property
+    def overrides(self)->Dict[str, Any]:
+        """The sparse override map as a plain dict; this is what gets persisted."""
+        return dict(self._over)
+
+    def with_changes(self, changes: Dict[Path, Any])->"PrivacySettings":
+        """A new settings object with ``changes`` ({path: value}) applied; ``self`` when nothing changes.
+
+        Values equal to the default are dropped from the overrides, so reverting a setting frees it.
+        """
+        over = dict(self._over); changed = False
+        for path, value in changes.items():
+            if _freeze(self.lookup(*path, default=_MISSING)) == _freeze(value): continue
+            changed = True
+            node = over; base = self._base; trail = []
+            for k in path[:-1]:
+                node[k] = dict(node.get(k, {})); trail.append((node, k)); node = node[k]
+                base = base.get(k, _EMPTY) if isinstance(base, Mapping) else _EMPTY
+            leaf = path[-1]
+            differs, sub = _diff(value, base[leaf]) if leaf in base else (True, _thaw(value))
+            if differs: node[leaf] = sub
+            else: node.pop(leaf, None)
+            for parent, k in reversed(trail):   # prune sections that fell back to defaults
+                if not parent[k]: del parent[k]
+        if not changed: return self
+        return DEFAULT_PRIVACY if not over and self._base is DEFAULTS else PrivacySettings(over, self._base)
+
+    def to_dict(self)->Dict[str, Any]:
+        """Fully resolved plain-dict copy."""
+        return {k: (v.to_dict() if isinstance(v, PrivacySettings) else _thaw(v)) for k, v in self.items()}
+
+    @classmethod
+    def from_dict(cls, settings: Optional[Mapping])->"PrivacySettings":
+        """Settings from a full or partial dict (e.g. a stored row), keeping only what differs from the defaults."""
+        _, over = _diff(settings if isinstance(settings, Mapping) else {}, DEFAULTS)
+        return cls(over) if over else DEFAULT_PRIVACY
+
+
+DEFAULT_PRIVACY = PrivacySettings()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""Timing probes for the app's hot paths.
+
+``timed`` wraps a function so each call is counted and timed into a per-name histogram
+(half-octave buckets from 1 us, so p50/p95 come out within ~20%). The wrapper is only put in
+place while recording is on; the app script re-runs its definitions on every rerun, so a
+toggle takes effect from the next rerun and a disabled probe is the bare function; ``instrument``
+does the same for the methods of an object that outlives reruns, such as the engine. Calls are also
+added to the current *run* of the calling thread: the whole script for a full rerun, or one
+tab body for a fragment rerun. The last runs are kept for per-rerun breakdowns; times are
+inclusive, so a function's time includes the probed functions it calls. A recorder can write
+everything in the Prometheus text format and profile the next run with cProfile.
+
+Recording starts enabled when ``WALKING_BUDDIES_PROBES=1``.
+"""
+import cProfile, functools, io, math, os, pstats, sys, threading, time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+N_BUCKETS = 50
+BOUNDS = tuple(1e-6 * 2 ** (i / 2) for i in range(N_BUCKETS))   # bucket upper bounds in seconds; the last one is open
+
+
+def _bucket(ns: int)->int:
+    if ns <= 1000: return 0
+    return min(N_BUCKETS - 1, math.ceil(2 * math.log2(ns / 1000.0)))
+
+
+class Stat:
+    __slots__ = ("count", "total_ns", "max_ns", "buckets")
+
+    def __init__(self):
+        self.count = 0; self.total_ns = 0; self.max_ns = 0; self.buckets = [0] * N_BUCKETS
+
+    def add(self, ns: int):
+        self.count += 1; self.total_ns += ns; self.buckets[_bucket(ns)] += 1
+        if ns > self.max_ns: self.max_ns = ns
+
+    def quantile(self, q: float)->float:
+        """Seconds at quantile ``q``, interpolated inside the bucket it falls in."""
+        if not self.count: return 0.0
+        rank = q * self.count; seen = 0
+        for i, n in enumerate(self.buckets):
+            if n and seen + n >= rank:
+                lo = BOUNDS[i - 1] if i else 0.0
+                return min(lo + (BOUNDS[i] - lo) * (rank - seen) / n, self.max_ns / 1e9)
+            seen += n
+        return self.max_ns / 1e9
+
+class Run:
+    __slots__ = ("label", "started", "total_ns", "spans", "_t0")
+
+    def __init__(self, label: str):
+        self.label = label; self.started = time.time(); self.total_ns = 0
+        self.spans: Dict[str, List[int]] = {}   # name -> [calls, ns]
+        self._t0 = time.perf_counter_ns()
+
+
+class Recorder:
+    def __init__(self, enabled: bool = False, keep_runs: int = 100):
+        self.enabled = enabled
+        self.stats: Dict[str, Stat] = {}; self.run_stats: Dict[str, Stat] = {}
+        self.runs: Deque[Run] = deque(maxlen=keep_runs)
+        self._lock = threading.Lock(); self._local = threading.local()
+        self._profile_to: Optional[str] = None; self.last_profile: Optional[Tuple[str, str]] = None   # (path, top functions)
+
+    def reset(self):
+        with self._lock: self.stats.clear(); self.run_stats.clear(); self.runs.clear()
+
+    # ---------- recording ----------
+    def record(self, name: str, ns: int):
+        with self._lock:
+            stat = self.stats.get(name)
+            if stat is None: stat = self.stats[name] = Stat()
+            stat.add(ns)
+        run = getattr(self._local, "run", None)
+        if run is not None:
+            span = run.spans.get(name)
+            if span is None: run.spans[name] = [1, ns]
+            else: span[0] += 1; span[1] += ns
+
+    def begin_run(self, label: str):
+        """Start this thread's run; an unfinished one (the script stopped early) is dropped."""
+        if not self.enabled: self._local.run = None; return
+        self._local.run = Run(label)
+        with self._lock: path, self._profile_to = self._profile_to, None
+        if path is not None:
+            prof = cProfile.Profile(); self._local.profile = (path, prof); prof.enable()
+
+    def end_run(self):
+        run = getattr(self._local, "run", None)
+        if run is None: return
+        self._local.run = None
+        profile = getattr(self._local, "profile", None)
+        if profile is not None:
+            path, prof = profile; prof.disable(); self._local.profile = None
+            prof.dump_stats(path); out = io.StringIO()
+            pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(25)
+            self.last_profile = (path, out.getvalue())
+        run.total_ns = time.perf_counter_ns() - run._t0
+        with self._lock:
+            stat = self.run_stats.get(run.label)
+            if stat is None: stat = self.run_stats[run.label] = Stat()
+            stat.add(run.total_ns); self.runs.append(run)
+
+    @contextmanager
+    def section(self, name: str)->Iterator[None]:
+        """Time a block; it becomes the thread's run when none is active (e.g. a fragment rerun)."""
+        if not self.enabled: yield; return
+        if getattr(self._local, "run", None) is None:
+            self.begin_run(name)
+            try: yield
+            finally: self.end_run()
+            return
+        t0 = time.perf_counter_ns()
+        try: yield
+        finally: self.record(name, time.perf_counter_ns() - t0)
+
+    def profile_next_run(self, path: str):
+        """cProfile the next run any thread begins and dump it to ``path`` (pstats format)."""
+        with self._lock: self._profile_to = path
+
+    # ---------- reading ----------
+    def summary(self)->List[Dict[str, Any]]:
+        """Per-name call stats, slowest total first."""
+        with self._lock: items = [(n, s.count, s.total_ns, s.max_ns, s.quantile(0.5), s.quantile(0.95)) for n, s in self.stats.items()]
+        return [{"name": n, "calls": c, "total_ms": t / 1e6, "mean_ms": t / 1e6 / c, "p50_ms": p50 * 1e3, "p95_ms": p95 * 1e3, "max_ms": m / 1e6}
+                for n, c, t, m, p50, p95 in sorted(items, key=lambda r: -r[2])]
+
+    def histogram(self, name: str)->List[Tuple[float, int]]:
+        """(bucket upper bound in ms, calls) for the populated range of ``name``'s histogram."""
+        stat = self.stats.get(name) or self.run_stats.get(name)
+        if stat is None or not stat.count: return []
+        b = stat.buckets; lo = next(i for i, n in enumerate(b) if n); hi = max(i for i, n in enumerate(b) if n)
+        return [(BOUNDS[i] * 1e3, b[i]) for i in range(lo, hi + 1)]
+
+    def prometheus(self, gauges: Optional[Dict[str, float]] = None, prefix: str = "walking_buddies")->str:
+        """All histograms (and ``gauges``) in the Prometheus text exposition format."""
+        lines: List[str] = []
+        def histogram(metric: str, label: str, stats: Dict[str, Stat], help_: str):
+            lines.append(f"# HELP {metric} {help_}"); lines.append(f"# TYPE {metric} histogram")
+            for key, s in sorted(stats.items()):
+                lab = f'{label}="{_escape(key)}"'; cum = 0
+                for bound, n in zip(BOUNDS[:-1], s.buckets):
+                    cum += n; lines.append(f'{metric}_bucket{{{lab},le="{bound:.6g}"}} {cum}')
+                lines.append(f'{metric}_bucket{{{lab},le="+Inf"}} {s.count}')
+                lines.append(f"{metric}_sum{{{lab}}} {s.total_ns / 1e9:.9f}"); lines.append(f"{metric}_count{{{lab}}} {s.count}")
+        with self._lock:
+            histogram(f"{prefix}_call_seconds", "fn", self.stats, "Wall time of probed calls (inclusive).")
+            histogram(f"{prefix}_run_seconds", "run", self.run_stats, "Wall time of script and fragment reruns.")
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {prefix}_{name} gauge"); lines.append(f"{prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str, gauges: Optional[Dict[str, float]] = None):
+        """Atomically replace ``path`` (e.g. for node_exporter's textfile collector)."""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fp: fp.write(self.prometheus(gauges))
+        os.replace(tmp, path)
+
+def _escape(value: str)->str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+RECORDER = Recorder(enabled=os.environ.get("WALKING_BUDDIES_PROBES", "") == "1")
+
+def timed(fn: Optional[Callable] = None, *, name: Optional[str] = None, recorder: Recorder = RECORDER):
+    """Decorator: record each call's wall time under ``name`` (default: the function's name).
+
+    Returns ``fn`` itself when the recorder is off at decoration time.
+    """
+    def wrap(fn: Callable)->Callable:
+        if not recorder.enabled: return fn
+        return _probe(fn, name or fn.__name__, recorder)
+    return wrap(fn) if fn is not None else wrap
+
+def _probe(fn: Callable, key: str, rec: Recorder)->Callable:
+    @functools.wraps(fn)
+    def probe(*args, **kwargs):
+        if not rec.enabled: return fn(*args, **kwargs)
+        t0 = time.perf_counter_ns()
+        try: return fn(*args, **kwargs)
+        finally: rec.record(key, time.perf_counter_ns() - t0)
+    return probe
+
+def instrument(obj: Any, names: Iterable[str], recorder: Recorder = RECORDER):
+    """Time the methods ``names`` of one long-lived object (e.g. the engine) by shadowing them with
+    instance attributes; ``uninstrument`` removes them, so an object that is not probed pays nothing."""
+    for n in names:
+        if n not in vars(obj): setattr(obj, n, _probe(getattr(obj, n), n, recorder))
+
+def uninstrument(obj: Any, names: Iterable[str]):
+    for n in names: vars(obj).pop(n, None)
+
+def section(name: str):
+    return RECORDER.section(name)
+
+
+# ---------- memory ----------
+_ATOMIC = (str, bytes, int, float, bool, complex, type(None), range)
+
+def deep_sizeof(obj: Any, seen: Optional[set] = None, limit: int = 5_000_000)->int:
+    """Approximate bytes reachable from ``obj``: containers, slotted and plain objects, array buffers.
+
+    Objects already in ``seen`` are not counted again (pass one set to measure several roots
+    without double counting); modules, classes and functions are not followed. Stops after
+    ``limit`` objects.
+    """
+    seen = set() if seen is None else seen; total = 0; stack = [obj]
+    while stack and len(seen) < limit:
+        o = stack.pop()
+        if id(o) in seen: continue
+        seen.add(id(o))
+        if isinstance(o, (type, type(sys), type(deep_sizeof), type(len))): continue
+        try: total += sys.getsizeof(o)
+        except TypeError: continue
+        if isinstance(o, _ATOMIC): continue
+        if hasattr(o, "dtype") and hasattr(o, "nbytes"): continue   # getsizeof of an ndarray includes a buffer it owns
+        if isinstance(o, dict): stack.extend(o.keys()); stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset, deque)): stack.extend(o)
+        else:
+            d = getattr(o, "__dict__", None)
+            if d is not None: stack.append(d)
+            for cls in type(o).__mro__:
+                slots = getattr(cls, "__slots__", ())
+                for slot in (slots,) if isinstance(slots, str) else slots:
+                    v = getattr(o, slot, None)
+                    if v is not None and slot != "__weakref__": stack.append(v)
+    return total
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""Per-user recurring reminders fired from a timer heap by one background thread.
+
+Every pending reminder is a (due, seq, uid, kind) entry in a binary heap; the latest entry
+for each (uid, kind) is the live one and older ones are skipped when they surface, so
+rescheduling, snoozing and cancelling are O(log n) pushes and repeated snoozes coalesce
+into a single pending reminder. The thread sleeps on a condition until the earliest due
+time (indefinitely when nothing is pending), so an idle scheduler costs nothing. A
+reminder that comes due inside the user's quiet hours is moved to the end of the window
+instead of being delivered. Deliveries go to a sink: anything with ``deliver(reminder)``.
+"""
+import heapq, json, threading, time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+KINDS = ("walk", "stand")
+DEFAULT_SETTINGS = {"walk_enabled": True, "walk_every_min": 120, "stand_enabled": True, "stand_every_min": 30, "snooze_minutes": 10}
+Reminder = namedtuple("Reminder", "uid kind due fired_at")
+
+
+@lru_cache(maxsize=256)
+def _parse_window(spec: str)->Optional[Tuple[int, int]]:
+    try:
+        start, end = spec.split("-")
+        (h1, m1), (h2, m2) = (map(int, start.split(":")), map(int, end.split(":")))
+    except (AttributeError, ValueError):
+        return None
+    return h1 * 60 + m1, h2 * 60 + m2
+
+def quiet_until(ts: float, spec: Optional[str])->Optional[float]:
+    """End of the quiet window ``spec`` ("22:00-07:00", local time, may wrap midnight) if ``ts`` falls inside it."""
+    window = _parse_window(spec) if spec else None
+    if window is None or window[0] == window[1]: return None
+    start, end = window; now = datetime.fromtimestamp(ts); minute = now.hour * 60 + now.minute
+    inside = start <= minute < end if start < end else (minute >= start or minute < end)
+    if not inside: return None
+    day = now.date() + timedelta(days=1) if start > end and minute >= start else now.date()
+    return datetime(day.year, day.month, day.day, end // 60, end % 60).timestamp()
+
+
+class MemorySink:
+    """In-process inbox: the unacknowledged reminders per user, one per kind (re-fires coalesce)."""
+
+    def __init__(self):
+        self._inbox: Dict[str, Dict[str, Reminder]] = {}
+        self._lock = threading.Lock()
+
+    def deliver(self, reminder: Reminder):
+        with self._lock: self._inbox.setdefault(reminder.uid, {})[reminder.kind] = reminder
+
+    def pending(self, uid: str)->Dict[str, Reminder]:
+        with self._lock: return dict(self._inbox.get(uid, ()))
+
+    def ack(self, uid: str, kind: str):
+        with self._lock:
+            box = self._inbox.get(uid)
+            if box is not None:
+                box.pop(kind, None)
+                if not box: del self._inbox[uid]
+
+class FileSink:
+    """Appends one JSON line per delivery; a stand-in for a push or email gateway."""
+
+    def __init__(self, path: str):
+        self.path = path; self._lock = threading.Lock()
+
+    def deliver(self, reminder: Reminder):
+        line = json.dumps(reminder._asdict(), separators=(",", ":"))
+        with self._lock, open(self.path, "a", encoding="utf-8") as fp: fp.write(line + "\n")
+
+
+class ReminderScheduler:
+    def __init__(self, sink, quiet_hours_of: Callable[[str], Optional[str]] = lambda uid: None, clock: Callable[[], float] = time.time):
+        self.sink = sink; self.quiet_hours_of = quiet_hours_of; self.clock = clock
+        self._heap: List[Tuple[float, int, str, str]] = []
+        self._live: Dict[Tuple[str, str], Tuple[float, int]] = {}   # (uid, kind) -> (due, seq) of the live entry
+        self._every: Dict[Tuple[str, str], float] = {}              # (uid, kind) -> repeat interval in seconds
+        self._seq = 0; self.delivered = 0; self.deferred = 0
+        self._cond = threading.Condition(); self._thread: Optional[threading.Thread] = None; self._running = False
+
+    def __len__(self)->int:
+        return len(self._live)
+
+    # ---------- scheduling ----------
+    def _push(self, uid: str, kind: str, due: float):
+        self._seq += 1; self._live[(uid, kind)] = (due, self._seq)
+        heapq.heappush(self._heap, (due, self._seq, uid, kind))
+        if len(self._heap) > 2 * len(self._live) + 64:   # mostly superseded entries: rebuild
+            self._heap = [(d, s, u, k) for (u, k), (d, s) in self._live.items()]; heapq.heapify(self._heap)
+        if self._heap[0][1] == self._seq: self._cond.notify()   # new earliest deadline: wake the timer thread
+
+    def schedule(self, uid: str, kind: str, every_min: float, first_in_min: Optional[float] = None):
+        """Repeat every ``every_min`` minutes, first after ``first_in_min`` (default: one interval)."""
+        with self._cond:
+            self._every[(uid, kind)] = every_min * 60.0
+            self._push(uid, kind, self.clock() + 60.0 * (every_min if first_in_min is None else first_in_min))
+
+    def snooze(self, uid: str, kind: str, minutes: float):
+        """Fire once ``minutes`` from now, then resume the usual interval; snoozing again replaces it."""
+        with self._cond:
+            if (uid, kind) in self._every: self._push(uid, kind, self.clock() + 60.0 * minutes)
+
+    def complete(self, uid: str, kind: str):
+        """Acknowledge: the next reminder is one full interval from now."""
+        with self._cond:
+            every = self._every.get((uid, kind))
+            if every is not None: self._push(uid, kind, self.clock() + every)
+
+    def cancel(self, uid: str, kind: str):
+        with self._cond: self._live.pop((uid, kind), None); self._every.pop((uid, kind), None)
+
+    def configure(self, uid: str, settings: Dict):
+        """Apply a user's settings: start, re-time or cancel each kind; unchanged kinds keep their due time."""
+        for kind in KINDS:
+            every = float(settings.get(f"{kind}_every_min", DEFAULT_SETTINGS[f"{kind}_every_min"]))
+            if not settings.get(f"{kind}_enabled", True): self.cancel(uid, kind)
+            elif self._every.get((uid, kind)) != every * 60.0: self.schedule(uid, kind, every)
+
+    def next_due(self, uid: str, kind: str)->Optional[float]:
+        live = self._live.get((uid, kind))
+        return live[0] if live else None
+
+    # ---------- firing ----------
+    def _pop_due(self, now: float)->List[Reminder]:
+        fired = []
+        while self._heap and self._heap[0][0] <= now:
+            due, seq, uid, kind = heapq.heappop(self._heap)
+            if self._live.get((uid, kind)) != (due, seq): continue   # superseded or cancelled
+            until = quiet_until(now, self.quiet_hours_of(uid))
+            if until is not None:
+                self._push(uid, kind, until); self.deferred += 1; continue
+            fired.append(Reminder(uid, kind, due, now))
+            self._push(uid, kind, now + self._every[(uid, kind)])
+        return fired
+
+    def tick(self, now: Optional[float] = None)->List[Reminder]:
+        """Deliver everything due by ``now``; the timer thread calls this, tests can call it directly."""
+        with self._cond: fired = self._pop_due(self.clock() if now is None else now)
+        for r in fired: self.sink.deliver(r)
+        self.delivered += len(fired)
+        return fired
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    timeout = self._heap[0][0] - self.clock() if self._heap else None
+                    if timeout is not None and timeout <= 0: break
+                    self._cond.wait(timeout)
+                if not self._running: return
+            self.tick()
+
+    def start(self)->"ReminderScheduler":
+        with self._cond:
+            if self._thread is None:
+                self._running = True
+                self._thread = threading.Thread(target=self._run, name="reminders", daemon=True); self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond: self._running = False; self._cond.notify()
+        if self._thread is not None: self._thread.join(); self._thread = None
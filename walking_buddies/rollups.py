@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""Materialized weekly, weekend and monthly activity totals per user, team, city and company.
+
+A PeriodTable keeps, per key and grain, a ring of the most recent ``WINDOWS[grain]`` buckets
+with the five activity metrics each: bucket ``b`` lives in slot ``b % window`` with its id
+alongside, so adding to a bucket or reading one is O(1) and a bucket older than the window is
+simply dropped. Weeks are ISO weeks (Monday first) numbered from day ordinal 1, a weekend is
+the Saturday and Sunday of its week, and months are numbered ``year * 12 + month - 1``.
+
+Rollups owns one table per scope plus the per-team daily mileage index used for battles (whose
+windows are arbitrary date ranges). Walk events update every table the walker belongs to;
+changing team, city or company moves the user's windowed totals from the old group to the new
+one; ``build`` recomputes everything from the activity logs. Writes serialize on a sequence
+lock and reads retry if one overlapped.
+"""
+from datetime import date
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from .concurrency import SeqLock
+from .team_miles import TeamMileageIndex
+from .timeseries import METRICS, ActivityLog, Day, day_ordinal, stack
+
+GRAINS = ("weekly", "weekend", "monthly")
+WINDOWS = {"weekly": 14, "weekend": 14, "monthly": 13}   # buckets kept: a quarter of weeks, a year of months
+GROUP_SCOPES = ("team", "city", "company")
+SCOPES = ("user",) + GROUP_SCOPES
+_M = len(METRICS)
+_COL = {m: i for i, m in enumerate(METRICS)}
+
+
+# ---------- buckets ----------
+@lru_cache(maxsize=4096)
+def _month(ordinal: int)->int:
+    d = date.fromordinal(ordinal); return d.year * 12 + d.month - 1
+
+def bucket(grain: str, day: Day)->Optional[int]:
+    """Bucket id of ``day`` for ``grain``; None for a weekday under "weekend"."""
+    o = day_ordinal(day)
+    if grain == "monthly": return _month(o)
+    if grain == "weekend" and (o - 1) % 7 < 5: return None
+    return (o - 1) // 7
+
+def current_bucket(grain: str, today: Day)->int:
+    """The bucket a period challenge means on ``today`` (this week's weekend even on a weekday)."""
+    o = day_ordinal(today)
+    return _month(o) if grain == "monthly" else (o - 1) // 7
+
+def bucket_start(grain: str, b: int)->date:
+    if grain == "monthly": return date(b // 12, b % 12 + 1, 1)
+    return date.fromordinal(b * 7 + (6 if grain == "weekend" else 1))
+
+def _buckets(grain: str, ordinals: np.ndarray)->np.ndarray:
+    if grain != "monthly": return (ordinals - 1) // 7
+    return np.fromiter((_month(int(o)) for o in ordinals), dtype=np.int64, count=len(ordinals))
+
+
+class PeriodTable:
+    def __init__(self, rows: int = 8):
+        self.rows: Dict[str, int] = {}
+        self.vals = {g: np.zeros((rows, w, _M)) for g, w in WINDOWS.items()}
+        self.ids = {g: np.full((rows, w), -1, dtype=np.int64) for g, w in WINDOWS.items()}
+        self.newest = {g: np.full(rows, -1, dtype=np.int64) for g in WINDOWS}   # latest bucket id per row
+
+    def _row(self, key: str)->int:
+        r = self.rows.get(key)
+        if r is None:
+            r = self.rows[key] = len(self.rows)
+            n = self.ids["weekly"].shape[0]
+            if r >= n:
+                for g, w in WINDOWS.items():
+                    vals = np.zeros((2 * n, w, _M)); vals[:n] = self.vals[g]; self.vals[g] = vals
+                    ids = np.full((2 * n, w), -1, dtype=np.int64); ids[:n] = self.ids[g]; self.ids[g] = ids
+                    newest = np.full(2 * n, -1, dtype=np.int64); newest[:n] = self.newest[g]; self.newest[g] = newest
+        return r
+
+    def _add(self, r: int, grain: str, b: int, vec):
+        slot = b % WINDOWS[grain]; ids = self.ids[grain]; cur = ids[r, slot]
+        if cur == b: self.vals[grain][r, slot] += vec
+        elif cur < b:
+            self.vals[grain][r, slot] = vec; ids[r, slot] = b
+            if b > self.newest[grain][r]: self.newest[grain][r] = b
+        # else: older than the window
+
+    def add(self, key: str, day: Day, vec: np.ndarray):
+        """Add one day's metric vector (in ``METRICS`` order) to ``key``'s buckets."""
+        r = self._row(key); o = day_ordinal(day)
+        for g in GRAINS:
+            b = bucket(g, o)
+            if b is not None: self._add(r, g, b, vec)
+
+    def add_many(self, key: str, ordinals: np.ndarray, values: np.ndarray):
+        """Vectorized ``add`` for parallel day ordinals and (days, metrics) values."""
+        if not len(ordinals): return
+        r = self._row(key)
+        for g in GRAINS:
+            o, v = ordinals, values
+            if g == "weekend":
+                keep = (ordinals - 1) % 7 >= 5; o, v = ordinals[keep], values[keep]
+                if not len(o): continue
+            bs = _buckets(g, o); uniq, inv = np.unique(bs, return_inverse=True)
+            sums = np.zeros((len(uniq), _M)); np.add.at(sums, inv, v)
+            for b, s in zip(uniq.tolist(), sums): self._add(r, g, b, s)
+
+    def fold(self, key: str, src: "PeriodTable", src_key: str, sign: int = 1):
+        """Add (or with sign=-1 subtract) every bucket ``src`` holds for ``src_key`` into ``key``."""
+        s = src.rows.get(src_key)
+        if s is None: return
+        r = self._row(key)
+        for g in GRAINS:
+            for slot in np.flatnonzero(src.ids[g][s] >= 0).tolist():
+                self._add(r, g, int(src.ids[g][s, slot]), sign * src.vals[g][s, slot])
+
+    def get(self, key: str, grain: str, b: int, metric: str)->Optional[float]:
+        """``metric`` in bucket ``b``: 0 when nothing was recorded, None when the bucket is older than the window."""
+        r = self.rows.get(key); w = WINDOWS[grain]
+        if r is None: return 0.0
+        if b <= self.newest[grain][r] - w: return None
+        slot = b % w
+        return float(self.vals[grain][r, slot, _COL[metric]]) if self.ids[grain][r, slot] == b else 0.0
+
+    def series(self, key: str, grain: str, last: int, n: int)->np.ndarray:
+        """(n, metrics) totals of buckets ``last - n + 1 .. last``, oldest first; n is capped at the window."""
+        n = min(n, WINDOWS[grain]); out = np.zeros((n, _M)); r = self.rows.get(key)
+        if r is None: return out
+        bs = np.arange(last - n + 1, last + 1); slots = bs % WINDOWS[grain]
+        hit = self.ids[grain][r, slots] == bs
+        out[hit] = self.vals[grain][r, slots[hit]]
+        return out
+
+
+class Rollups:
+    def __init__(self, team_miles: TeamMileageIndex):
+        self.tables = {s: PeriodTable() for s in SCOPES}
+        self.team_miles = team_miles   # per-team daily miles with prefix sums: battles over any date range
+        self.seq = SeqLock()
+
+    @classmethod
+    def build(cls, users: Dict[str, Any], teams: Dict[str, dict], today: Optional[Day] = None, chunk: int = 1024)->"Rollups":
+        """All rollups from the users' activity logs (buckets within the windows ending at ``today``)."""
+        today = day_ordinal(today if today is not None else date.today())
+        ru = cls(TeamMileageIndex.build(teams, users, today)); table = ru.tables["user"]
+        first = min(bucket_start(g, current_bucket(g, today) - WINDOWS[g] + 1).toordinal() for g in GRAINS)
+        days = np.arange(first, today + 1, dtype=np.int64)
+        uids = list(users); groups = {s: [] for s in GROUP_SCOPES}
+        for uid in uids:
+            table._row(uid); u = users[uid]
+            for s in GROUP_SCOPES: groups[s].append(ru.tables[s]._row(getattr(u, s)) if getattr(u, s) else -1)
+        n = len(uids); spread = {}
+        for g in GRAINS:   # (days, buckets) 0/1 matrix over the grain's own window: a day's values go to its bucket
+            lo = bucket_start(g, current_bucket(g, today) - WINDOWS[g] + 1).toordinal() - first; gd = days[lo:]
+            keep = (gd - 1) % 7 >= 5 if g == "weekend" else np.ones(len(gd), dtype=bool)
+            bs = _buckets(g, gd); uniq = np.unique(bs[keep])   # at most WINDOWS[g] buckets, so one slot each
+            spread[g] = (lo, uniq, ((bs[:, None] == uniq[None, :]) & keep[:, None]).astype(float))
+            table.ids[g][:n, uniq % WINDOWS[g]] = uniq; table.newest[g][:n] = uniq.max() if len(uniq) else -1
+        for lo in range(0, n, chunk):
+            logs: List[ActivityLog] = [users[uid].activity for uid in uids[lo:lo + chunk]]; hi = lo + len(logs)
+            for i, m in enumerate(METRICS):
+                daily = stack(logs, m, first, today).astype(float)   # (users, days)
+                for g, (start, uniq, to_bucket) in spread.items(): table.vals[g][lo:hi, uniq % WINDOWS[g], i] = daily[:, start:] @ to_bucket
+        for s in GROUP_SCOPES:
+            idx = np.asarray(groups[s], dtype=np.int64); member = idx >= 0; gt = ru.tables[s]
+            for g in GRAINS:
+                np.add.at(gt.vals[g], idx[member], table.vals[g][:n][member])
+                m = len(gt.rows)
+                if m and n: gt.ids[g][:m] = table.ids[g][0]; gt.newest[g][:m] = table.newest[g][0]
+        return ru
+
+    def _groups(self, u)->Iterable[Tuple[str, str]]:
+        return [(s, getattr(u, s)) for s in GROUP_SCOPES if getattr(u, s)]
+
+    # ---------- writes ----------
+    def record(self, uid: str, u, day: Day, minutes: int = 0, steps: int = 0, miles: float = 0.0, calories: int = 0, walks: int = 0):
+        """One day's increase for ``uid``, into the user's rollups and those of their team, city and company."""
+        vec = np.array([minutes, steps, miles, calories, walks], dtype=float)
+        with self.seq.write():
+            self.tables["user"].add(uid, day, vec)
+            for scope, key in self._groups(u): self.tables[scope].add(key, day, vec)
+        if u.team and miles: self.team_miles.add(u.team, day, miles)
+
+    def record_many(self, uid: str, u, ordinals, minutes=0, steps=0, miles=0.0, calories=0, walks=0):
+        """Vectorized ``record`` for parallel arrays (or scalars) per day."""
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        if not len(ordinals): return
+        values = np.column_stack([np.broadcast_to(np.asarray(v, dtype=float), ordinals.shape) for v in (minutes, steps, miles, calories, walks)])
+        with self.seq.write():
+            self.tables["user"].add_many(uid, ordinals, values)
+            for scope, key in self._groups(u): self.tables[scope].add_many(key, ordinals, values)
+        if u.team: self.team_miles.add_many(u.team, ordinals, values[:, 2])
+
+    def move(self, uid: str, log: ActivityLog, scope: str, old: Optional[str], new: Optional[str]):
+        """``uid`` left group ``old`` and joined ``new`` of ``scope`` (either may be None): carry their totals over."""
+        users = self.tables["user"]
+        with self.seq.write():
+            if old: self.tables[scope].fold(old, users, uid, -1)
+            if new: self.tables[scope].fold(new, users, uid)
+        if scope == "team":
+            if old: self.team_miles.remove_member(old, log)
+            if new: self.team_miles.add_member(new, log)
+
+    # ---------- reads ----------
+    def period_total(self, scope: str, key: str, metric: str, grain: str, today: Day)->Optional[float]:
+        """``metric`` for the current ``grain`` period of ``today``; None when it is outside the window."""
+        b = current_bucket(grain, today); table = self.tables[scope]
+        return self.seq.read(lambda: table.get(key, grain, b, metric))
+
+    def trend(self, scope: str, key: str, grain: str, periods: int, today: Day)->Tuple[List[date], np.ndarray]:
+        """(period start dates, (periods, metrics) totals) for the last ``periods`` periods up to ``today``."""
+        last = current_bucket(grain, today)
+        out = self.seq.read(lambda: self.tables[scope].series(key, grain, last, periods))
+        return [bucket_start(grain, b) for b in range(last - len(out) + 1, last + 1)], out
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""GPS route tracks: compact polylines, simplification, geometry and spatial lookup.
+
+Tracks are stored as encoded polylines (per-point deltas of 1e-5 degrees, zigzag varints
+in 5-bit printable chunks, the format map libraries read). ``simplify`` is Douglas-Peucker
+with each split's distances computed as one NumPy expression over the segment. Distances
+come from the raw track (haversine), neighborhoods are the geohash cells it passes
+through. RouteIndex keeps routes per owner, by name, and in a uniform lat/lon grid so
+"routes within X km" only examines the cells around the query point.
+"""
+import io, math
+import xml.etree.ElementTree as ET
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+
+EARTH_KM = 6371.0088
+KM_PER_DEG = math.pi * EARTH_KM / 180.0
+_GEOHASH = "0123456789bcdefghjkmnpqrstuvwxyz"
+Track = Tuple[np.ndarray, np.ndarray]   # (lat, lon) in degrees
+
+
+# ---------- polyline codec ----------
+def encode_polyline(lat: np.ndarray, lon: np.ndarray, precision: int = 5)->str:
+    scale = 10 ** precision
+    pts = np.column_stack([np.round(np.asarray(lat) * scale), np.round(np.asarray(lon) * scale)]).astype(np.int64)
+    deltas = np.diff(pts, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    zz = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+    out = []
+    for v in zz.tolist():
+        while v >= 0x20: out.append(chr((0x20 | (v & 0x1f)) + 63)); v >>= 5
+        out.append(chr(v + 63))
+    return "".join(out)
+
+def decode_polyline(text: str, precision: int = 5)->Track:
+    vals = []; v = shift = 0
+    for ch in text:
+        b = ord(ch) - 63; v |= (b & 0x1f) << shift; shift += 5
+        if b < 0x20: vals.append(~(v >> 1) if v & 1 else v >> 1); v = shift = 0
+    pts = np.cumsum(np.asarray(vals, dtype=np.int64).reshape(-1, 2), axis=0) / 10 ** precision
+    return pts[:, 0], pts[:, 1]
+
+
+# ---------- geometry ----------
+def path_km(lat: np.ndarray, lon: np.ndarray)->float:
+    """Haversine length of a track."""
+    if len(lat) < 2: return 0.0
+    p = np.radians(lat); l = np.radians(lon)
+    a = np.sin(np.diff(p) / 2) ** 2 + np.cos(p[:-1]) * np.cos(p[1:]) * np.sin(np.diff(l) / 2) ** 2
+    return float(2 * EARTH_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0))).sum())
+
+def _local_xy(lat: np.ndarray, lon: np.ndarray)->np.ndarray:
+    """Equirectangular projection to km around the track's mean latitude; fine at route scale."""
+    k = math.cos(math.radians(float(np.mean(lat))))
+    return np.column_stack([(lon - lon[0]) * KM_PER_DEG * k, (lat - lat[0]) * KM_PER_DEG])
+
+def simplify(lat: np.ndarray, lon: np.ndarray, tolerance_m: float = 5.0)->Track:
+    """Douglas-Peucker: drop points closer than ``tolerance_m`` to the simplified line."""
+    lat = np.asarray(lat, dtype=float); lon = np.asarray(lon, dtype=float)
+    if len(lat) < 3: return lat, lon
+    xy = _local_xy(lat, lon); tol = tolerance_m / 1000.0
+    keep = np.zeros(len(lat), dtype=bool); keep[0] = keep[-1] = True
+    stack = [(0, len(lat) - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2: continue
+        seg = xy[j] - xy[i]; pts = xy[i + 1:j] - xy[i]; norm = math.hypot(*seg)
+        if norm == 0: d = np.hypot(pts[:, 0], pts[:, 1])
+        else: d = np.abs(seg[0] * pts[:, 1] - seg[1] * pts[:, 0]) / norm
+        k = int(np.argmax(d))
+        if d[k] > tol:
+            m = i + 1 + k; keep[m] = True; stack.append((i, m)); stack.append((m, j))
+    return lat[keep], lon[keep]
+
+def densify(lat: np.ndarray, lon: np.ndarray, step_deg: float)->Track:
+    """The track with points inserted so no two consecutive points are more than ``step_deg`` apart."""
+    lat = np.asarray(lat, dtype=float); lon = np.asarray(lon, dtype=float)
+    if len(lat) < 2: return lat, lon
+    n = np.maximum(1, np.ceil(np.hypot(np.diff(lat), np.diff(lon)) / step_deg).astype(np.int64))
+    seg = np.repeat(np.arange(len(n)), n)
+    frac = np.arange(int(n.sum())) - np.repeat(np.cumsum(n) - n, n)
+    frac = frac / np.repeat(n, n)
+    return (np.append(lat[seg] + frac * np.diff(lat)[seg], lat[-1]), np.append(lon[seg] + frac * np.diff(lon)[seg], lon[-1]))
+
+def geohash(lat: float, lon: float, precision: int = 6)->str:
+    lat_r, lon_r = [-90.0, 90.0], [-180.0, 180.0]; out = []; bits = 0; n = 0; even = True
+    while len(out) < precision:
+        r, v = (lon_r, lon) if even else (lat_r, lat)
+        mid = (r[0] + r[1]) / 2
+        if v >= mid: bits = (bits << 1) | 1; r[0] = mid
+        else: bits <<= 1; r[1] = mid
+        even = not even; n += 1
+        if n == 5: out.append(_GEOHASH[bits]); bits = n = 0
+    return "".join(out)
+
+def neighborhoods(lat: np.ndarray, lon: np.ndarray, precision: int = 6)->List[str]:
+    """Distinct geohash cells (~1.2 x 0.6 km at precision 6) a track passes through, in visiting order."""
+    step = 180.0 / 2 ** (5 * precision // 2 + 1)   # half the smaller cell side, so no cell is stepped over
+    lat, lon = densify(lat, lon, step)
+    seen: Dict[str, None] = {}; last = None
+    for a, b in zip(lat.tolist(), lon.tolist()):
+        cell = (int(a / step), int(b / step))   # several samples per cell: hash each sub-cell once
+        if cell == last: continue
+        last = cell; seen.setdefault(geohash(a, b, precision), None)
+    return list(seen)
+
+def parse_gpx(data: bytes)->Track:
+    """Track points (``trkpt``, falling back to ``rtept``) of a GPX file."""
+    lat, lon = [], []
+    for _, el in ET.iterparse(io.BytesIO(data)):
+        if el.tag.rsplit("}", 1)[-1] in ("trkpt", "rtept"):
+            lat.append(float(el.get("lat"))); lon.append(float(el.get("lon")))
+        el.clear()
+    return np.asarray(lat), np.asarray(lon)
+
+def track_fields(lat: np.ndarray, lon: np.ndarray, tolerance_m: float = 5.0)->Dict[str, Any]:
+    """What a route stores for a raw track: simplified polyline, geometric distance, neighborhoods."""
+    slat, slon = simplify(lat, lon, tolerance_m)
+    return {"polyline": encode_polyline(slat, slon), "distance_km": round(path_km(lat, lon), 3),
+            "points": int(len(slat)), "neighborhoods": neighborhoods(lat, lon)}
+
+
+def _distance_km(track: Track, lat: float, lon: float, k: float)->float:
+    """Distance from a point to a polyline, in a local projection scaled by ``k = cos(lat)``."""
+    x = (track[1] - lon) * k * KM_PER_DEG; y = (track[0] - lat) * KM_PER_DEG
+    if len(x) == 1: return float(math.hypot(x[0], y[0]))
+    dx, dy = np.diff(x), np.diff(y); l2 = dx * dx + dy * dy
+    t = np.clip(-(x[:-1] * dx + y[:-1] * dy) / np.where(l2 > 0, l2, 1.0), 0.0, 1.0)
+    return float(np.hypot(x[:-1] + t * dx, y[:-1] + t * dy).min())
+
+
+# ---------- index ----------
+class RouteIndex:
+    def __init__(self, routes: Iterable[Dict[str, Any]] = (), cell_km: float = 2.0):
+        self.cell_deg = cell_km / KM_PER_DEG
+        self.by_user: Dict[str, Dict[str, Dict[str, Any]]] = {}   # owner -> name -> route, in insertion order
+        self.grid: Dict[Tuple[int, int], Set[Tuple[str, str]]] = {}
+        self._tracks: Dict[Tuple[str, str], Track] = {}
+        for r in routes: self.add(r)
+
+    def __len__(self)->int:
+        return sum(len(v) for v in self.by_user.values())
+
+    def _cells(self, lat: np.ndarray, lon: np.ndarray)->Set[Tuple[int, int]]:
+        lat, lon = densify(lat, lon, self.cell_deg / 2)   # every cell a segment crosses, not only its vertices
+        i = np.floor(lat / self.cell_deg).astype(np.int64); j = np.floor(lon / self.cell_deg).astype(np.int64)
+        return set(zip(i.tolist(), j.tolist()))
+
+    def add(self, route: Dict[str, Any]):
+        key = (route["user_id"], route["name"])
+        if key[1] in self.by_user.get(key[0], ()): self.remove(*key)   # same-name routes replace the older one
+        self.by_user.setdefault(key[0], {})[key[1]] = route
+        if route.get("polyline"):
+            track = self._tracks[key] = decode_polyline(route["polyline"])
+            for c in self._cells(*track): self.grid.setdefault(c, set()).add(key)
+
+    def remove(self, uid: str, name: str)->Optional[Dict[str, Any]]:
+        route = self.by_user.get(uid, {}).pop(name, None)
+        track = self._tracks.pop((uid, name), None)
+        if track is not None:
+            for c in self._cells(*track):
+                keys = self.grid.get(c)
+                if keys is not None:
+                    keys.discard((uid, name))
+                    if not keys: del self.grid[c]
+        return route
+
+    def of_user(self, uid: str)->List[Dict[str, Any]]:
+        return list(self.by_user.get(uid, {}).values())
+
+    def track(self, uid: str, name: str)->Optional[Track]:
+        return self._tracks.get((uid, name))
+
+    def near(self, lat: float, lon: float, radius_km: float, visible: Optional[Callable[[Dict[str, Any]], bool]] = None,
+             limit: int = 50)->List[Tuple[float, Dict[str, Any]]]:
+        """(km to the nearest point of the track, route) for routes passing within ``radius_km``, nearest first."""
+        dlat = radius_km / KM_PER_DEG; dlon = radius_km / (KM_PER_DEG * max(math.cos(math.radians(lat)), 1e-6))
+        i0, i1 = math.floor((lat - dlat) / self.cell_deg), math.floor((lat + dlat) / self.cell_deg)
+        j0, j1 = math.floor((lon - dlon) / self.cell_deg), math.floor((lon + dlon) / self.cell_deg)
+        keys: Set[Tuple[str, str]] = set()
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1): keys |= self.grid.get((i, j), set())
+        hits = []; p = math.radians(lat); k = math.cos(p)
+        for key in keys:
+            route = self.by_user[key[0]][key[1]]
+            if visible is not None and not visible(route): continue
+            d = _distance_km(self._tracks[key], lat, lon, k)
+            if d <= radius_km: hits.append((float(d), route))
+        hits.sort(key=lambda h: h[0])
+        return hits[:limit]
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""The buddy graph in compressed sparse row (CSR) form.
+
+Users get dense integer ids; each user's buddies are a sorted slice of one int32
+``indices`` array delimited by ``indptr``, so an edge costs 8 bytes (stored once per
+direction) instead of two set entries. New edges go to a small pending buffer that is
+merged into the CSR arrays in bulk. Queries (2-hop reachability, mutual counts,
+suggestions, degree statistics) work on whole rows with numpy.
+"""
+from typing import Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+
+_EMPTY = np.zeros(0, dtype=np.int32)
+
+
+class SocialGraph:
+    def __init__(self, edges: Iterable[Tuple[str, str]] = (), compact_every: int = 4096):
+        self.ids: Dict[str, int] = {}
+        self.names: List[str] = []
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = _EMPTY
+        self._pending: Dict[int, Set[int]] = {}   # id -> buddies added since the last compaction
+        self._pending_edges = 0
+        self.compact_every = compact_every
+        self.add_edges(edges); self.compact()
+
+    def _id(self, uid: str)->int:
+        i = self.ids.get(uid)
+        if i is None:
+            i = self.ids[uid] = len(self.names); self.names.append(uid)
+        return i
+
+    def add_user(self, uid: str)->int:
+        return self._id(uid)
+
+    # ---------- rows ----------
+    def _row(self, i: int)->np.ndarray:
+        row = self.indices[self.indptr[i]:self.indptr[i + 1]] if i + 1 < len(self.indptr) else _EMPTY
+        extra = self._pending.get(i)
+        if extra: row = np.union1d(row, np.fromiter(extra, dtype=np.int32, count=len(extra))).astype(np.int32)
+        return row
+
+    def _has(self, i: int, j: int)->bool:
+        if j in self._pending.get(i, ()): return True
+        if i + 1 >= len(self.indptr): return False
+        lo, hi = self.indptr[i], self.indptr[i + 1]
+        k = lo + int(np.searchsorted(self.indices[lo:hi], j))
+        return k < hi and self.indices[k] == j
+
+    def _rows(self, ids: Iterable[int])->np.ndarray:
+        parts = [self._row(i) for i in ids]
+        return np.concatenate(parts) if parts else _EMPTY
+
+    # ---------- writes ----------
+    def add_edges(self, pairs: Iterable[Tuple[str, str]])->List[Tuple[str, str]]:
+        """Insert undirected edges in one batch; returns the pairs that were new."""
+        added = []
+        for a, b in pairs:
+            if a == b: continue
+            i, j = self._id(a), self._id(b)
+            if self._has(i, j): continue
+            self._pending.setdefault(i, set()).add(j); self._pending.setdefault(j, set()).add(i)
+            self._pending_edges += 1; added.append((a, b))
+        if self._pending_edges >= self.compact_every: self.compact()
+        return added
+
+    def compact(self):
+        """Merge pending edges into the CSR arrays."""
+        n = len(self.names)
+        if not self._pending:
+            if len(self.indptr) < n + 1:
+                self.indptr = np.concatenate([self.indptr, np.full(n + 1 - len(self.indptr), self.indptr[-1])])
+            return
+        old_src = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int32), np.diff(self.indptr))
+        new_src = np.fromiter((i for i, js in self._pending.items() for _ in js), dtype=np.int32)
+        new_dst = np.fromiter((j for js in self._pending.values() for j in js), dtype=np.int32)
+        src = np.concatenate([old_src, new_src]); dst = np.concatenate([self.indices, new_dst])
+        order = np.lexsort((dst, src))
+        self.indices = dst[order].astype(np.int32)
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=self.indptr[1:])
+        self._pending.clear(); self._pending_edges = 0
+
+    # ---------- point queries ----------
+    def friends(self, uid: str)->List[str]:
+        i = self.ids.get(uid)
+        return [] if i is None else [self.names[j] for j in self._row(i)]
+
+    def degree(self, uid: str)->int:
+        i = self.ids.get(uid)
+        return 0 if i is None else len(self._row(i))
+
+    def is_friend(self, a: str, b: str)->bool:
+        i, j = self.ids.get(a), self.ids.get(b)
+        return i is not None and j is not None and self._has(i, j)
+
+    def within_two_hops(self, a: str, b: str)->bool:
+        """Buddies, or sharing at least one buddy."""
+        i, j = self.ids.get(a), self.ids.get(b)
+        if i is None or j is None: return False
+        return self._has(i, j) or len(np.intersect1d(self._row(i), self._row(j), assume_unique=True)) > 0
+
+    # ---------- bulk queries ----------
+    def _mask(self, ids: np.ndarray)->np.ndarray:
+        mask = np.zeros(len(self.names), dtype=bool); mask[ids] = True
+        return mask
+
+    def reachable_two_hops(self, uid: str, targets: Iterable[str])->np.ndarray:
+        """Boolean per target: is it a buddy or a buddy of a buddy of ``uid``?"""
+        targets = list(targets)
+        i = self.ids.get(uid)
+        if i is None: return np.zeros(len(targets), dtype=bool)
+        near = self._row(i)
+        reach = self._mask(np.concatenate([near, self._rows(near)]))
+        reach[i] = False
+        return np.array([t in self.ids and bool(reach[self.ids[t]]) for t in targets], dtype=bool)
+
+    def mutual_counts(self, uid: str, others: Iterable[str])->np.ndarray:
+        others = list(others)
+        i = self.ids.get(uid)
+        if i is None: return np.zeros(len(others), dtype=np.int64)
+        mine = self._mask(self._row(i))
+        return np.array([int(mine[self._row(self.ids[o])].sum()) if o in self.ids else 0 for o in others], dtype=np.int64)
+
+    def suggestions(self, uid: str, limit: int = 10, visible=None)->List[Tuple[str, int]]:
+        """Friends-of-friends who are not yet buddies, most mutual buddies first: [(uid, mutual count)]."""
+        i = self.ids.get(uid)
+        if i is None: return []
+        near = self._row(i)
+        counts = np.bincount(self._rows(near), minlength=len(self.names))
+        counts[near] = 0; counts[i] = 0
+        nz = np.flatnonzero(counts)
+        out: List[Tuple[str, int]] = []
+        for j in nz[np.lexsort((nz, -counts[nz]))]:
+            if len(out) == limit: break
+            name = self.names[j]
+            if visible is None or visible(name): out.append((name, int(counts[j])))
+        return out
+
+    def degree_stats(self)->Dict[str, float]:
+        self.compact()
+        deg = np.diff(self.indptr)
+        if not len(deg): return {"users": 0, "edges": 0, "mean": 0.0, "median": 0.0, "p95": 0.0, "max": 0}
+        return {"users": int(len(deg)), "edges": int(deg.sum() // 2), "mean": float(deg.mean()),
+                "median": float(np.median(deg)), "p95": float(np.percentile(deg, 95)), "max": int(deg.max())}
+
+    def edges(self)->List[Tuple[str, str]]:
+        """Each undirected edge once, as (lower id, higher id) name pairs."""
+        self.compact()
+        src = np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))
+        keep = src < self.indices
+        return [(self.names[a], self.names[b]) for a, b in zip(src[keep], self.indices[keep])]
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""SQLite system of record behind the Streamlit session state.
+
+A Store is opened once per process. It loads the shared state every session works on,
+keeps a small pool of WAL-mode connections and writes the changes made during a rerun
+in one transaction when ``flush`` is called. Any number of threads may change the state
+inside ``writing`` (or ``journaled``) blocks at once; ``flush`` waits for them to finish,
+so a snapshot never holds half an operation.
+
+An open Store holds an advisory lock on ``<db>.lock`` (and ``<journal>.lock``) until it is
+closed, so a second process, such as the health import command line, cannot open the same
+database or journal next to a running app; it gets StoreInUse instead. Stores opened again
+within one process share the lock.
+"""
+import itertools, json, os, queue, sqlite3, threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, Iterable, List, Iterator, Optional, Tuple
+from .concurrency import SharedLock
+from .journal import Journal, replay
+from .privacy import PrivacySettings
+from .streaks import StreakState
+from .timeseries import day_ordinal
+from .users import UserRecord
+
+try:
+    import fcntl
+except ImportError:   # Windows
+    fcntl = None; import msvcrt
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS activity (
+    user_id TEXT NOT NULL, day TEXT NOT NULL, team TEXT,
+    minutes INTEGER NOT NULL DEFAULT 0, steps INTEGER NOT NULL DEFAULT 0,
+    miles REAL NOT NULL DEFAULT 0, calories INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_activity_team_day ON activity(team, day);
+CREATE TABLE IF NOT EXISTS walks (id INTEGER PRIMARY KEY, user_id TEXT NOT NULL, day TEXT NOT NULL, ts TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS idx_walks_user_day ON walks(user_id, day);
+CREATE TABLE IF NOT EXISTS teams (name TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS routes (id INTEGER PRIMARY KEY, user_id TEXT NOT NULL, name TEXT NOT NULL, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS idx_routes_user ON routes(user_id, name);
+CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, sender TEXT NOT NULL, recipient TEXT NOT NULL, text TEXT NOT NULL, ts TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS idx_messages_pair ON messages(sender, recipient, ts);
+CREATE TABLE IF NOT EXISTS photos (id INTEGER PRIMARY KEY, user_id TEXT NOT NULL, ts TEXT NOT NULL, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS battles (id TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS custom_challenges (id TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS buddies (a TEXT NOT NULL, b TEXT NOT NULL, PRIMARY KEY (a, b)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+SET_FIELDS = ("routes_completed_month",)
+
+# Statements are kept as constants so sqlite3's per-connection statement cache reuses them.
+_UPSERT_USER = "INSERT INTO users(user_id, data) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET data=excluded.data"
+_UPSERT_DAY = ("INSERT INTO activity(user_id, day, team, minutes, steps, miles, calories) VALUES (?, ?, ?, ?, ?, ?, ?) "
+               "ON CONFLICT(user_id, day) DO UPDATE SET team=excluded.team, minutes=excluded.minutes, "
+               "steps=excluded.steps, miles=excluded.miles, calories=excluded.calories")
+_SET_META = "INSERT INTO meta(key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value"
+_INSERT_WALK = "INSERT INTO walks(user_id, day, ts) VALUES (?, ?, ?)"
+_UPSERT_TEAM = "INSERT INTO teams(name, data) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET data=excluded.data"
+_INSERT_ROUTE = "INSERT INTO routes(user_id, name, data) VALUES (?, ?, ?)"
+_DELETE_ROUTE = "DELETE FROM routes WHERE user_id = ? AND name = ?"
+_INSERT_MESSAGE = "INSERT INTO messages(sender, recipient, text, ts) VALUES (?, ?, ?, ?)"
+_INSERT_PHOTO = "INSERT INTO photos(user_id, ts, data) VALUES (?, ?, ?)"
+_UPSERT_BATTLE = "INSERT INTO battles(id, data) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET data=excluded.data"
+_UPSERT_CHALLENGE = "INSERT INTO custom_challenges(id, data) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET data=excluded.data"
+_INSERT_BUDDY = "INSERT OR IGNORE INTO buddies(a, b) VALUES (?, ?)"
+
+
+class StoreInUse(RuntimeError):
+    """The database or journal is held open by another live process."""
+
+_HELD: Dict[str, List[int]] = {}   # lock file -> [fd, opens in this process]
+_HELD_LOCK = threading.Lock()
+
+def _hold(target: str)->str:
+    path = os.path.abspath(target) + ".lock"
+    with _HELD_LOCK:
+        held = _HELD.get(path)
+        if held is None:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None: fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else: msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            except OSError:
+                os.close(fd); raise StoreInUse(f"{target} is in use by another process (lock file {path})") from None
+            held = _HELD[path] = [fd, 0]
+        held[1] += 1
+    return path
+
+def _release(path: str):
+    with _HELD_LOCK:
+        held = _HELD.get(path)
+        if held is None: return
+        held[1] -= 1
+        if not held[1]: del _HELD[path]; os.close(held[0])   # closing the descriptor drops the lock
+
+def _dumps(obj)->str:
+    return json.dumps(obj, separators=(",", ":"), default=lambda o: sorted(o) if isinstance(o, (set, frozenset)) else str(o))
+
+def empty_state()->Dict[str,Any]:
+    return {"users": {}, "teams": {}, "routes": [], "messages": [], "photos": [], "team_battles": [],
+            "custom_challenges": [], "user_challenges": {}, "badges": {}, "buddies": []}
+
+
+class Store:
+    def __init__(self, path: str, pool_size: int = 4, journal: Optional[Journal] = None):
+        self.path = path; self.journal = journal
+        self._held = [_hold(path)]
+        if journal is not None:
+            try: self._held.append(_hold(journal.directory))
+            except StoreInUse: _release(self._held.pop()); raise
+        self._pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        for _ in range(max(1, pool_size)):
+            self._pool.put(self._connect())
+        self._lock = threading.RLock()   # the dirty sets and queued ops
+        self._gate = SharedLock()          # shared by state changes in progress, exclusive for a flush
+        self._dirty_users: set = set(); self._dirty_days: set = set(); self._dirty_teams: set = set()
+        self._dirty_battles: Dict[str, Dict[str,Any]] = {}; self._dirty_challenges: Dict[str, Dict[str,Any]] = {}
+        self._ops: List[Tuple[str, tuple]] = []
+        self.version = 0   # bumped on every recorded change; derived views compare against it
+        with self.connection() as con:
+            con.executescript(SCHEMA)
+        self.state = self.load()
+        if journal is not None:
+            # the database is the snapshot; re-apply whatever was journaled after its last flush
+            with self.connection() as con:
+                row = con.execute("SELECT value FROM meta WHERE key='journal_seq'").fetchone()
+            self.snapshot_seq = int(row[0]) if row else 0
+            journal.advance(self.snapshot_seq)
+            if replay(self, journal.events(self.snapshot_seq)): self.flush()
+
+    def _connect(self)->sqlite3.Connection:
+        con = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, cached_statements=64)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute("PRAGMA busy_timeout=5000")
+        return con
+
+    @contextmanager
+    def connection(self)->Iterator[sqlite3.Connection]:
+        con = self._pool.get()
+        try: yield con
+        finally: self._pool.put(con)
+
+    def close(self):
+        self.flush()
+        if self.journal is not None: self.journal.close()
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
+        while self._held: _release(self._held.pop())
+
+    # ---------- load ----------
+    def load(self)->Dict[str,Any]:
+        state = empty_state()
+        users, badges, user_challenges = state["users"], state["badges"], state["user_challenges"]
+        legacy: List[Tuple[str, str]] = []
+        with self.connection() as con:
+            for uid, data in con.execute("SELECT user_id, data FROM users"):
+                row = json.loads(data)
+                u = row["user"]
+                for f in SET_FIELDS:
+                    if u.get(f): u[f] = set(u[f])
+                    else: u.pop(f, None)   # left unallocated until first use
+                if not u.get("mood_log"): u.pop("mood_log", None)
+                if u.get("buddies"):   # rows written before the buddies table existed
+                    legacy.extend((uid, b) for b in u["buddies"]); self._dirty_users.add(uid)
+                u.pop("buddies", None)
+                u["privacy"] = PrivacySettings.from_dict(u.get("privacy"))   # rows store overrides only; older rows the full dict
+                users[uid] = UserRecord.from_dict(u)
+                if row.get("badges"): badges[uid] = set(row["badges"])
+                if row.get("challenges"): user_challenges[uid] = row["challenges"]
+            for uid, day, minutes, steps, miles, calories in con.execute(
+                    "SELECT user_id, day, minutes, steps, miles, calories FROM activity"):
+                u = users.get(uid)
+                if u is None: continue
+                u.activity.add(day, minutes, steps, miles, calories)
+            for uid, day in con.execute("SELECT user_id, day FROM walks ORDER BY id"):
+                u = users.get(uid)
+                if u is None: continue
+                o = day_ordinal(day); u.walk_dates.append(o); u.activity.add(o, walks=1)
+            for u in users.values():
+                u.activity.recompute_totals(); u.streak = StreakState.rebuild(u.walk_dates)
+            for name, data in con.execute("SELECT name, data FROM teams"):
+                t = json.loads(data); t["members"] = set(t.get("members", [])); state["teams"][name] = t
+            state["routes"] = [json.loads(d) for (d,) in con.execute("SELECT data FROM routes ORDER BY id")]
+            state["messages"] = [{"from": s, "to": r, "text": t, "ts": ts} for s, r, t, ts in
+                                 con.execute("SELECT sender, recipient, text, ts FROM messages ORDER BY id")]
+            state["photos"] = [json.loads(d) for (d,) in con.execute("SELECT data FROM photos ORDER BY id")]
+            state["team_battles"] = [json.loads(d) for (d,) in con.execute("SELECT data FROM battles ORDER BY rowid")]
+            state["custom_challenges"] = [json.loads(d) for (d,) in con.execute("SELECT data FROM custom_challenges ORDER BY rowid")]
+            state["buddies"] = con.execute("SELECT a, b FROM buddies").fetchall() + legacy
+        if legacy: self.add_buddies(legacy)
+        return state
+
+    # ---------- write-behind ----------
+    def touch_user(self, uid: str):
+        with self._lock: self._dirty_users.add(uid); self.version += 1
+
+    def touch_day(self, uid: str, day: str):
+        with self._lock: self._dirty_users.add(uid); self._dirty_days.add((uid, day)); self.version += 1
+
+    def touch_team(self, name: str):
+        with self._lock: self._dirty_teams.add(name); self.version += 1
+
+    def touch_battle(self, battle: Dict[str,Any]):
+        with self._lock: self._dirty_battles[battle["id"]] = battle; self.version += 1
+
+    def touch_challenge(self, ch: Dict[str,Any]):
+        with self._lock: self._dirty_challenges[ch["id"]] = ch; self.version += 1
+
+    def writing(self):
+        """Context for an in-memory state change: flushes wait until it is complete. Nests freely."""
+        return self._gate.shared()
+
+    def quiesced(self):
+        """Context in which no state change is in progress or starts, e.g. to rebuild derived indexes.
+
+        Like ``flush``, it must not be entered from inside a ``writing`` block."""
+        return self._gate.exclusive()
+
+    @contextmanager
+    def journaled(self, kind: str, **data)->Iterator[Dict[str, Any]]:
+        """Run a state change and journal it as one step: no flush can fall between the two.
+
+        The block may add to the yielded event data (e.g. points computed inside it); nothing is
+        journaled if it raises. Callers serialize changes to the same records themselves (the
+        engine's per-user locks), which also keeps their events in order.
+        """
+        with self._gate.shared():
+            yield data
+            if self.journal is not None: self.journal.append(kind, data)
+
+    def bump(self):
+        """Record an in-memory change that has nothing to persist yet (e.g. unsaved settings)."""
+        with self._lock: self.version += 1
+
+    def add_walk(self, uid: str, ts: datetime):
+        self._queue(_INSERT_WALK, (uid, ts.date().isoformat(), ts.isoformat(timespec="seconds")))
+
+    def add_walks(self, walks: Iterable[Tuple[str, datetime]]):
+        """Queue many (uid, ts) walks under one lock acquisition."""
+        rows = [(_INSERT_WALK, (uid, ts.date().isoformat(), ts.isoformat(timespec="seconds"))) for uid, ts in walks]
+        with self._lock: self._ops.extend(rows); self.version += 1
+
+    def touch_days(self, days: Iterable[Tuple[str, str]]):
+        with self._lock:
+            for uid, day in days: self._dirty_users.add(uid); self._dirty_days.add((uid, day))
+            self.version += 1
+
+    def add_route(self, route: Dict[str,Any]):
+        self._queue(_INSERT_ROUTE, (route["user_id"], route["name"], _dumps(route)))
+
+    def delete_route(self, uid: str, name: str):
+        self._queue(_DELETE_ROUTE, (uid, name))
+
+    def add_message(self, msg: Dict[str,Any]):
+        self._queue(_INSERT_MESSAGE, (msg["from"], msg["to"], msg["text"], msg["ts"]))
+
+    def add_photo(self, photo: Dict[str,Any]):
+        self._queue(_INSERT_PHOTO, (photo["user_id"], photo["ts"], _dumps(photo)))
+
+    def add_buddies(self, pairs: List[Tuple[str, str]]):
+        with self._lock: self._ops.extend((_INSERT_BUDDY, (min(a, b), max(a, b))) for a, b in pairs); self.version += 1
+
+    def _queue(self, sql: str, params: tuple):
+        with self._lock: self._ops.append((sql, params)); self.version += 1
+
+    def _user_row(self, uid: str)->str:
+        u = self.state["users"][uid]
+        row = {"user": u.to_row()}
+        if uid in self.state["badges"]: row["badges"] = self.state["badges"][uid]
+        if uid in self.state["user_challenges"]: row["challenges"] = self.state["user_challenges"][uid]
+        return _dumps(row)
+
+    def _day_row(self, uid: str, day: str)->tuple:
+        u = self.state["users"][uid]
+        return (uid, day, u.get("team"), int(u["minutes_log"].get(day, 0)), int(u["steps_log"].get(day, 0)),
+                float(u["distance_miles_log"].get(day, 0.0)), int(u["calories_log"].get(day, 0)))
+
+    def flush(self)->int:
+        """Write everything touched since the last flush in a single transaction. Returns rows written."""
+        with self._gate.exclusive(), self._lock:
+            users = self.state["users"]; teams = self.state["teams"]
+            batches: List[Tuple[str, List[tuple]]] = []
+            batches.append((_UPSERT_USER, [(uid, self._user_row(uid)) for uid in self._dirty_users if uid in users]))
+            batches.append((_UPSERT_DAY, [self._day_row(uid, day) for uid, day in sorted(self._dirty_days) if uid in users]))
+            batches.append((_UPSERT_TEAM, [(n, _dumps(teams[n])) for n in self._dirty_teams if n in teams]))
+            batches.append((_UPSERT_BATTLE, [(bid, _dumps(b)) for bid, b in self._dirty_battles.items()]))
+            batches.append((_UPSERT_CHALLENGE, [(cid, _dumps(c)) for cid, c in self._dirty_challenges.items()]))
+            for sql, group in itertools.groupby(self._ops, key=lambda op: op[0]):
+                batches.append((sql, [params for _, params in group]))
+            batches = [(sql, rows) for sql, rows in batches if rows]
+            if not batches: return 0
+            if self.journal is not None:   # events first, then the snapshot that covers them
+                self.journal.sync(); batches.append((_SET_META, [("journal_seq", str(self.journal.seq))]))
+            with self.connection() as con:
+                con.execute("BEGIN IMMEDIATE")
+                try:
+                    for sql, rows in batches: con.executemany(sql, rows)
+                    con.execute("COMMIT")
+                except Exception:
+                    con.execute("ROLLBACK"); raise
+            self._dirty_users.clear(); self._dirty_days.clear(); self._dirty_teams.clear()
+            self._dirty_battles.clear(); self._dirty_challenges.clear(); self._ops.clear()
+            return sum(len(rows) for _, rows in batches)
+
+
+def open_store(path: str, journal_dir: Optional[str] = None)->Store:
+    d = os.path.dirname(os.path.abspath(path))
+    os.makedirs(d, exist_ok=True)
+    held = [_hold(path)]
+    try:
+        if journal_dir: held.append(_hold(journal_dir))   # before Journal opens (and may trim) the newest segment
+        return Store(path, journal=Journal(journal_dir) if journal_dir else None)
+    finally:
+        for lock in held: _release(lock)
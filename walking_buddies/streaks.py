@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Incremental walking-streak state.
+
+A StreakState remembers the run of consecutive active days that ends on the last active
+day, plus the longest run ever seen. Recording a new active day is O(1) when it extends or
+restarts the current run; a backfilled day only scans the runs it joins, never the whole
+history. Whether the streak is still alive is decided lazily against "today".
+"""
+from typing import Callable, Iterable, Optional
+
+
+class StreakState:
+    __slots__ = ("last_day", "current", "longest")
+
+    def __init__(self, last_day: Optional[int] = None, current: int = 0, longest: int = 0):
+        self.last_day = last_day   # ordinal of the latest active day
+        self.current = current     # length of the run ending on last_day
+        self.longest = longest
+
+    @classmethod
+    def rebuild(cls, ordinals: Iterable[int])->"StreakState":
+        s = cls(); run = 0; prev = None
+        for d in sorted(set(ordinals)):
+            run = run + 1 if prev is not None and d == prev + 1 else 1
+            s.longest = max(s.longest, run); prev = d
+        s.last_day = prev; s.current = run
+        return s
+
+    def record(self, day: int, is_active: Callable[[int], bool]):
+        """Mark ``day`` (an ordinal that was not active before) as active.
+
+        ``is_active`` answers for neighbouring days and is only consulted for backfills.
+        """
+        if self.last_day is None or day > self.last_day + 1:
+            self.last_day, self.current = day, 1
+        elif day == self.last_day + 1:
+            self.last_day, self.current = day, self.current + 1
+        else:
+            run_start = self.last_day - self.current + 1
+            if day >= run_start: return
+            if day == run_start - 1:
+                # joins the current run; absorb any older run it now touches
+                self.current += 1; d = day - 1
+                while is_active(d): self.current += 1; d -= 1
+            else:
+                left = 0; d = day - 1
+                while is_active(d): left += 1; d -= 1
+                right = 0; d = day + 1
+                while is_active(d): right += 1; d += 1
+                self.longest = max(self.longest, left + right + 1)
+                return
+        self.longest = max(self.longest, self.current)
+
+    def current_for(self, today: int)->int:
+        """Streak counted back from ``today``; zero unless there was activity today."""
+        return self.current if self.last_day == today else 0
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""Concurrency stress test for one engine shared by many sessions.
+
+A thread pool runs a random mix of walks, point awards, redemptions, battle payouts, team
+switches and privacy changes against a ``synth`` population, interleaved with leaderboard,
+feed and battle-score reads and a background flusher, once per thread count. Afterwards
+every user's points must equal the starting balance plus exactly what the journal says was
+gained and spent, each successful operation must have journaled exactly one event, each
+battle must have paid out at most once, and every index must agree with the user records:
+leaderboard scores and team totals, team member sets, the visibility service's teams and
+audiences, buddy-search discoverability, and each team's rollups and battle mileage against
+the sum over its members. ``tests/test_stress.py`` runs a small instance; from the shell::
+
+    python -m walking_buddies.stress --users 2000 --ops 20000 --threads 1,2,4,8
+
+Throughput is printed per thread count. CPython runs one thread's bytecode at a time, so
+the engine's locking shows up as correctness under contention, not as linear scaling; the
+run fails only on a mismatch.
+"""
+import argparse, os, shutil, sys, tempfile, threading, time
+from collections import Counter
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+import numpy as np
+from . import synth
+from .core import CHALLENGE_CATALOG, REWARD_CATALOG, Engine
+from .journal import Journal
+from .rollups import GRAINS, current_bucket
+from .storage import Store
+from .visibility import compile_policy
+
+WRITES = ("walk", "points", "redeem", "battle", "team", "privacy")
+_PRIVACY = ((("leaderboards", "public"), (True, False)), (("photos", "defaultAudience"), ("public", "friends", "team", "private")),
+            (("discoverability", "byCity"), (True, False)), (("profileVisibility",), ("public", "friends", "private")))
+READS = ("leaderboards", "position", "feed", "battles")
+
+
+def _ops(rng: np.random.Generator, users: List[str], n: int, read_share: float)->List[tuple]:
+    kinds = rng.choice(len(WRITES), n, p=[0.4, 0.15, 0.2, 0.01, 0.12, 0.12]); reads = rng.random(n) < read_share
+    who = rng.integers(len(users), size=n); arg = rng.integers(1 << 30, size=n)
+    return [(READS[a % len(READS)] if r else WRITES[k], users[u], int(a)) for k, r, u, a in zip(kinds, reads, who, arg)]
+
+def run(n_users: int, n_ops: int, threads: int, seed: int = 0, years: float = 0.25, read_share: float = 0.3)->Dict[str, Any]:
+    """One stress run on a fresh engine; returns throughput and the list of mismatches found."""
+    tmp = tempfile.mkdtemp(prefix="wb-stress-")
+    try:
+        state = synth.generate(n_users, seed, years, challenge_ids=[c["id"] for c in CHALLENGE_CATALOG])
+        store = Store(os.path.join(tmp, "stress.db"), journal=Journal(os.path.join(tmp, "events"), fsync=False))
+        engine = Engine(store, state)
+        users = list(engine.users); start = {uid: int(u.points) for uid, u in engine.users.items()}
+        battles = engine.team_battles; rewards = [r for r in REWARD_CATALOG if r["cost"]]; teams = sorted(engine.teams)
+        ops = _ops(np.random.default_rng(seed), users, n_ops, read_share)
+        redeemed = Counter(); walks = Counter(); lock = threading.Lock(); done = threading.Event()
+
+        def one(op):
+            kind, uid, a = op
+            if kind == "walk":
+                engine.award_walk(uid, 10 + a % 50, 1000 + a % 5000, (a % 40) / 10.0, 50 + a % 200, a % 5 == 0, a % 7 == 0)
+                with lock: walks[uid] += 1
+            elif kind == "points": engine.add_points(uid, 1 + a % 25)
+            elif kind == "redeem":
+                if engine.redeem(uid, rewards[a % len(rewards)]):
+                    with lock: redeemed[uid] += 1
+            elif kind == "battle":
+                if battles: engine.award_battle_points(battles[a % len(battles)])
+            elif kind == "team":
+                if teams: engine.join_team(uid, teams[a % len(teams)])
+            elif kind == "privacy":
+                path, values = _PRIVACY[a % len(_PRIVACY)]
+                engine.set_privacy(uid, engine.users[uid].privacy.with_changes({path: values[(a >> 4) % len(values)]}))
+            elif kind == "leaderboards": engine._leaderboards_page(uid, a % 3, 25, 10)
+            elif kind == "position": engine._leaderboard_position(uid, 2)
+            elif kind == "feed": engine.feed.page(uid, 20, visible=engine.can_view_photo)
+            elif battles: engine._score_battles(battles[:50])
+
+        def flusher():
+            while not done.wait(0.05): store.flush()
+
+        bg = threading.Thread(target=flusher, daemon=True); bg.start()
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            for f in [pool.submit(one, op) for op in ops]: f.result()
+        elapsed = time.perf_counter() - t0
+        done.set(); bg.join(); store.flush()
+        problems = check(engine, start, walks, redeemed)
+        store.close(); store.journal.close()
+        return {"threads": threads, "ops": n_ops, "seconds": round(elapsed, 3), "ops_per_s": round(n_ops / elapsed), "problems": problems}
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def check(engine: Engine, start: Dict[str, int], walks: Counter, redeemed: Counter)->List[str]:
+    """Mismatches between the user records, the journal and the leaderboard index (empty when consistent)."""
+    expected = dict(start); n_walks = Counter(); n_redeems = Counter(); payouts = Counter(); problems = []
+    for ev in engine.store.journal.events():
+        d = ev.data
+        if ev.kind == "walk": expected[d["uid"]] += d["gained"]; n_walks[d["uid"]] += 1
+        elif ev.kind == "points": expected[d["uid"]] += d["delta"]
+        elif ev.kind == "redeem": expected[d["uid"]] -= d["cost"]; n_redeems[d["uid"]] += 1
+        elif ev.kind == "challenge" and d["action"] == "complete": expected[d["uid"]] += d["reward"]
+        elif ev.kind == "battle": payouts[d["id"]] += 1
+    boards = engine.leaderboards; team_totals = Counter()
+    for uid, u in engine.users.items():
+        pts = int(u.points)
+        if pts != expected[uid]: problems.append(f"{uid}: {pts} points, journal says {expected[uid]}")
+        if pts < 0: problems.append(f"{uid}: overdrawn to {pts}")
+        if boards.users.score(uid) != pts: problems.append(f"{uid}: board has {boards.users.score(uid)}, record {pts}")
+        if u.team: team_totals[u.team] += pts
+    problems += [f"{uid}: {walks[uid]} walks, {n_walks[uid]} journaled" for uid in set(walks) | set(n_walks) if walks[uid] != n_walks[uid]]
+    problems += [f"{uid}: {redeemed[uid]} redemptions, {n_redeems[uid]} journaled" for uid in set(redeemed) | set(n_redeems) if redeemed[uid] != n_redeems[uid]]
+    problems += [f"battle {b}: paid {n} times" for b, n in payouts.items() if n > 1]
+    problems += [f"team {t}: board {boards.teams.score(t)}, members {n}" for t, n in team_totals.items() if boards.teams.score(t) != n]
+    return problems + check_indexes(engine)
+
+def check_indexes(engine: Engine, today: Optional[date] = None)->List[str]:
+    """Mismatches between team membership, visibility, discoverability and group rollups and the user records."""
+    today = today or date.today(); problems = []; vis = engine.visibility; rollups = engine.rollups
+    members: Dict[str, set] = {}
+    for uid, u in engine.users.items():
+        if u.team: members.setdefault(u.team, set()).add(uid)
+        if (vis.team_of.get(uid) or None) != (u.team or None): problems.append(f"{uid}: visibility team {vis.team_of.get(uid)}, record {u.team}")
+        if vis.policy.get(uid) != compile_policy(u.privacy): problems.append(f"{uid}: stale visibility policy")
+        if (uid in engine.directory.discoverable) != bool(u.privacy.lookup("discoverability", "byCity")):
+            problems.append(f"{uid}: directory discoverability out of date")
+    for name, team in engine.teams.items():
+        mine = members.get(name, set())
+        if set(team["members"]) != mine: problems.append(f"team {name}: members {sorted(team['members'])[:5]}..., records say {sorted(mine)[:5]}...")
+        if set(vis.team_members.get(name, ())) != mine: problems.append(f"team {name}: visibility members differ")
+        for g in GRAINS:
+            got = rollups.period_total("team", name, "steps", g, today) or 0.0
+            want = sum(rollups.period_total("user", uid, "steps", g, today) or 0.0 for uid in mine)
+            if abs(got - want) > 1e-6: problems.append(f"team {name}: {g} steps {got}, members {want} (bucket {current_bucket(g, today)})")
+        start = today - timedelta(days=30)
+        got = rollups.team_miles.miles(name, start, today)
+        want = sum(engine.users[uid].activity.sum("miles", start, today) for uid in mine)
+        if abs(got - want) > 1e-6: problems.append(f"team {name}: 30-day miles {got:.3f}, members {want:.3f}")
+    return problems
+
+def main(argv: Optional[List[str]] = None)->int:
+    ap = argparse.ArgumentParser(description="Hammer one shared engine from a thread pool and check that point totals stay exact.")
+    ap.add_argument("--users", type=int, default=2000); ap.add_argument("--ops", type=int, default=20000)
+    ap.add_argument("--threads", default="1,2,4,8", help="comma-separated pool sizes, one fresh run each")
+    ap.add_argument("--seed", type=int, default=0); ap.add_argument("--years", type=float, default=0.25)
+    ap.add_argument("--read-share", type=float, default=0.3, help="fraction of operations that are reads")
+    args = ap.parse_args(argv)
+    print(f"{'threads':>8} {'ops':>8} {'seconds':>9} {'ops/s':>9}  result")
+    failed = False
+    for n in (int(s) for s in args.threads.split(",") if s):
+        res = run(args.users, args.ops, n, args.seed, args.years, args.read_share)
+        bad = res["problems"]; failed = failed or bool(bad)
+        print(f"{n:>8} {res['ops']:>8} {res['seconds']:>9} {res['ops_per_s']:>9}  {'ok' if not bad else f'{len(bad)} mismatch(es)'}")
+        for line in bad[:20]: print(f"    {line}", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Seeded synthetic populations for benchmarks and load tests.
+
+``generate`` builds the shared state the app loads from the store: slotted UserRecords
+with activity logs, walk days and streaks, teams with captains and roles, buddy edges,
+messages, photos, battles, challenge memberships and badges. The same seed gives the same
+population. Users join at a random point in the history window and walk on a per-user share
+of days, so logs are as ragged as real ones. Memory is dominated by the logs, about 15 KB
+per user-year of history loaded in the app. ``save`` writes a population into a SQLite store::
+
+    python -m walking_buddies.synth --users 10000 --years 2 --db /tmp/wb-10k.db
+"""
+import argparse
+from array import array
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, Optional
+import numpy as np
+from .privacy import DEFAULT_PRIVACY
+from .storage import empty_state, open_store
+from .streaks import StreakState
+from .users import UserRecord
+
+FIRST = ("Alex", "Martha", "Sam", "Priya", "Jordan", "Lee", "Maria", "Chen", "Fatima", "Noah", "Ava", "Diego", "Yuki", "Omar", "Grace", "Ivan")
+LAST = ("Smith", "Garcia", "Nguyen", "Okafor", "Kim", "Novak", "Silva", "Cohen", "Patel", "Jones", "Rossi", "Berg")
+CITIES = ("Atlanta", "Austin", "Boston", "Chicago", "Denver", "Seattle", "Portland", "Miami", "New York", "San Diego", "Toronto", "London")
+COMPANIES = ("Acme", "Globex", "Initech", "Umbrella", "Hooli", "Stark", "Wayne", "Tyrell", "")
+TIMES = ("Mornings", "Lunch", "Evenings", "Weekends")
+TEXTS = ("Walk at 7?", "Great pace today!", "Same route tomorrow?", "Running late, start without me", "Nice photo!")
+# privacy variants users switch to (copy-on-write settings, shared between the users that chose the same one)
+PRIVACY = (DEFAULT_PRIVACY,
+           DEFAULT_PRIVACY.with_changes({("leaderboards", "public"): True, ("profileVisibility",): "public"}),
+           DEFAULT_PRIVACY.with_changes({("profileVisibility",): "friends", ("photos", "defaultAudience"): "public"}),
+           DEFAULT_PRIVACY.with_changes({("messaging", "allowRequests"): "anyone", ("discoverability", "byCompany"): True}),
+           DEFAULT_PRIVACY.with_changes({("discoverability", "byCity"): False, ("messaging", "allowRequests"): "friends_only"}))
+_PRIVACY_P = (0.6, 0.15, 0.1, 0.1, 0.05)
+
+
+def _streak(days: np.ndarray)->StreakState:
+    """StreakState.rebuild for sorted distinct day ordinals, in array passes."""
+    if not len(days): return StreakState()
+    starts = np.flatnonzero(np.diff(days) != 1) + 1
+    bounds = np.concatenate([[0], starts, [len(days)]])
+    runs = np.diff(bounds)
+    return StreakState(int(days[-1]), int(runs[-1]), int(runs.max()))
+
+def _iso(ts: np.ndarray)->list:
+    return [datetime.fromtimestamp(t).isoformat(timespec="seconds") for t in ts.tolist()]
+
+def generate(n_users: int, seed: int = 0, years: float = 2.0, today: Optional[date] = None, team_size: int = 12,
+             team_share: float = 0.7, buddies_per_user: int = 8, messages_per_user: float = 2.0, photos_per_user: float = 1.0,
+             battles: Optional[int] = None, challenge_ids: Iterable[str] = ())->Dict[str, Any]:
+    """A population of ``n_users`` shaped like ``Store.load``'s state; deterministic for a given seed and ``today``."""
+    rng = np.random.default_rng(seed); today = today or date.today(); end = today.toordinal()
+    span = max(1, int(round(365 * years)))
+    state = empty_state(); users = state["users"]; teams = state["teams"]
+    uids = [f"user{i:07d}" for i in range(n_users)]
+
+    # ---------- profiles and teams ----------
+    n_teams = max(2, n_users // team_size)
+    team_of = np.where(rng.random(n_users) < team_share, rng.integers(0, n_teams, n_users), -1)
+    team_city = rng.integers(0, len(CITIES), n_teams); team_company = rng.integers(0, len(COMPANIES), n_teams)
+    city = np.where(team_of >= 0, team_city[team_of], rng.integers(0, len(CITIES), n_users))
+    company = np.where(team_of >= 0, team_company[team_of], rng.integers(0, len(COMPANIES), n_users))
+    first = rng.integers(0, len(FIRST), n_users); last = rng.integers(0, len(LAST), n_users)
+    times = rng.integers(0, len(TIMES), n_users); privacy = rng.choice(len(PRIVACY), n_users, p=_PRIVACY_P)
+
+    # ---------- activity ----------
+    joined = end - rng.integers(0, span, n_users)    # first day of each user's history
+    activity = rng.beta(2.0, 3.0, n_users)           # share of days walked
+    ch_ids = list(challenge_ids)
+    for i, uid in enumerate(uids):
+        u = users[uid] = UserRecord(f"{FIRST[first[i]]} {LAST[last[i]]}", city=CITIES[city[i]], company=COMPANIES[company[i]],
+                                    available_times=TIMES[times[i]])
+        u.privacy = PRIVACY[privacy[i]]
+        days = np.arange(joined[i], end + 1)
+        days = days[rng.random(len(days)) < activity[i]]
+        if len(days):
+            walks = 1 + (rng.random(len(days)) < 0.15)   # some days have a second walk
+            minutes = rng.gamma(4.0, 8.0, len(days)).astype(np.int64) + 5
+            steps = minutes * rng.integers(90, 130, len(days)); miles = np.round(steps / 2100.0, 2)
+            u.activity.add_many(days, minutes, steps, miles, minutes * 4, walks)
+            u.walk_dates = array("l", np.repeat(days, walks).tolist()); u.streak = _streak(days)
+            u.points = int(minutes.sum()) + 10 * int(len(days) // 7)
+            u.avatar_level = 1 + int(u.activity.totals["miles"] >= 50) + int(u.activity.totals["miles"] >= 150)
+        if len(u.walk_dates) >= 10:
+            state["badges"][uid] = {"badge_10_walks"} | ({"badge_100_miles"} if u.activity.totals["miles"] >= 100 else set())
+        if ch_ids and rng.random() < 0.3:
+            state["user_challenges"][uid] = {c: {"joined": True, "completed": False, "last_reset": None}
+                                             for c in rng.choice(ch_ids, min(len(ch_ids), 1 + int(rng.integers(0, 3))), replace=False).tolist()}
+    for i in np.flatnonzero(team_of >= 0).tolist():
+        name = f"Team {int(team_of[i]):05d}"; uid = uids[i]; users[uid].team = name
+        team = teams.get(name)
+        if team is None:
+            t = int(team_of[i])
+            team = teams[name] = {"captain": uid, "members": set(), "roles": {uid: "Captain"}, "city": CITIES[team_city[t]], "company": COMPANIES[team_company[t]]}
+        else:
+            team["roles"][uid] = "Co-Captain" if len(team["roles"]) == 1 else "Player"
+        team["members"].add(uid)
+
+    # ---------- buddies: half within the user's team or city, half anywhere ----------
+    k = min(buddies_per_user // 2, max(0, n_users - 1))
+    if n_users > 1 and k:
+        a = np.repeat(np.arange(n_users), k)
+        b = rng.integers(0, n_users, len(a))
+        order = np.argsort(city, kind="stable"); pos = np.empty(n_users, dtype=np.int64); pos[order] = np.arange(n_users)
+        local = order[np.clip(pos[a] + rng.integers(-50, 51, len(a)), 0, n_users - 1)]   # neighbours in city order
+        a = np.concatenate([a, a]); b = np.concatenate([b, local])
+        lo, hi = np.minimum(a, b), np.maximum(a, b); keep = lo != hi
+        pairs = np.unique(np.stack([lo[keep], hi[keep]], axis=1), axis=0)
+        state["buddies"] = [(uids[x], uids[y]) for x, y in pairs.tolist()]
+
+    # ---------- messages between buddies, photos, battles ----------
+    now = datetime.combine(today, datetime.min.time()).timestamp() + 12 * 3600
+    edges = state["buddies"]
+    n_msg = int(n_users * messages_per_user) if edges else 0
+    if n_msg:
+        pick = rng.integers(0, len(edges), n_msg); flip = rng.random(n_msg) < 0.5
+        ts = np.sort(now - rng.random(n_msg) * 30 * 86400)
+        text = rng.integers(0, len(TEXTS), n_msg)
+        state["messages"] = [{"from": edges[p][f], "to": edges[p][1 - f], "text": TEXTS[t], "ts": s}
+                             for p, f, t, s in zip(pick.tolist(), flip.astype(int).tolist(), text.tolist(), _iso(ts))]
+    n_ph = int(n_users * photos_per_user)
+    if n_ph:
+        owner = rng.integers(0, n_users, n_ph); ts = np.sort(now - rng.random(n_ph) * 60 * 86400)
+        miles = np.round(rng.gamma(2.0, 1.0, n_ph), 2)
+        state["photos"] = [{"user_id": uids[o], "miles": m, "notes": "Shared a scenic photo", "ts": s,
+                            "audience": users[uids[o]].privacy.lookup("photos", "defaultAudience")}
+                           for o, m, s in zip(owner.tolist(), miles.tolist(), _iso(ts))]
+    names = sorted(teams)
+    n_bat = min(len(names) // 2, battles if battles is not None else max(1, len(names) // 20))
+    for j in range(n_bat):
+        home, away = rng.choice(len(names), 2, replace=False).tolist()
+        start = today - timedelta(days=int(rng.integers(0, 60))); stop = start + timedelta(days=int(rng.integers(3, 15)))
+        state["team_battles"].append({"id": f"battle_{j:05d}", "name": f"Battle {j}", "home": names[home], "away": names[away],
+                                      "start": start.isoformat(), "end": stop.isoformat(), "reward_points": 200, "winner_awarded": False})
+    return state
+
+
+def save(state: Dict[str, Any], path: str)->int:
+    """Write a generated population into the SQLite store at ``path`` (which should be new). Returns rows written."""
+    store = open_store(path)
+    store.state = state
+    for uid, u in state["users"].items():
+        store.touch_user(uid)
+        store.touch_days((uid, date.fromordinal(int(d)).isoformat()) for d in u.activity.ordinals())
+        store.add_walks((uid, datetime.fromordinal(d) + timedelta(hours=8)) for d in u.walk_dates)
+    for name in state["teams"]: store.touch_team(name)
+    for b in state["team_battles"]: store.touch_battle(b)
+    for m in state["messages"]: store.add_message(m)
+    for p in state["photos"]: store.add_photo(p)
+    store.add_buddies(state["buddies"])
+    rows = store.flush(); store.close()
+    return rows
+
+
+def main(argv=None)->int:
+    ap = argparse.ArgumentParser(description="Generate a seeded synthetic Walking Buddies population into a SQLite store.")
+    ap.add_argument("--users", type=int, default=1000); ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--years", type=float, default=2.0); ap.add_argument("--db", required=True)
+    args = ap.parse_args(argv)
+    state = generate(args.users, args.seed, args.years)
+    print(f"{len(state['users'])} users, {len(state['teams'])} teams, {len(state['buddies'])} buddy pairs, "
+          f"{len(state['messages'])} messages, {len(state['photos'])} photos; {save(state, args.db)} rows written to {args.db}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Per-team daily mileage with cumulative sums for constant-time range queries.
+
+Rows are teams and columns are days from a shared origin ordinal. Writes touch one cell
+(a walk) or one row slice (a member joining or leaving). Cumulative sums are refreshed
+lazily for the rows that changed, after which any team/date-range total is two lookups
+and a whole list of battles is scored in one vectorized expression. Writes and refreshes
+serialize on a sequence lock; range queries read without locking and retry if one overlapped.
+"""
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+import numpy as np
+from .concurrency import SeqLock
+from .timeseries import ActivityLog, Day, day_ordinal
+
+
+class TeamMileageIndex:
+    def __init__(self, origin: int, days: int = 366, teams: int = 8):
+        self.origin = origin
+        self.rows: Dict[str, int] = {}
+        self.daily = np.zeros((teams, days))
+        self.cum = np.zeros((teams, days + 1))   # cum[r, i] = miles of row r over the first i days
+        self._stale: set = set()
+        self.seq = SeqLock()
+
+    @classmethod
+    def build(cls, teams: Dict[str, dict], users: Dict[str, dict], today: Optional[Day] = None)->"TeamMileageIndex":
+        logs = [(name, users[uid]["activity"]) for name, info in teams.items() for uid in info.get("members", ()) if uid in users]
+        starts = [log.origin for _, log in logs if log.origin is not None]
+        origin = min(starts) if starts else day_ordinal(today) if today is not None else 0
+        idx = cls(origin)
+        for name in teams: idx._row(name)
+        for name, log in logs: idx.add_member(name, log)
+        return idx
+
+    def _grow(self, teams: int, pad: int, days: int):
+        daily = np.zeros((teams, days)); n, m = self.daily.shape
+        daily[:n, pad:pad + m] = self.daily
+        self.daily = daily; self.cum = np.zeros((teams, days + 1))
+        self._stale = set(self.rows.values())
+
+    def _row(self, team: str)->int:
+        r = self.rows.get(team)
+        if r is None:
+            r = self.rows[team] = len(self.rows)
+            if r >= self.daily.shape[0]: self._grow(2 * self.daily.shape[0], 0, self.daily.shape[1])
+        return r
+
+    def _col(self, ordinal: int)->int:
+        if ordinal < self.origin:
+            pad = self.origin - ordinal
+            self._grow(self.daily.shape[0], pad, max(self.daily.shape[1] + pad, 2 * self.daily.shape[1]))
+            self.origin = ordinal
+        c = ordinal - self.origin
+        if c >= self.daily.shape[1]: self._grow(self.daily.shape[0], 0, max(c + 1, 2 * self.daily.shape[1]))
+        return c
+
+    def add(self, team: str, day: Day, miles: float):
+        with self.seq.write():
+            r = self._row(team); c = self._col(day_ordinal(day))
+            self.daily[r, c] += float(miles); self._stale.add(r)
+
+    def add_many(self, team: str, ordinals: np.ndarray, miles: np.ndarray):
+        """Vectorized ``add`` of one team's miles per day; repeated ordinals accumulate."""
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        if not len(ordinals): return
+        with self.seq.write():
+            r = self._row(team); self._col(int(ordinals.max())); self._col(int(ordinals.min()))
+            np.add.at(self.daily[r], ordinals - self.origin, np.asarray(miles, dtype=float)); self._stale.add(r)
+
+    def add_member(self, team: str, log: ActivityLog, sign: int = 1):
+        """Fold a member's whole mileage history into (or, with sign=-1, out of) the team row."""
+        if log.origin is None: return
+        with self.seq.write():
+            r = self._row(team)
+            self._col(log.origin + log.size - 1); c = self._col(log.origin)
+            self.daily[r, c:c + log.size] += sign * log.cols["miles"][:log.size]
+            self._stale.add(r)
+
+    def remove_member(self, team: str, log: ActivityLog):
+        self.add_member(team, log, -1)
+
+    def _refresh(self):
+        if not self._stale: return
+        with self.seq.write():
+            rows = sorted(self._stale)
+            self.cum[rows, 1:] = np.cumsum(self.daily[rows], axis=1)
+            self._stale.clear()
+
+    def _bounds(self, starts: np.ndarray, ends: np.ndarray)->Tuple[np.ndarray, np.ndarray]:
+        n = self.daily.shape[1]
+        return np.clip(starts - self.origin, 0, n), np.clip(ends - self.origin + 1, 0, n)
+
+    def miles(self, team: str, start: Day, end: Day)->float:
+        """Team miles over the inclusive day range [start, end]."""
+        r = self.rows.get(team)
+        if r is None: return 0.0
+        def total()->float:
+            s, e = self._bounds(np.int64(day_ordinal(start)), np.int64(day_ordinal(end)))
+            return float(self.cum[r, e] - self.cum[r, s]) if e > s else 0.0
+        return self.seq.read(total, prepare=self._refresh)
+
+    def miles_many(self, teams: Sequence[str], starts: Iterable[Day], ends: Iterable[Day])->np.ndarray:
+        """Vectorized ``miles`` for parallel sequences of teams and inclusive ranges."""
+        starts = np.array([day_ordinal(d) for d in starts], dtype=np.int64); ends = np.array([day_ordinal(d) for d in ends], dtype=np.int64)
+        def totals()->np.ndarray:
+            rows = np.array([self.rows.get(t, -1) for t in teams], dtype=np.int64)
+            s, e = self._bounds(starts, ends)
+            safe = np.maximum(rows, 0)
+            out = self.cum[safe, e] - self.cum[safe, s]
+            out[(rows < 0) | (e <= s)] = 0.0
+            return out
+        return self.seq.read(totals, prepare=self._refresh)
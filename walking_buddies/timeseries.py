@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Columnar per-user activity logs indexed by day ordinal.
+
+Each user keeps one ActivityLog: a NumPy array per metric covering the days between
+their first and last recorded activity. Period totals are slice reductions and many
+users can be summed in a single vectorized pass with ``sum_many``. Lifetime totals are
+kept as running sums updated on every write.
+"""
+import math
+from collections.abc import MutableMapping
+from datetime import date
+from typing import Dict, Iterable, Iterator, Sequence, Union
+import numpy as np
+
+DTYPES = {"minutes": np.int32, "steps": np.int32, "miles": np.float64, "calories": np.int32, "walks": np.int32}
+METRICS = tuple(DTYPES)
+LOG_FIELDS = {"minutes_log": "minutes", "steps_log": "steps", "distance_miles_log": "miles", "calories_log": "calories"}
+
+Day = Union[date, str, int]
+
+def day_ordinal(day: Day)->int:
+    if isinstance(day, int): return day
+    if isinstance(day, str): return date.fromisoformat(day).toordinal()
+    return day.toordinal()
+
+def _frozen_empty(dtype)->np.ndarray:
+    a = np.zeros(0, dtype=dtype); a.flags.writeable = False
+    return a
+
+# Shared by every log that has no data yet; the first write reallocates, so they are never written to
+_EMPTY_PRESENT = _frozen_empty(bool)
+_EMPTY_COLS = {m: _frozen_empty(dt) for m, dt in DTYPES.items()}
+
+def _scalar(metric: str, v):
+    return float(v) if metric == "miles" else int(v)
+
+
+class ActivityLog:
+    __slots__ = ("origin", "size", "present", "cols", "totals")
+
+    def __init__(self):
+        self.origin = None   # day ordinal stored at index 0
+        self.size = 0        # number of days in use, starting at origin
+        self.present = _EMPTY_PRESENT
+        self.cols: Dict[str, np.ndarray] = dict(_EMPTY_COLS)
+        self.totals: Dict[str, float] = {m: _scalar(m, 0) for m in METRICS}  # lifetime running sums
+
+    def _realloc(self, pad: int, capacity: int):
+        def grow(a):
+            b = np.zeros(capacity, dtype=a.dtype); b[pad:pad + self.size] = a[:self.size]; return b
+        self.present = grow(self.present)
+        self.cols = {m: grow(a) for m, a in self.cols.items()}
+
+    def _slot(self, ordinal: int)->int:
+        if self.origin is None: self.origin = ordinal
+        if ordinal < self.origin:  # backfill before the first recorded day
+            pad = self.origin - ordinal
+            self._realloc(pad, max(self.size + pad, 2 * len(self.present)))
+            self.origin = ordinal; self.size += pad
+        i = ordinal - self.origin
+        if i >= len(self.present):
+            self._realloc(0, max(i + 1, 2 * len(self.present), 32))
+        if i >= self.size: self.size = i + 1
+        return i
+
+    def _index(self, day: Day):
+        if self.origin is None: return None
+        i = day_ordinal(day) - self.origin
+        return i if 0 <= i < self.size else None
+
+    def add(self, day: Day, minutes: int = 0, steps: int = 0, miles: float = 0.0, calories: int = 0, walks: int = 0):
+        i = self._slot(day_ordinal(day))
+        self.present[i] = True
+        c, t = self.cols, self.totals
+        c["minutes"][i] += int(minutes); c["steps"][i] += int(steps)
+        c["miles"][i] += float(miles); c["calories"][i] += int(calories); c["walks"][i] += int(walks)
+        t["minutes"] += int(minutes); t["steps"] += int(steps); t["miles"] += float(miles)
+        t["calories"] += int(calories); t["walks"] += int(walks)
+
+    def add_many(self, ordinals: np.ndarray, minutes=0, steps=0, miles=0.0, calories=0, walks=0):
+        """Vectorized ``add`` for parallel arrays (or scalars) per day; repeated ordinals accumulate."""
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        if not len(ordinals): return
+        self._slot(int(ordinals.min())); self._slot(int(ordinals.max()))
+        idx = ordinals - self.origin
+        self.present[idx] = True
+        for m, v in (("minutes", minutes), ("steps", steps), ("miles", miles), ("calories", calories), ("walks", walks)):
+            v = np.broadcast_to(np.asarray(v, dtype=DTYPES[m]), idx.shape)
+            np.add.at(self.cols[m], idx, v); self.totals[m] += _scalar(m, v.sum())
+
+    def set(self, metric: str, day: Day, value):
+        i = self._slot(day_ordinal(day))
+        col = self.cols[metric]
+        self.totals[metric] += _scalar(metric, value) - _scalar(metric, col[i])
+        self.present[i] = True; col[i] = value
+
+    def total(self, metric: str):
+        return self.totals[metric]
+
+    def recompute_totals(self):
+        """Rebuild the running totals from the columns (after loading or repairing a record)."""
+        self.totals = {m: _scalar(m, a[:self.size].sum()) for m, a in self.cols.items()}
+
+    def check_totals(self)->Dict[str, tuple]:
+        """Metrics whose running total disagrees with a full recompute, as {metric: (running, recomputed)}."""
+        bad = {}
+        for m, a in self.cols.items():
+            full = _scalar(m, a[:self.size].sum())
+            if not math.isclose(self.totals[m], full, rel_tol=1e-9, abs_tol=1e-6): bad[m] = (self.totals[m], full)
+        return bad
+
+    def get(self, metric: str, day: Day, default=0):
+        i = self._index(day)
+        if i is None or not self.present[i]: return default
+        return _scalar(metric, self.cols[metric][i])
+
+    def walked(self, day: Day)->bool:
+        i = self._index(day)
+        return i is not None and self.cols["walks"][i] > 0
+
+    def has(self, day: Day)->bool:
+        i = self._index(day)
+        return i is not None and bool(self.present[i])
+
+    def sum(self, metric: str, start: Day, end: Day):
+        """Total of ``metric`` over the inclusive day range [start, end]."""
+        if self.origin is None: return _scalar(metric, 0)
+        lo = max(day_ordinal(start) - self.origin, 0); hi = min(day_ordinal(end) - self.origin + 1, self.size)
+        if hi <= lo: return _scalar(metric, 0)
+        return _scalar(metric, self.cols[metric][lo:hi].sum())
+
+    def ordinals(self)->np.ndarray:
+        return np.flatnonzero(self.present[:self.size]) + (self.origin or 0)
+
+    def view(self, metric: str)->"DayColumn":
+        return DayColumn(self, metric)
+
+
+class DayColumn(MutableMapping):
+    """Dict-compatible ``{iso_day: value}`` view of one metric, so callers written against the old logs keep working."""
+    __slots__ = ("log", "metric")
+
+    def __init__(self, log: ActivityLog, metric: str):
+        self.log = log; self.metric = metric
+
+    def __getitem__(self, day: Day):
+        v = self.log.get(self.metric, day, None)
+        if v is None: raise KeyError(day)
+        return v
+
+    def get(self, day: Day, default=None):
+        return self.log.get(self.metric, day, default)
+
+    def __setitem__(self, day: Day, value):
+        self.log.set(self.metric, day, value)
+
+    def __delitem__(self, day: Day):
+        i = self.log._index(day)
+        if i is None or not self.log.present[i]: raise KeyError(day)
+        for m, a in self.log.cols.items():
+            self.log.totals[m] -= _scalar(m, a[i]); a[i] = 0
+        self.log.present[i] = False
+
+    def __iter__(self)->Iterator[str]:
+        return (date.fromordinal(int(o)).isoformat() for o in self.log.ordinals())
+
+    def __len__(self)->int:
+        return int(self.log.present[:self.log.size].sum())
+
+    def values(self):
+        log = self.log
+        if log.origin is None: return []
+        return [_scalar(self.metric, v) for v in log.cols[self.metric][:log.size][log.present[:log.size]]]
+
+
+def activity_fields(log: ActivityLog = None)->Dict[str, object]:
+    """User-record fields for a log: the ``activity`` object plus the legacy ``*_log`` views over it."""
+    log = log if log is not None else ActivityLog()
+    fields = {"activity": log}
+    fields.update({f: log.view(m) for f, m in LOG_FIELDS.items()})
+    return fields
+
+def stack(logs: Sequence[ActivityLog], metric: str, start: Day, end: Day)->np.ndarray:
+    """(len(logs), days) matrix of ``metric`` over the inclusive range, zero where a user has no data."""
+    s, e = day_ordinal(start), day_ordinal(end)
+    out = np.zeros((len(logs), max(e - s + 1, 0)), dtype=DTYPES[metric])
+    for row, log in enumerate(logs):
+        if log.origin is None: continue
+        lo = max(s, log.origin); hi = min(e, log.origin + log.size - 1)
+        if hi < lo: continue
+        out[row, lo - s:hi - s + 1] = log.cols[metric][lo - log.origin:hi - log.origin + 1]
+    return out
+
+def sum_many(logs: Iterable[ActivityLog], metric: str, start: Day, end: Day)->np.ndarray:
+    """Per-user totals of ``metric`` over [start, end] for every log, as one array."""
+    return stack(list(logs), metric, start, end).sum(axis=1)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Compact user records.
+
+A UserRecord keeps the fields every user has in ``__slots__`` instead of a per-user dict,
+interns the strings many users share (team, city, company, walk time) and only allocates
+the rarely used containers (mood log, routes this month) on first use. The ``*_log`` day
+views are built on demand from the activity log instead of being stored. Records still
+behave as mutable mappings, so ``u["points"]`` and ``u.get("team")`` keep working; hot
+paths can read attributes (``u.points``) directly.
+"""
+import sys
+from array import array
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator
+from .privacy import DEFAULT_PRIVACY
+from .streaks import StreakState
+from .timeseries import ActivityLog, LOG_FIELDS
+
+FIELDS = ("name", "points", "team", "company", "city", "available_times", "photos_this_week", "invites_this_month",
+          "avatar_level", "privacy", "walk_dates", "streak", "activity", "routes_completed_month", "mood_log")
+_FIELD_SET = frozenset(FIELDS)
+_INTERNED = frozenset({"team", "company", "city", "available_times"})
+_LAZY = {"routes_completed_month": set, "mood_log": dict}   # None until first read through the mapping API
+_RUNTIME = frozenset({"walk_dates", "streak", "activity"})   # rebuilt from the activity and walks tables on load
+
+
+class UserRecord(MutableMapping):
+    __slots__ = FIELDS + ("extra",)
+
+    def __init__(self, name: str = "", **fields):
+        self.name = name; self.points = 0; self.team = None; self.company = ""; self.city = ""
+        self.available_times = "Mornings"; self.photos_this_week = 0; self.invites_this_month = 0; self.avatar_level = 1
+        self.privacy = DEFAULT_PRIVACY; self.walk_dates = array("l"); self.streak = StreakState(); self.activity = ActivityLog()
+        self.routes_completed_month = None; self.mood_log = None
+        self.extra = None   # keys outside the fixed schema, kept so older rows round-trip
+        for k, v in fields.items(): self[k] = v
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any])->"UserRecord":
+        rec = cls()
+        for k, v in data.items(): rec[k] = v
+        return rec
+
+    def to_row(self)->Dict[str, Any]:
+        """The persisted part of the record: scalar fields, lazy containers (without allocating them) and privacy overrides."""
+        row = {k: getattr(self, k) for k in FIELDS if k not in _RUNTIME}
+        for k, make in _LAZY.items():
+            if row[k] is None: row[k] = make()
+        row["privacy"] = getattr(self.privacy, "overrides", self.privacy)
+        if self.extra: row.update(self.extra)
+        return row
+
+    # ---------- mapping API ----------
+    def __getitem__(self, key: str):
+        if key in _FIELD_SET:
+            v = getattr(self, key)
+            if v is None and key in _LAZY:
+                v = _LAZY[key](); setattr(self, key, v)
+            return v
+        if key in LOG_FIELDS: return self.activity.view(LOG_FIELDS[key])
+        if self.extra is not None and key in self.extra: return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None):
+        if key in _FIELD_SET and key not in _LAZY: return getattr(self, key)
+        try: return self[key]
+        except KeyError: return default
+
+    def __setitem__(self, key: str, value):
+        if key in _FIELD_SET:
+            if key in _INTERNED and isinstance(value, str): value = sys.intern(value)
+            setattr(self, key, value)
+        elif key in LOG_FIELDS:
+            raise TypeError(f"{key} is a view over the activity log; write through activity.add/set")
+        else:
+            if self.extra is None: self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key: str):
+        if key in _FIELD_SET or key in LOG_FIELDS: raise TypeError(f"{key} is a fixed user field")
+        if self.extra is None or key not in self.extra: raise KeyError(key)
+        del self.extra[key]
+
+    def __contains__(self, key)->bool:
+        return key in _FIELD_SET or key in LOG_FIELDS or (self.extra is not None and key in self.extra)
+
+    def __iter__(self)->Iterator[str]:
+        yield from FIELDS
+        yield from LOG_FIELDS
+        if self.extra: yield from list(self.extra)
+
+    def __len__(self)->int:
+        return len(FIELDS) + len(LOG_FIELDS) + (len(self.extra) if self.extra else 0)
+
+    def __repr__(self)->str:
+        return f"UserRecord(name={self.name!r}, points={self.points}, team={self.team!r})"
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Compiled privacy checks: who may see an owner's profile, leaderboard entry, photos or routes.
+
+Each user's privacy settings are compiled into one audience per kind (private, friends,
+team or public), stored as a one-byte code per owner. Buddy lists are sets of owner indexes
+and team membership is a dict, so any check, whether a single one or a predicate walked over
+a page of owners, is a few constant-time lookups combined at query time. A privacy, buddy
+or team change writes only the entries of the users involved; nothing is kept per viewer, so
+nothing has to be patched or dropped. Changes are guarded by one lock; checks read without it.
+"""
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+from .privacy import DEFAULT_PRIVACY
+
+AUDIENCES = ("private", "friends", "team", "public")
+KINDS = ("profile", "leaderboard", "photos", "routes")
+PRIVATE, FRIENDS, TEAM, PUBLIC = range(len(AUDIENCES))
+_CODE = {a: i for i, a in enumerate(AUDIENCES)}
+
+def _setting(privacy, default, *path):
+    lookup = getattr(privacy, "lookup", None)   # PrivacySettings: resolve the path without building section views
+    if lookup is not None: return lookup(*path, default=default)
+    for k in path[:-1]: privacy = privacy.get(k, {})
+    return privacy.get(path[-1], default)
+
+def compile_policy(privacy: Dict[str, Any])->Dict[str, str]:
+    if privacy is DEFAULT_PRIVACY and _DEFAULT_POLICY: return _DEFAULT_POLICY
+    return {
+        "profile": _setting(privacy, "private", "profileVisibility"),
+        "leaderboard": "public" if _setting(privacy, False, "leaderboards", "public") else
+                       ("team" if _setting(privacy, True, "leaderboards", "teamVisible") else "private"),
+        "photos": _setting(privacy, "friends", "photos", "defaultAudience"),
+        "routes": _setting(privacy, "private", "routes", "defaultShare"),
+    }
+
+_DEFAULT_POLICY: Dict[str, str] = {}
+_DEFAULT_POLICY.update(compile_policy(DEFAULT_PRIVACY))   # shared by every user who never changed a setting
+
+class VisibilityService:
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.team_of: Dict[str, Optional[str]] = {}
+        self.team_members: Dict[str, Set[str]] = {}
+        self.friends: Dict[str, Set[int]] = {}   # uid -> indexes of their buddies
+        self.policy: Dict[str, Dict[str, str]] = {}
+        self.audience: Dict[str, bytearray] = {k: bytearray() for k in KINDS}   # owner index -> audience code
+        self.version = 0   # bumped whenever an effective audience, team or friendship changes
+        self._lock = threading.RLock()
+
+    # ---------- registration & changes ----------
+    def _id(self, uid: str)->int:
+        i = self.ids.get(uid)
+        if i is None:
+            with self._lock:
+                i = self.ids.get(uid)
+                if i is None:
+                    for codes in self.audience.values(): codes.append(PRIVATE)
+                    i = self.ids[uid] = len(self.ids)
+        return i
+
+    def register(self, uid: str, privacy: Dict[str, Any], team: Optional[str] = None, friends: Iterable[str] = ()):
+        with self._lock:
+            self._id(uid)
+            self.friends.setdefault(uid, set())
+            for f in friends: self.add_friendship(uid, f)
+            self.set_privacy(uid, privacy)
+            if team: self.set_team(uid, team)
+
+    def set_privacy(self, uid: str, privacy: Dict[str, Any]):
+        new = compile_policy(privacy)
+        with self._lock:
+            if new == self.policy.get(uid): return
+            i = self._id(uid)
+            for kind, audience in new.items(): self.audience[kind][i] = _CODE.get(audience, PRIVATE)
+            self.policy[uid] = new; self.version += 1
+
+    def set_team(self, uid: str, team: Optional[str]):
+        with self._lock:
+            old = self.team_of.get(uid)
+            if old == team: return
+            if old: self.team_members[old].discard(uid)
+            if team: self.team_members.setdefault(team, set()).add(uid)
+            self.team_of[uid] = team; self.version += 1
+
+    def add_friendship(self, a: str, b: str):
+        with self._lock:
+            self.friends.setdefault(a, set()).add(self._id(b)); self.friends.setdefault(b, set()).add(self._id(a))
+            self.version += 1
+
+    def remove_friendship(self, a: str, b: str):
+        with self._lock:
+            self.friends.get(a, set()).discard(self._id(b)); self.friends.get(b, set()).discard(self._id(a))
+            self.version += 1
+
+    # ---------- point checks ----------
+    def is_friend(self, a: str, b: str)->bool:
+        i = self.ids.get(b)
+        return i is not None and i in self.friends.get(a, ())
+
+    def same_team(self, a: str, b: str)->bool:
+        t = self.team_of.get(a)
+        return bool(t) and t == self.team_of.get(b)
+
+    def can_see(self, audience: str, owner: str, viewer: str)->bool:
+        if owner == viewer or audience == "public": return True
+        if audience == "friends": return self.is_friend(owner, viewer)
+        if audience == "team": return self.same_team(owner, viewer)
+        return False
+
+    def can_view(self, kind: str, owner: str, viewer: str)->bool:
+        return self.can_see(self.policy.get(owner, {}).get(kind, "private"), owner, viewer)
+
+    # ---------- bulk checks ----------
+    def predicate(self, kind: str, viewer: str)->Callable[[str], bool]:
+        """Fast ``owner -> bool`` test for one viewer, e.g. to filter a leaderboard page."""
+        ids = self.ids; codes = self.audience[kind]; team_of = self.team_of
+        me = ids.get(viewer); buddies = self.friends.get(viewer, ()); team = team_of.get(viewer) or None
+        def visible(owner: str)->bool:
+            i = ids.get(owner)
+            if i is None: return False
+            c = codes[i]
+            return (c == PUBLIC or i == me or (c == FRIENDS and i in buddies)
+                    or (c == TEAM and team is not None and team_of.get(owner) == team))
+        return visible
+
+    def visible_owners(self, kind: str, viewer: str, owners: Iterable[str])->List[str]:
+        """The subset of ``owners`` whose ``kind`` the viewer may see, in input order."""
+        visible = self.predicate(kind, viewer)
+        return [o for o in owners if visible(o)]